@@ -1,68 +1,179 @@
 # Required libraries import
 
 from braket.ahs.atom_arrangement import AtomArrangement
-from braket.aws import AwsDevice
-from braket.devices import Devices
 from braket.timings.time_series import TimeSeries
 from braket.ahs.driving_field import DrivingField
 from braket.ahs.analog_hamiltonian_simulation import AnalogHamiltonianSimulation
-from braket.devices import LocalSimulator
-from braket.aws import AwsQuantumTask
-from braket.aws import AwsSession
-import boto3
 from dotenv import load_dotenv
 import ast  # For safe evaluation of literals
 
 
 from collections import Counter
-import networkx as nx
 import numpy as np
 import os
+import threading
+
+from graph_reduction import GraphReduction, graph_from_coordinates, kernelize
+from register_packing import LOCAL_SIMULATOR_MAX_ATOMS, pack_registers
+from adaptive_shots import adaptive_sample
+from shot_planner import plan_qpu_shots
+from hamiltonian_cache import simulate as simulate_cached
+from run_store import get_run_store
+from shot_matrix import ShotMatrix
+from shot_analytics import analyze_run, total_variation_distance
+from result_stream import ingest_task_result
 
 load_dotenv(dotenv_path='env.local')
 profile_name = os.getenv("profile_name")
-session = boto3.Session(profile_name=profile_name,region_name='us-east-1'))
-aws_session = AwsSession(boto_session=session)
-device_qpu = AwsDevice(Devices.QuEra.Aquila, aws_session=aws_session)
 # quantumComputer = os.getenv('quantumComputer')
 
+# The AWS session and the Aquila device (and the braket.aws / boto3 imports behind them) are
+# created the first time a stage needs them, not when the module is imported
+_aws_session = None
+_device_qpu = None
+_aws_lock = threading.Lock()
 
-def quantum_simulator_execute(nodes,mode):
 
-    a = 7e-6  # grid vertex distance Use same value of the QuEra Training
-    row_max = 4
-    col_max = 4
-    
-    atoms = AtomArrangement()
-    
-    # Add atoms directly using the coordinates from nodes input
-    
-    # Extract the string representation from the tuple
-    #nodes_str = nodes[0]
-    #print(f"Nodes string: {nodes_str}")
-    # Convert string to list using eval
-    try:
-        # Use ast.literal_eval instead of eval for safe parsing of literal structures
-        nodes_list = ast.literal_eval(nodes)
-        
-        # Add atoms for each coordinate pair
-        for node in nodes_list:
-            coord = np.array(node, dtype=float)
-            atoms.add(coord * a)
-            
-    except Exception as e:
-        print(f"Error processing nodes: {e}")
-        return None
-   
+def get_aws_session():
+
+    global _aws_session
+    with _aws_lock:
+        if _aws_session is None:
+            import boto3
+            from braket.aws import AwsSession
+
+            session = boto3.Session(profile_name=profile_name,region_name='us-east-1')
+            _aws_session = AwsSession(boto_session=session)
+    return _aws_session
+
+
+def get_local_simulator():
+
+    # braket.devices pulls in the whole simulator registry, so it is imported on first use
+    from braket.devices import LocalSimulator
+
+    return LocalSimulator("braket_ahs")
+
+
+def get_qpu_device():
+
+    global _device_qpu
+    aws_session = get_aws_session()
+    with _aws_lock:
+        if _device_qpu is None:
+            from braket.aws import AwsDevice
+            from braket.devices import Devices
+
+            _device_qpu = AwsDevice(Devices.QuEra.Aquila, aws_session=aws_session)
+    return _device_qpu
+
+# Status checks of QPU tasks reuse task handles, skip tasks already ended and check many tasks per API call
+_task_status_service = None
+
+def get_task_status_service():
+
+    global _task_status_service
+    aws_session = get_aws_session()
+    with _aws_lock:
+        if _task_status_service is None:
+            from task_status import TaskStatusService
+
+            _task_status_service = TaskStatusService(aws_session)
+    return _task_status_service
+
+def _load_aws_task(task_arn):
+
+    return get_task_status_service().handle(task_arn)
+
+
+def _check_aws_task_states(task_arns):
+
+    return {arn: state.status for arn, state in get_task_status_service().statuses(task_arns).items()}
+
+
+# QPU job queue shared by every session in front of the QuEra submissions: identical programs
+# run once, users take turns and jobs wait while the device is offline.
+# Set qpu_stand_in=true in env.local to run the queue against the local stand-in device.
+# Its database is kept in qpu_queue_dir from env.local (qpu_job_queue.QPU_QUEUE_DIR by default),
+# a directory only the user running the app can access.
+_qpu_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_qpu_queue():
+
+    global _qpu_queue
+    with _queue_lock:
+        if _qpu_queue is None:
+            from qpu_job_queue import QPUJobQueue, QPU_QUEUE_DB_NAME, private_directory
+
+            if os.getenv("qpu_stand_in", "").lower() in ("1", "true", "yes"):
+                from local_device import LocalStandInDevice
+
+                device = LocalStandInDevice()
+                load_task = device.get_task
+                check_states = None
+            else:
+                device = get_qpu_device()
+                load_task = _load_aws_task
+                check_states = _check_aws_task_states
+
+            queue_dir = os.getenv("qpu_queue_dir")
+            _qpu_queue = QPUJobQueue(
+                device,
+                encode_result=lambda result: ShotMatrix.from_measurements(result.measurements).to_json(),
+                load_task=load_task,
+                check_states=check_states,
+                db_path=os.path.join(private_directory(queue_dir), QPU_QUEUE_DB_NAME) if queue_dir else None
+            ).start()
+    return _qpu_queue
+
+# Reductions applied before submitting a register to the QPU, keyed by task ARN,
+# so that quantum_task_get_result can lift the kernel results back to the full graph
+task_reductions = {}
+
+# Graph and schedule of the registers submitted to the QPU, keyed by task ARN, so that
+# quantum_task_get_result can store the run once its shots are fetched
+task_registers = {}
+
+# Packed registers submitted to the QPU, keyed by task ARN, with the reduction of every packed graph
+task_packings = {}
+
+
+def lift_state_counts(most_frequent_regs, reduction):
+    """
+    Expand state labels measured on a kernel register to labels over every atom
+    of the original register, adding the atoms removed by the reduction.
+    """
+    kernel_nodes = sorted(reduction.kernel.nodes)
+    atom_count = reduction.original.number_of_nodes()
+
+    lifted_regs = []
+    for label, count in most_frequent_regs:
+        kernel_states = dict(zip(kernel_nodes, label))
+        solution = reduction.lift(node for node, state in kernel_states.items() if state == "r")
+        full_label = "".join(
+            kernel_states.get(node, "r" if node in solution else "g") for node in range(atom_count)
+        )
+        lifted_regs.append((full_label, count))
+
+    return lifted_regs
+
+
+def create_driving_field():
+
     # Extract QPU values to be used in the program, directly from Braket API
     # We use maximum omega and minimum time ramp value allowed by the QPU in May 2025.
     # In case the QPU evolves and those values changes affecting the algorthim, we'll overwrite those value.
-    capabilities = device_qpu.properties.paradigm
-    cap_ryd = capabilities.dict()['rydberg']
-    omega_max_QPU = float(cap_ryd['rydbergGlobal']['rabiFrequencyRange'][1]) # rad/s
-    time_ramp = float(cap_ryd['rydbergGlobal']['timeDeltaMin'])
     omega_max_QPU = 15800000
     time_ramp = 5e-08
+    # The device is only queried when it was already loaded for a QPU task, a local simulation
+    # does not need an AWS round trip for values it overwrites anyway
+    if _device_qpu is not None:
+        cap_ryd = _device_qpu.properties.paradigm.dict()['rydberg']
+        if float(cap_ryd['rydbergGlobal']['rabiFrequencyRange'][1]) < omega_max_QPU \
+                or float(cap_ryd['rydbergGlobal']['timeDeltaMin']) > time_ramp:
+            print("QPU capabilities changed, the driving field values may no longer be accepted")
     time_ramp_options = [0.8e-6, time_ramp] 
     omega_max_options = [2*np.pi*2.5*1e6, omega_max_QPU]
     delta_max_options = [2*np.pi*6.85*1e6, omega_max_QPU*2.7]
@@ -95,6 +206,94 @@ def quantum_simulator_execute(nodes,mode):
         detuning=delta
     )
 
+    return drive
+
+
+def measurement_state_labels(measurements):
+
+    # Convert every shot to a label with one letter per atom: e (empty site), r (Rydberg) or g (ground)
+    return ShotMatrix.from_measurements(measurements).state_labels()
+
+
+def schedule_parameters(drive):
+
+    # Time series of the driving field, JSON serializable, as stored with every run
+    return {
+        name: {
+            'times': [float(t) for t in field.time_series.times()],
+            'values': [float(v) for v in field.time_series.values()],
+        }
+        for name, field in (('amplitude', drive.amplitude), ('detuning', drive.detuning), ('phase', drive.phase))
+    }
+
+
+def record_run(nodes_list,kernel_nodes,shots,mode,schedule=None,task_arn=None,user_id=None):
+
+    # Keep the full shot data of the run in the run store, a failure to store never fails the run
+    try:
+        graph = graph_from_coordinates(nodes_list)
+        return get_run_store().save_run(
+            nodes_list, shots, mode,
+            kernel_nodes=kernel_nodes, edges=graph.edges, schedule=schedule,
+            task_arn=task_arn, user_id=user_id
+        )
+    except Exception as e:
+        print(f"Could not store the run: {e}")
+        return None
+
+
+def quantum_simulator_execute(nodes,mode,reduce_graph=True,adaptive=False,shots=1000,drive=None):
+
+    a = 7e-6  # grid vertex distance Use same value of the QuEra Training
+    row_max = 4
+    col_max = 4
+    
+    atoms = AtomArrangement()
+    
+    # Add atoms directly using the coordinates from nodes input
+    
+    # Extract the string representation from the tuple
+    #nodes_str = nodes[0]
+    #print(f"Nodes string: {nodes_str}")
+    # Convert string to list using eval
+    try:
+        # Use ast.literal_eval instead of eval for safe parsing of literal structures
+        nodes_list = ast.literal_eval(nodes)
+
+        # Remove the atoms whose state exact MIS reduction rules already fix (leaves,
+        # dominated nodes...), so only the irreducible kernel is simulated. Folding rules
+        # are disabled because folded nodes have no position in the atom arrangement.
+        reduction = None
+        kernel_nodes = list(range(len(nodes_list)))
+        if reduce_graph:
+            reduction = kernelize(graph_from_coordinates(nodes_list), allow_folding=False)
+            kernel_nodes = sorted(reduction.kernel.nodes)
+            print(f"Graph kernel: {len(kernel_nodes)} of {len(nodes_list)} atoms")
+
+            # The QPU run was explicitly requested, so keep the full register when nothing is left
+            if not kernel_nodes and mode == 'QuEra':
+                reduction = None
+                kernel_nodes = list(range(len(nodes_list)))
+
+        # Add atoms for each coordinate pair of the kernel
+        for idx in kernel_nodes:
+            coord = np.array(nodes_list[idx], dtype=float)
+            atoms.add(coord * a)
+            
+    except Exception as e:
+        print(f"Error processing nodes: {e}")
+        return None
+
+    # The reductions solved the whole graph, there is nothing left to simulate
+    if mode in ('simulator', 'cached_simulator', 'emulator') and not kernel_nodes:
+        # Without reductions the graph itself is empty, every shot measures the empty state
+        if reduction is None:
+            return [("", shots)]
+        return lift_state_counts([("", shots)], reduction)
+   
+    # The default schedule unless an optimized one (quantum_optimize_schedule) is given
+    drive = drive or create_driving_field()
+
     # Atom Arrangement and Driving Field creates the QPU Program
    
     ahs_program = AnalogHamiltonianSimulation(
@@ -104,10 +303,10 @@ def quantum_simulator_execute(nodes,mode):
 
     # Simulate QPU with the Program in the local simulator.
     if mode == 'simulator':
-     device = LocalSimulator("braket_ahs")
+     device = get_local_simulator()
      result_simulator = device.run(
         ahs_program,
-        shots=1000
+        shots=shots
      ).result()  # takes about 150 seconds
 
 
@@ -115,17 +314,65 @@ def quantum_simulator_execute(nodes,mode):
 
      show_n_result = 1
 
-     states = ["e", "r", "g"]
-     state_labels = []
-     for shot in result_simulator.measurements:
-        pre = shot.pre_sequence
-        post = shot.post_sequence
-        state_idx = np.array(pre) * (1 + np.array(post))
-        state_labels.append("".join([states[s_idx] for s_idx in state_idx]))
+     shot_matrix = ShotMatrix.from_measurements(result_simulator.measurements)
+     record_run(nodes_list, kernel_nodes, shot_matrix, mode, schedule=schedule_parameters(drive))
+
+     if adaptive:
+        # Consume the shots in increments and stop as soon as the most frequent state is
+        # statistically ahead of the runner-up. The simulator cost is the time evolution,
+        # which does not depend on the shot count, so the shots come from the single run above.
+        shot_stream = iter(shot_matrix.state_labels())
+        report = adaptive_sample(
+           lambda n: [label for _, label in zip(range(n), shot_stream)],
+           max_shots=len(shot_matrix)
+        )
+        print(f"Adaptive sampling used {report.shots_used} shots ({report.stop_reason})")
+        occurence_count = report.counts
+     else:
+        occurence_count = shot_matrix.counts()
 
-     occurence_count = Counter(state_labels)
+     most_frequent_regs = occurence_count.most_common(show_n_result)
+     if reduction is not None:
+        most_frequent_regs = lift_state_counts(most_frequent_regs, reduction)
+     return  most_frequent_regs
+
+    # Same program on the in-process simulator, which builds the interaction and drive operators
+    # once per register geometry and only re-evolves the state when the schedule changes.
+    if mode == 'cached_simulator':
+     coordinates = list(zip(atoms.coordinate_list(0), atoms.coordinate_list(1)))
+     simulation = simulate_cached(coordinates, drive)
+
+     show_n_result = 1
+
+     if adaptive:
+        # Shots are drawn from the final state distribution, so stopping early saves real sampling
+        report = adaptive_sample(simulation.sample, max_shots=shots)
+        print(f"Adaptive sampling used {report.shots_used} shots ({report.stop_reason})")
+        occurence_count = report.counts
+        shot_matrix = ShotMatrix.from_labels(occurence_count.elements())
+     else:
+        shot_matrix = simulation.sample_shots(shots)
+        occurence_count = shot_matrix.counts()
+
+     record_run(nodes_list, kernel_nodes, shot_matrix, mode, schedule=schedule_parameters(drive))
 
      most_frequent_regs = occurence_count.most_common(show_n_result)
+     if reduction is not None:
+        most_frequent_regs = lift_state_counts(most_frequent_regs, reduction)
+     return  most_frequent_regs
+
+    # Classical Monte Carlo preview following the same detuning sweep, for registers too large
+    # for the state vector simulators. Approximate: it has the blockade but no quantum coherence.
+    if mode == 'emulator':
+     from rydberg_annealer import emulate
+
+     coordinates = list(zip(atoms.coordinate_list(0), atoms.coordinate_list(1)))
+     shot_matrix = emulate(coordinates, drive, shots=shots)
+     record_run(nodes_list, kernel_nodes, shot_matrix, mode, schedule=schedule_parameters(drive))
+
+     most_frequent_regs = shot_matrix.counts().most_common(1)
+     if reduction is not None:
+        most_frequent_regs = lift_state_counts(most_frequent_regs, reduction)
      return  most_frequent_regs
     
     if mode == 'QuEra':
@@ -134,7 +381,7 @@ def quantum_simulator_execute(nodes,mode):
      # aquila_qpu = AwsDevice(quantumComputer)
      # print(profile_name)
      # print(device_qpu)
-     aquila_qpu = device_qpu
+     aquila_qpu = get_qpu_device()
      # aquila_qpu = AwsDevice("arn:aws:braket:us-east-1::device/qpu/quera/Aquila",aws_session=aws_session)
 
      # use the same program simulated in the local simulator, but adapt the 
@@ -142,7 +389,7 @@ def quantum_simulator_execute(nodes,mode):
      discretized_ahs_program = ahs_program.discretize(aquila_qpu)
 
      # Launch the Task, retrieve and show ARN of the task and its status.
-     task = aquila_qpu.run(discretized_ahs_program, shots=1000)
+     task = aquila_qpu.run(discretized_ahs_program, shots=shots)
    
      metadata = task.metadata()
      task_arn = metadata['quantumTaskArn']
@@ -151,41 +398,396 @@ def quantum_simulator_execute(nodes,mode):
      print(f"ARN: {task_arn}")
      print(f"status: {task_status}")
 
+     if reduction is not None:
+        task_reductions[task_arn] = reduction
+     task_registers[task_arn] = (nodes_list, kernel_nodes, schedule_parameters(drive))
+
+     return task_arn,task_status
+
+
+def quantum_shot_plan(nodes,target_probability=0.99,reduce_graph=True,safety_factor=None,pilot_shots=1000):
+
+    # Run the program on the local simulator and estimate how many QPU shots are needed to observe
+    # a maximum independent set with the target probability. Pass plan.shots to quantum_simulator_execute.
+    a = 7e-6  # grid vertex distance Use same value of the QuEra Training
+
+    nodes_list = ast.literal_eval(nodes) if isinstance(nodes, str) else nodes
+    graph = graph_from_coordinates(nodes_list)
+    if reduce_graph:
+        # Same kernel as the one quantum_simulator_execute submits
+        graph = kernelize(graph, allow_folding=False).kernel
+
+    kernel_nodes = sorted(graph.nodes)
+    if not kernel_nodes:
+        return plan_qpu_shots(Counter({"": 1}), graph, target_probability, safety_factor)
+
+    atoms = AtomArrangement()
+    for idx in kernel_nodes:
+        atoms.add(np.array(nodes_list[idx], dtype=float) * a)
+
+    ahs_program = AnalogHamiltonianSimulation(
+    register=atoms,
+    hamiltonian=create_driving_field()
+    )
+
+    device = get_local_simulator()
+    result_simulator = device.run(ahs_program, shots=pilot_shots).result()
+    counts = ShotMatrix.from_measurements(result_simulator.measurements).counts()
+
+    plan = plan_qpu_shots(counts, graph, target_probability, safety_factor)
+    print(f"QPU shot plan: {plan.shots} shots, estimated cost ${plan.estimated_cost:.2f}, "
+          f"estimated time {plan.estimated_seconds:.0f}s")
+    return plan
+
+
+def build_kernel_program(nodes_list,reduce_graph=True,keep_full_register=True,drive=None):
+
+    # Program of the atoms left after the exact MIS reductions, as in quantum_simulator_execute.
+    # Returns the program, its driving field, the graph nodes of the atoms and the reduction applied.
+    # drive defaults to create_driving_field(), an optimized schedule can be passed instead.
+    a = 7e-6  # grid vertex distance Use same value of the QuEra Training
+
+    reduction = None
+    kernel_nodes = list(range(len(nodes_list)))
+    if reduce_graph:
+        reduction = kernelize(graph_from_coordinates(nodes_list), allow_folding=False)
+        kernel_nodes = sorted(reduction.kernel.nodes)
+
+        # A device run was explicitly requested, so keep the full register when nothing is left
+        if not kernel_nodes and keep_full_register:
+            reduction = None
+            kernel_nodes = list(range(len(nodes_list)))
+
+    atoms = AtomArrangement()
+    for idx in kernel_nodes:
+        atoms.add(np.array(nodes_list[idx], dtype=float) * a)
+
+    drive = drive or create_driving_field()
+    ahs_program = AnalogHamiltonianSimulation(
+    register=atoms,
+    hamiltonian=drive
+    )
+    return ahs_program, drive, kernel_nodes, reduction
+
+
+def acquire_qpu_submission(user_id,cost=1):
+
+    # QPU runs started from code (backends, decomposed solvers) draw from the same per-user and global
+    # quotas as the app's QuEra button. Raises when the quota is used up. cost reserves the tokens of
+    # several submissions at once, all or none.
+    from rate_limiter import get_quantum_limiter
+
+    limiter = get_quantum_limiter()
+    capacity = min(limiter.max_calls, limiter.global_max_calls or limiter.max_calls)
+    if cost > capacity:
+        raise RuntimeError(f"{cost} QPU submissions exceed the quantum rate limit of {capacity} per "
+                           f"{limiter.time_frame / 3600:.0f} hour(s), split the work into fewer runs")
+
+    decision = limiter.acquire(user_id, cost=cost)
+    if not decision.allowed:
+        raise RuntimeError(f"Rate limit exceeded for quantum operations, retry in about {decision.wait_seconds:.0f}s")
+
+
+def quantum_queue_submit(nodes,user_id,shots=1000,reduce_graph=True,drive=None):
+
+    # Same program as quantum_simulator_execute in QuEra mode, handed to the shared QPU job queue
+    # instead of being run directly. Returns the request id to follow with quantum_queue_status.
+    nodes_list = ast.literal_eval(nodes) if isinstance(nodes, str) else nodes
+
+    ahs_program, drive, kernel_nodes, reduction = build_kernel_program(nodes_list, reduce_graph, drive=drive)
+
+    queue = get_qpu_queue()
+    # Only the real QPU publishes the discretization it expects
+    if hasattr(queue.device, 'properties'):
+        ahs_program = ahs_program.discretize(queue.device)
+
+    # The graph and its reduction travel with the request, two requests can share a program but not their graph
+    context = {
+        'coordinates': [[float(value) for value in coord] for coord in nodes_list],
+        'kernel_nodes': [int(node) for node in kernel_nodes],
+        'reduction': reduction.to_dict() if reduction is not None else None,
+        'schedule': schedule_parameters(drive),
+        'user_id': user_id,
+    }
+    request_id = queue.submit(user_id, ahs_program, shots, context=context)
+
+    status = queue.request_status(request_id)
+    print(f"QPU request {request_id}: {status['status']}, queue position {status['queue_position']}")
+    return request_id
+
+
+def quantum_queue_status(request_id):
+
+    # Status of a queued QPU request: 'queued', 'submitting', 'submitted', 'completed' or 'failed', with the
+    # queue position and the task ARN once it was submitted
+    return get_qpu_queue().request_status(request_id)
+
+
+def quantum_queue_poll_interval(request_state,attempt):
+
+    # Seconds before checking a queued QPU request again: longer the further back it is in the
+    # app's queue or the device's queue, short once its task runs, long while the device is offline
+    from task_status import poll_interval, MIN_POLL_SECONDS
+
+    queue = get_qpu_queue()
+    device_available = queue.device.is_available
+
+    if request_state['status'] == 'queued':
+        return poll_interval('QUEUED', attempt, request_state['queue_position'], device_available)
+    if request_state['task_arn'] is None:
+        # Being submitted, the task ARN comes next
+        return poll_interval('QUEUED', attempt, 0, device_available)
+
+    if queue.check_states is None:
+        # Tasks of the stand-in device have no queue information
+        return poll_interval('RUNNING', attempt, None, device_available)
+
+    # The state seen by another session's poll in the last few seconds is good enough
+    state = get_task_status_service().status(request_state['task_arn'], max_age=MIN_POLL_SECONDS)
+    return poll_interval(state.status, attempt, state.queue_position, device_available)
+
+
+def quantum_queue_get_shots(request_id):
+
+    # Every shot of a completed QPU request: (ShotMatrix, graph nodes of the atoms, reduction or None),
+    # None while it is not completed. The run is stored the first time a request of its job asks.
+    queue = get_qpu_queue()
+    outcome = queue.request_result(request_id)
+    if outcome is None:
+        return None
+    result, context = outcome
+    shot_matrix = ShotMatrix.from_json(result)
+
+    # Every request of a shared job sees the same task, it is stored once
+    task_arn = queue.request_status(request_id)['task_arn']
+    if get_run_store().find_runs(task_arn=task_arn, limit=1) == []:
+        record_run(context['coordinates'], context['kernel_nodes'], shot_matrix, 'QuEra',
+                   schedule=context['schedule'], task_arn=task_arn, user_id=context['user_id'])
+
+    reduction = GraphReduction.from_dict(context['reduction']) if context['reduction'] is not None else None
+    return shot_matrix, context['kernel_nodes'], reduction
+
+
+def quantum_queue_get_result(request_id):
+
+    outcome = quantum_queue_get_shots(request_id)
+    if outcome is None:
+        return None
+    shot_matrix, kernel_nodes, reduction = outcome
+
+    # Collect the results and show the most frequent atom configuration.
+
+    show_n_result = 1
+
+    occurence_count = shot_matrix.counts()
+
+    most_frequent_regs = occurence_count.most_common(show_n_result)
+
+    if reduction is not None:
+        most_frequent_regs = lift_state_counts(most_frequent_regs, reduction)
+    return  most_frequent_regs
+
+
+def quantum_packed_execute(nodes_sets,mode,copies=None,reduce_graph=True,shots=1000):
+
+    # Tile several graphs (or copies of the same one) into a single register and run it as one task.
+    # Each copy yields its own sample per shot, multiplying the effective shot count of the task.
+    # Only the QPU fills its field of view with copies by default, the local simulator runs one copy of each graph.
+    a = 7e-6  # grid vertex distance Use same value of the QuEra Training
+
+    if copies is None and mode != 'QuEra':
+        copies = 1
+
+    try:
+        coordinate_sets = []
+        reductions = []
+        for nodes in nodes_sets:
+            nodes_list = ast.literal_eval(nodes) if isinstance(nodes, str) else nodes
+            reduction = kernelize(graph_from_coordinates(nodes_list), allow_folding=False) if reduce_graph else None
+            kernel_nodes = sorted(reduction.kernel.nodes) if reduction else range(len(nodes_list))
+            coordinate_sets.append([nodes_list[idx] for idx in kernel_nodes])
+            reductions.append(reduction)
+
+        packed = pack_registers(coordinate_sets, copies=copies, lattice_constant=a)
+    except Exception as e:
+        print(f"Error packing nodes: {e}")
+        return None
+
+    if mode != 'QuEra' and len(packed.coordinates) > LOCAL_SIMULATOR_MAX_ATOMS:
+        raise ValueError(f"Packed register of {len(packed.coordinates)} atoms is too large for the local simulator "
+                         f"(at most {LOCAL_SIMULATOR_MAX_ATOMS}), pack fewer graphs or copies")
+
+    if not packed.coordinates:
+        # Every graph was solved by the reductions alone
+        return [lift_state_counts([("", shots)], reduction) if reduction is not None else [("", shots)]
+                for reduction in reductions]
+
+    atoms = AtomArrangement()
+    for coord in packed.coordinates:
+        atoms.add(np.array(coord, dtype=float) * a)
+
+    ahs_program = AnalogHamiltonianSimulation(
+    register=atoms,
+    hamiltonian=create_driving_field()
+    )
+
+    if mode == 'simulator':
+     device = get_local_simulator()
+     result_simulator = device.run(ahs_program, shots=shots).result()
+     return demultiplex_packed_results(
+        measurement_state_labels(result_simulator.measurements), packed, reductions, shots
+     )
+
+    if mode == 'QuEra':
+     aquila_qpu = get_qpu_device()
+     discretized_ahs_program = ahs_program.discretize(aquila_qpu)
+     task = aquila_qpu.run(discretized_ahs_program, shots=shots)
+
+     metadata = task.metadata()
+     task_arn = metadata['quantumTaskArn']
+     task_status = metadata['status']
+
+     print(f"ARN: {task_arn}")
+     print(f"status: {task_status} ({len(packed.slots)} sub-registers)")
+
+     task_packings[task_arn] = (packed, reductions)
      return task_arn,task_status
 
 
+def demultiplex_packed_results(state_labels, packed, reductions, shots, show_n_result=1):
+
+    # Most frequent configurations of every packed graph, lifted back to the full graph when it was reduced
+    results = []
+    for counts, reduction in zip(packed.demultiplex(state_labels), reductions):
+        if not counts:
+            # Graph solved by the reductions alone, it had no atoms in the register
+            counts[""] = shots
+        most_frequent_regs = counts.most_common(show_n_result)
+        if reduction is not None:
+            most_frequent_regs = lift_state_counts(most_frequent_regs, reduction)
+        results.append(most_frequent_regs)
+    return results
+
+
+def quantum_packed_task_get_result(task_arn):
+
+    from braket.aws import AwsQuantumTask
+
+    task = AwsQuantumTask(task_arn,aws_session=get_aws_session())
+    result_aquila = task.result()
+
+    packed, reductions = task_packings[task_arn]
+    return demultiplex_packed_results(
+        measurement_state_labels(result_aquila.measurements), packed, reductions, len(result_aquila.measurements)
+    )
+
+
 def quantum_task_status(task_arn):
 
-    task = AwsQuantumTask(task_arn,aws_session=aws_session)
+    # One GetQuantumTask call on a cached task handle, none once the task has ended
+    return get_task_status_service().status(task_arn).status
 
-    metadata = task.metadata()
-    task_arn = metadata['quantumTaskArn']
-    task_status = metadata['status']
-   
 
-    return task_status
+def quantum_task_statuses(task_arns):
+
+    # Status of many tasks, up to 10 per SearchQuantumTasks call
+    return {arn: state.status for arn, state in get_task_status_service().statuses(task_arns).items()}
 
 
 
 
 def quantum_task_get_result(task_arn):
 
-    task = AwsQuantumTask(task_arn,aws_session=aws_session)
-    result_aquila = task.result()
+    # Shots already fetched once are read back from the run store instead of Braket
+    stored_run = get_run_store().find_by_task(task_arn)
+    if stored_run is not None:
+        shot_matrix = stored_run.shots
+    else:
+        # Read the result from S3 as it downloads, in chunks, rather than decoding the whole document at once
+        try:
+            shot_matrix = ingest_task_result(task_arn, get_aws_session(), keep_shots=True).shots
+        except Exception as e:
+            print(f"Streaming the result failed ({e}), loading it in one piece")
+            from braket.aws import AwsQuantumTask
+
+            task = AwsQuantumTask(task_arn,aws_session=get_aws_session())
+            shot_matrix = ShotMatrix.from_measurements(task.result().measurements)
+
+        if task_arn in task_registers:
+            nodes_list, kernel_nodes, schedule = task_registers[task_arn]
+            record_run(nodes_list, kernel_nodes, shot_matrix, 'QuEra', schedule=schedule, task_arn=task_arn)
 
     # Collect simulation results and show the most frequent atom configuration.
 
     show_n_result = 1
 
-    states = ["e", "r", "g"]
-    state_labels = []
-    for shot in result_aquila.measurements:
-        pre = shot.pre_sequence
-        post = shot.post_sequence
-        state_idx = np.array(pre) * (1 + np.array(post))
-        state_labels.append("".join([states[s_idx] for s_idx in state_idx]))
-
-    occurence_count = Counter(state_labels)
+    occurence_count = shot_matrix.counts()
 
     most_frequent_regs = occurence_count.most_common(show_n_result)
+
+    reduction = task_reductions.get(task_arn)
+    if reduction is not None:
+        most_frequent_regs = lift_state_counts(most_frequent_regs, reduction)
     return  most_frequent_regs
+
+
+def quantum_run_analytics(run_id=None,task_arn=None):
+
+    # Quality of a stored run from all its shots: per-atom Rydberg probabilities, rate of shots
+    # violating the blockade, independent set sizes and approximation ratio against the exact MIS
+    store = get_run_store()
+    stored_run = store.load_run(run_id) if run_id is not None else store.find_by_task(task_arn)
+    if stored_run is None:
+        print(f"No stored run for {run_id or task_arn}")
+        return None
+    return analyze_run(stored_run).as_dict()
+
+
+def quantum_compare_runs(run_id_a,run_id_b):
+
+    # Total variation distance between the state distributions of two runs of the same register,
+    # e.g. the simulator and the QPU runs of a graph
+    store = get_run_store()
+    run_a, run_b = store.load_run(run_id_a), store.load_run(run_id_b)
+    if run_a is None or run_b is None:
+        print(f"No stored run for {run_id_b if run_a is not None else run_id_a}")
+        return None
+    if (not np.array_equal(run_a.coordinates, run_b.coordinates)
+            or not np.array_equal(run_a.kernel_nodes, run_b.kernel_nodes)):
+        print("The runs were not measured on the same register")
+        return None
+    return total_variation_distance(run_a.shots, run_b.shots)
+
+
+def quantum_compare_backends(nodes,backends=('local_ahs','classical_exact'),shots=1000,user_id=None):
+
+    # Run the graph on several backends at the same time ('local_ahs', 'emulator', 'classical_exact',
+    # 'aquila', 'stand_in') and return the most frequent configuration of each, or the error it raised.
+    # 'aquila' goes through the QPU job queue and the quantum rate limit of user_id.
+    import asyncio
+    from quantum_backends import run_backends
+
+    nodes_list = ast.literal_eval(nodes) if isinstance(nodes, str) else nodes
+    results = asyncio.run(run_backends(nodes_list, backends, shots, user_id=user_id))
+    return {
+        name: result.most_common(1) if not isinstance(result, Exception) else f"Error: {result}"
+        for name, result in results.items()
+    }
+
+
+def quantum_optimize_schedule(nodes,objective='mis_probability',reduce_graph=True,max_generations=15,seed=None):
+
+    # Search the detuning and Rabi schedule maximizing the probability of measuring a maximum
+    # independent set (or minimizing the expected MIS energy) of the graph on the cached simulator.
+    # Returns the summary and the DrivingField to pass to quantum_simulator_execute or quantum_queue_submit.
+    from schedule_optimizer import optimize_schedule
+
+    nodes_list = ast.literal_eval(nodes) if isinstance(nodes, str) else nodes
+    result = optimize_schedule(nodes_list, objective=objective, reduce_graph=reduce_graph,
+                               max_generations=max_generations, seed=seed)
+    if result is None:
+        print("The reductions solved the whole graph, there is no schedule to optimize")
+        return None, None
+    print(f"Optimized schedule: MIS probability {result.mis_probability:.3f} "
+          f"(default schedule {result.baseline_mis_probability:.3f})")
+    return result.as_dict(), result.driving_field()
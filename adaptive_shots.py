@@ -0,0 +1,88 @@
+import logging
+import math
+import time
+from collections import Counter
+from statistics import NormalDist
+
+
+logger = logging.getLogger('adaptive_shots')
+
+SHOT_BATCH_SIZE = 100
+MAX_SHOTS = 1000
+CONFIDENCE = 0.95
+
+
+class AdaptiveShotReport:
+    """Outcome of an adaptive sampling run"""
+
+    def __init__(self, counts, shots_used, stop_reason, elapsed_seconds):
+        self.counts = counts
+        self.shots_used = shots_used
+        self.stop_reason = stop_reason  # 'stable', 'time_budget' or 'max_shots'
+        self.elapsed_seconds = elapsed_seconds
+
+    def __repr__(self):
+        return (f"AdaptiveShotReport(shots_used={self.shots_used}, stop_reason='{self.stop_reason}', "
+                f"elapsed_seconds={self.elapsed_seconds:.2f})")
+
+
+def leading_state_margin(counts, confidence=CONFIDENCE):
+    """
+    Lower confidence bound on how much more likely the leading state is than the runner-up.
+
+    For multinomial frequencies p1 and p2 over n shots the difference p1 - p2 has
+    variance (p1 + p2 - (p1 - p2)^2) / n, so a positive bound means the ranking of
+    the top state is statistically stable at the given one-sided confidence.
+    """
+    total = sum(counts.values())
+    if total == 0:
+        return -1.0
+
+    top = counts.most_common(2)
+    p1 = top[0][1] / total
+    p2 = top[1][1] / total if len(top) > 1 else 0.0
+
+    z = NormalDist().inv_cdf(confidence)
+    variance = (p1 + p2 - (p1 - p2) ** 2) / total
+    return (p1 - p2) - z * math.sqrt(max(variance, 0.0))
+
+
+def adaptive_sample(draw, batch_size=SHOT_BATCH_SIZE, max_shots=MAX_SHOTS,
+                    confidence=CONFIDENCE, time_budget=None):
+    """
+    Draw shots in increments until the most frequent state is statistically stable.
+
+    Args:
+        draw: Function taking a number of shots and returning that many state labels
+        batch_size: Shots drawn per increment
+        max_shots: Upper bound on the total number of shots
+        confidence: One-sided confidence required to stop early
+        time_budget: Seconds after which sampling stops, or None for no limit
+
+    Returns:
+        AdaptiveShotReport with the label counts and the number of shots used
+    """
+    start = time.monotonic()
+    counts = Counter()
+    shots_used = 0
+    stop_reason = 'max_shots'
+
+    while shots_used < max_shots:
+        batch = min(batch_size, max_shots - shots_used)
+        labels = draw(batch)
+        counts.update(labels)
+        shots_used += len(labels)
+
+        if leading_state_margin(counts, confidence) > 0:
+            stop_reason = 'stable'
+            break
+        if time_budget is not None and time.monotonic() - start >= time_budget:
+            stop_reason = 'time_budget'
+            break
+        if len(labels) < batch:
+            # The source ran out of shots
+            break
+
+    report = AdaptiveShotReport(counts, shots_used, stop_reason, time.monotonic() - start)
+    logger.info(f"Adaptive sampling: {report}")
+    return report
@@ -3,15 +3,12 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 from bedrock_backend_functions import process_quantum_results,execute_quantum_algorythm,process_image_to_graph,generate_atom_arrangement,modify_network_graph,modify_atom_arrangement
-from Quantum_API import quantum_task_status,quantum_task_get_result
 import uuid
 import time
 import re
-from io import BytesIO
-from PIL import Image
-import hashlib
 
-from secure_file_handler import validate_and_store_file, store_generated_image, get_file_as_bytesio, cleanup_all_files
+from rate_limiter import get_rate_limiter, get_quantum_limiter, client_identity
+from secure_file_handler import validate_and_store_file, store_generated_image, get_file_as_bytesio, cleanup_all_files, release_session_files
 import atexit
 
 import secrets
@@ -47,28 +44,15 @@ def get_aws_client(service_name):
         return None
 
 # Rate Limiting
-class RateLimiter:
-    def __init__(self, max_calls, time_frame):
-        self.max_calls = max_calls
-        self.time_frame = time_frame  # in seconds
-        self.calls = []
-        
-    def is_allowed(self):
-        now = time.time()
-        # Remove old calls
-        self.calls = [call_time for call_time in self.calls if call_time > now - self.time_frame]
-        
-        # Check if under limit
-        if len(self.calls) < self.max_calls:
-            self.calls.append(now)
-            return True
-        return False
-
-# Create rate limiters
-if 'bedrock_limiter' not in st.session_state:
-    st.session_state.bedrock_limiter = RateLimiter(max_calls=10, time_frame=60)  # 10 calls per minute
-if 'quantum_limiter' not in st.session_state:
-    st.session_state.quantum_limiter = RateLimiter(max_calls=5, time_frame=3600)  # 5 calls per hour
+# Token buckets shared by every session and process: each user keeps its own quota, whatever the
+# number of tabs or reloads, and all of them together stay under the account wide limits
+BEDROCK_CALLS_PER_MINUTE = 10       # per user
+BEDROCK_GLOBAL_CALLS_PER_MINUTE = 30
+
+bedrock_limiter = get_rate_limiter('bedrock', max_calls=BEDROCK_CALLS_PER_MINUTE, time_frame=60,
+                                   global_max_calls=BEDROCK_GLOBAL_CALLS_PER_MINUTE)
+# QPU limits (rate_limiter.QUANTUM_CALLS_PER_HOUR) are shared with the code paths that submit to the device
+quantum_limiter = get_quantum_limiter()
 
 # Register temporal file cleanup on application exit
 atexit.register(cleanup_all_files)
@@ -140,22 +124,37 @@ if 'generated_mis_graph' not in st.session_state:
 if 'generated_mis_qera_graph' not in st.session_state:
     st.session_state.generated_mis_qera_graph = None   
                 
-if 'sessionId' not in st.session_state:
+SESSION_TIMEOUT_SECONDS = 3600  # 1 hour
+
+def new_session_id():
     # Generate a secure random token with additional entropy
     random_bytes = secrets.token_bytes(32)
-    session_id = uuid.UUID(bytes=random_bytes[:16])
-    st.session_state.sessionId = str(session_id)
+    return str(uuid.UUID(bytes=random_bytes[:16]))
+
+if 'sessionId' not in st.session_state:
+    st.session_state.sessionId = new_session_id()
     st.session_state.session_created = time.time()
 
-    # Add session expiration check
-    SESSION_TIMEOUT_SECONDS = 3600  # 1 hour
-    if 'session_created' in st.session_state:
-        if time.time() - st.session_state.session_created > SESSION_TIMEOUT_SECONDS:
-            # Reset session
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
-            st.warning("Your session has expired. Please start again.")
-            st.stop()
+# Session expiration check, on every rerun
+if time.time() - st.session_state.session_created > SESSION_TIMEOUT_SECONDS:
+    # Reset session, releasing the stored files it referenced, and continue under a new id
+    release_session_files(st.session_state.sessionId)
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    st.session_state.sessionId = new_session_id()
+    st.session_state.session_created = time.time()
+    st.warning("Your session has expired. Please start again.")
+    st.stop()
+
+def rate_limit_identity():
+    # Rate limits follow the logged in user or the client address, the session id is only a fallback
+    try:
+        user_id = st.user.get('email') if st.user.is_logged_in else None
+    except Exception:
+        user_id = None  # authentication is not configured
+    return client_identity(st.session_state.sessionId, user_id, st.context.headers, st.context.ip_address)
+
+rate_limit_key = rate_limit_identity()
 
 
 if 'generated_graph_nok' not in st.session_state:
@@ -187,7 +186,7 @@ with st.container(key="ContainerFileUploader"):
     
     if uploaded_file is not None:
         # Validate the uploaded file
-        is_valid, error_message, secure_file = validate_and_store_file(uploaded_file)        
+        is_valid, error_message, secure_file = validate_and_store_file(uploaded_file, owner=st.session_state.sessionId)        
         
         if not is_valid:
             st.error(f"Invalid file: {error_message}")
@@ -195,8 +194,8 @@ with st.container(key="ContainerFileUploader"):
             # Store the secure file in session state
             st.session_state.secure_files['current_image'] = secure_file
             # Display the image
-            file_data = secure_file.get_data()
-            st.image(BytesIO(file_data))
+            # Streamlit reads the stored file itself, no copy of the image is kept in the session
+            st.image(secure_file.file_path)
 
             with st.container(key="ContainerGenerateGraph"):  
                 # header that is shown on the web UI
@@ -207,8 +206,9 @@ with st.container(key="ContainerFileUploader"):
                 if result_process_image:
                 # When process impage button being pressed  
                 # 
-                    if not st.session_state.bedrock_limiter.is_allowed():
-                         st.error("Bedrock API rate limit reached. Please wait a moment before trying again.")
+                    bedrock_limit = bedrock_limiter.acquire(rate_limit_key)
+                    if not bedrock_limit.allowed:
+                         st.error(f"Bedrock API rate limit reached. Please wait about {bedrock_limit.wait_seconds:.0f} seconds before trying again.")
                     else:  
                         progress_text = st.success("Calculating the Network Graph, please wait")
                         
@@ -218,7 +218,7 @@ with st.container(key="ContainerFileUploader"):
                         if secure_file and secure_file.verify_integrity():
                         
                         # File integrity verified, proceed with processing
-                        # Get file as BytesIO for processing
+                        # Get file as a memory mapped file object for processing
                             file_obj = get_file_as_bytesio(secure_file)
 
                             # Process the image
@@ -227,7 +227,7 @@ with st.container(key="ContainerFileUploader"):
                             if image_data is not None:
                             
                                 # Store generated image securely
-                                secure_graph = store_generated_image(image_data)
+                                secure_graph = store_generated_image(image_data, owner=st.session_state.sessionId)
                                 st.session_state.secure_files['generated_graph'] = secure_graph
 
                                 st.session_state.generated_graph = image_data
@@ -321,15 +321,16 @@ with st.container(key="ContainerFileUploader"):
                 secure_graph = st.session_state.secure_files.get('generated_graph')
                 if secure_graph and secure_graph.verify_integrity():
                  
-                    if not st.session_state.bedrock_limiter.is_allowed():
-                            st.error("Bedrock API rate limit reached. Please wait a moment before trying again.")
+                    bedrock_limit = bedrock_limiter.acquire(rate_limit_key)
+                    if not bedrock_limit.allowed:
+                            st.error(f"Bedrock API rate limit reached. Please wait about {bedrock_limit.wait_seconds:.0f} seconds before trying again.")
                     else:  
                             text, image_data = generate_atom_arrangement(st.session_state.sessionId)
 
                             # Update session state with the new image data
                             if image_data is not None:
                                 # Store securely
-                                secure_atom = store_generated_image(image_data)
+                                secure_atom = store_generated_image(image_data, owner=st.session_state.sessionId)
                                 st.session_state.secure_files['atom_arrangement'] = secure_atom
 
                                 st.markdown("### Atom Arrangement")
@@ -359,8 +360,9 @@ with st.container(key="ContainerFileUploader"):
                     sanitized_input = sanitize_text_input(user_input)
                     progress_text = st.success("Modifying the Network Graph, please wait")
 
-                    if not st.session_state.bedrock_limiter.is_allowed():
-                            st.error("Bedrock API rate limit reached. Please wait a moment before trying again.")
+                    bedrock_limit = bedrock_limiter.acquire(rate_limit_key)
+                    if not bedrock_limit.allowed:
+                            st.error(f"Bedrock API rate limit reached. Please wait about {bedrock_limit.wait_seconds:.0f} seconds before trying again.")
                     else:  
                             text, image_data = modify_network_graph(sanitized_input, st.session_state.sessionId)
                     
@@ -386,8 +388,9 @@ with st.container(key="ContainerFileUploader"):
                     sanitized_input = sanitize_text_input(user_input)
                     progress_text = st.success("Modifying the Atom Arrangement, please wait")
 
-                    if not st.session_state.bedrock_limiter.is_allowed():
-                            st.error("Bedrock API rate limit reached. Please wait a moment before trying again.")
+                    bedrock_limit = bedrock_limiter.acquire(rate_limit_key)
+                    if not bedrock_limit.allowed:
+                            st.error(f"Bedrock API rate limit reached. Please wait about {bedrock_limit.wait_seconds:.0f} seconds before trying again.")
                     else:  
 
                         text,image_data = modify_atom_arrangement(sanitized_input,st.session_state.sessionId)
@@ -415,14 +418,15 @@ with st.container(key="ContainerFileUploader"):
                  secure_atom = st.session_state.secure_files.get('atom_arrangement')
                  if secure_atom and secure_atom.verify_integrity():
                  
-                    if not st.session_state.bedrock_limiter.is_allowed():
-                            st.error("Bedrock API rate limit reached. Please wait a moment before trying again.")
+                    bedrock_limit = bedrock_limiter.acquire(rate_limit_key)
+                    if not bedrock_limit.allowed:
+                            st.error(f"Bedrock API rate limit reached. Please wait about {bedrock_limit.wait_seconds:.0f} seconds before trying again.")
                     else:  
                             text,image_data = execute_quantum_algorythm("simulator",st.session_state.sessionId)
 
                             if image_data is not None:
                                 # Store securely
-                                secure_mis = store_generated_image(image_data)
+                                secure_mis = store_generated_image(image_data, owner=st.session_state.sessionId)
                                 st.session_state.secure_files['mis_graph'] = secure_mis
 
                                 st.markdown("### MIS Graph calculated on Local simulator")
@@ -450,35 +454,48 @@ with st.container(key="ContainerFileUploader"):
 
                     # Use the rate limiter before expensive operations
 
-                    if not st.session_state.quantum_limiter.is_allowed():
-                          st.error("Rate limit exceeded for quantum operations. Please try again later.")
+                    quantum_limit = quantum_limiter.acquire(rate_limit_key)
+                    if not quantum_limit.allowed:
+                          st.error(f"Rate limit exceeded for quantum operations. Please try again in about {quantum_limit.wait_seconds / 60:.0f} minutes.")
 
                     else:
-                        text,image_data = execute_quantum_algorythm("QuEra",st.session_state.sessionId)
+                        # The Braket SDK is only loaded once a QuEra task is actually requested
+                        from Quantum_API import quantum_queue_status,quantum_queue_get_result,quantum_queue_poll_interval
+
+                        # The request joins the shared QPU queue, identical programs of other sessions run once
+                        request_id = execute_quantum_algorythm("QuEra",st.session_state.sessionId,user_id=rate_limit_key)
 
-                        task_state = quantum_task_status(text)
+                        request_state = quantum_queue_status(request_id)
 
-                        # Implement exponential backoff for status checking
+                        # Poll with intervals adapted to the queue position and the device availability.
+                        # They are short while the task runs, so the limit is a duration rather than a number of attempts
                         attempt = 0
-                        max_attempts = 60
-                        while task_state != "COMPLETED" and attempt < max_attempts:
+                        max_wait_seconds = 2 * 60 * 60
+                        started = time.time()
+                        while request_state['status'] not in ("completed", "failed") and time.time() - started < max_wait_seconds:
                             # Update the existing message in the placeholder
-                            progress_placeholder.success(f"Task status is {task_state}, please wait it can take some minutes (attempt {attempt+1}/{max_attempts})")
+                            waited_minutes = (time.time() - started) / 60
+                            if request_state['status'] in ("queued", "submitting"):
+                                progress_placeholder.success(f"Request queued at position {request_state['queue_position']}, waiting for the QuEra device ({waited_minutes:.0f} min)")
+                            else:
+                                progress_placeholder.success(f"Task {request_state['task_arn']} submitted, please wait it can take some minutes ({waited_minutes:.0f} min)")
                             
-                            # Calculate wait time with exponential backoff, starting at 10 seconds and capping at 2 minutes
-                            wait_time = min(10 * (1.5 ** attempt), 120)
+                            # Wait time adapted to the queue position and the device state, with jitter
+                            wait_time = quantum_queue_poll_interval(request_state, attempt)
                             time.sleep(wait_time)
                             
-                            task_state = quantum_task_status(text)
+                            request_state = quantum_queue_status(request_id)
                             attempt += 1
                             
-                        if task_state != "COMPLETED":
-                            progress_placeholder.error("Maximum attempts reached. Please check if the QuEra device is available or check task status manually in AWS Console.")
+                        if request_state['status'] == "failed":
+                            progress_placeholder.error(f"The QuEra task failed: {request_state['error']}")
+                        elif request_state['status'] != "completed":
+                            progress_placeholder.error("Maximum waiting time reached. Please check if the QuEra device is available or check task status manually in AWS Console.")
                         else:
                          # Update the message one final time when complete
                          progress_placeholder.success("Task Completed!")
                                     
-                         result_aquila = quantum_task_get_result(text)
+                         result_aquila = quantum_queue_get_result(request_id)
                     
                          text,image_data =  process_quantum_results(result_aquila,st.session_state.sessionId)
 
@@ -497,16 +514,20 @@ with st.container(key="ContainerFileUploader"):
 # Show rate limits
 with st.expander(" AWS Services Usage Status"):
     # Calculate remaining calls for Bedrock
-    bedrock_calls_used = len(st.session_state.bedrock_limiter.calls)
-    bedrock_calls_remaining = st.session_state.bedrock_limiter.max_calls - bedrock_calls_used
+    bedrock_status = bedrock_limiter.status(rate_limit_key)
+    bedrock_calls_remaining = bedrock_status.user_remaining
     
     # Calculate remaining calls for Quantum
-    quantum_calls_used = len(st.session_state.quantum_limiter.calls)
-    quantum_calls_remaining = st.session_state.quantum_limiter.max_calls - quantum_calls_used
+    quantum_status = quantum_limiter.status(rate_limit_key)
+    quantum_calls_remaining = quantum_status.user_remaining
     
     # Display status
-    st.write(f"Bedrock API calls remaining: {bedrock_calls_remaining}/{st.session_state.bedrock_limiter.max_calls} (resets every minute)")
-    st.write(f"Bracket API calls remaining: {quantum_calls_remaining}/{st.session_state.quantum_limiter.max_calls} (resets every hour)")
+    st.write(f"Bedrock API calls remaining: {bedrock_calls_remaining}/{bedrock_limiter.max_calls} (refills continuously over a minute)")
+    st.write(f"Bracket API calls remaining: {quantum_calls_remaining}/{quantum_limiter.max_calls} (refills continuously over an hour)")
+    if not bedrock_status.allowed:
+        st.write(f"Next Bedrock call available in about {bedrock_status.wait_seconds:.0f} seconds")
+    if not quantum_status.allowed:
+        st.write(f"Next quantum call available in about {quantum_status.wait_seconds / 60:.0f} minutes")
     
     # Show warning if approaching limits
     if bedrock_calls_remaining < 5:
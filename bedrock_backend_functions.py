@@ -4,20 +4,10 @@ from dotenv import load_dotenv
 import os
 import base64
 import io
-from PIL import Image
 from Prompts import *
 
-
-import networkx as nx
-import numpy as np
-from scipy.optimize import minimize
-from Quantum_API import quantum_simulator_execute
-
-
-
-# libraries for agent
-
-import matplotlib.pyplot as plt
+# PIL, matplotlib, the Braket SDK (through Quantum_API) and the simulation worker pool are
+# imported inside the functions that need them, so the app starts without paying for them
 
 import logging
 
@@ -106,12 +96,27 @@ def modify_atom_arrangement(modify_text,sessionId):
     text,image_data = invoke_agent(f"{PROMPT_MODIFY_ATOM_ARRANGEMENT_GRAPH} {modify_text}", sessionId)
     return text,image_data   
 
-def execute_quantum_algorythm(mode,sessionId):
+def execute_quantum_algorythm(mode,sessionId,plan_shots=False,user_id=None):
+
+    from Quantum_API import quantum_simulator_execute, quantum_shot_plan, quantum_queue_submit
+    from simulation_worker_pool import get_simulation_pool
 
     graph_array,image_blank = invoke_agent(f"{PROMPT_CREATE_INPUT_QUANTUM_EXEC_FUNCTION}",sessionId)
-    result = quantum_simulator_execute(graph_array,mode)
+
+    # Size the QPU task from the simulated distribution instead of always paying for 1000 shots
+    shots = 1000
+    if mode == "QuEra" and plan_shots:
+      shots = quantum_shot_plan(graph_array).shots
+
+    if mode in ("simulator", "cached_simulator", "emulator"):
+      # Local simulations run in the warm worker pool, away from the Streamlit process
+      result = get_simulation_pool().submit(quantum_simulator_execute, graph_array, mode, shots=shots).result()
+    else:
+      # QPU runs go through the shared job queue, the result is the request id to follow.
+      # The queue takes turns between users, so it is keyed on the client identity rather than the session
+      result = quantum_queue_submit(graph_array,user_id or sessionId,shots=shots)
     
-    if mode=="simulator":
+    if mode in ("simulator", "cached_simulator", "emulator"):
       text,image_data = process_quantum_results (result,sessionId) 
       return text,image_data
     else:
@@ -172,6 +177,7 @@ def invoke_agent(inputText,sessionId,showTrace=True, endSession=False):
                     # It the file is a PNG image then we can display it...
                     if type == 'image/png':
                         # Display PNG image using Matplotlib
+                        import matplotlib.pyplot as plt
                         
                         img = plt.imread(io.BytesIO(bytes_data))
 
@@ -208,6 +214,8 @@ def image_base64_encoder(image_name):
     :param image_name: This is the path to the image file that the user has uploaded.
     :return: A base64 string of the image that was uploaded.
     """
+    from PIL import Image
+
     # opening the image file that was uploaded by the user
     open_image = Image.open(image_name)
     # creating a BytesIO object to store the image in memory
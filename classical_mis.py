@@ -0,0 +1,78 @@
+import logging
+
+import networkx as nx
+
+from graph_reduction import kernelize
+
+
+logger = logging.getLogger('classical_mis')
+
+
+def is_independent_set(graph, nodes):
+    """Check that no two of the given nodes are connected"""
+    nodes = set(nodes)
+    return all(not (nodes & set(graph.neighbors(v))) for v in nodes)
+
+
+def repair_independent_set(graph, nodes):
+    """
+    Turn a candidate set (e.g. a noisy quantum measurement) into a maximal independent set.
+
+    Nodes are dropped, highest degree first, until no edge is violated, and the
+    set is then greedily extended with lowest degree nodes that still fit.
+    """
+    solution = {v for v in nodes if v in graph}
+
+    for v in sorted(solution, key=graph.degree, reverse=True):
+        if v in solution and solution & set(graph.neighbors(v)):
+            solution.discard(v)
+
+    for v in sorted(graph.nodes, key=graph.degree):
+        if v not in solution and not (solution & set(graph.neighbors(v))):
+            solution.add(v)
+
+    return solution
+
+
+def solve_mis_exact(graph):
+    """
+    Solve the Maximum Independent Set problem exactly with branch and reduce.
+
+    The graph is kernelized, split into connected components and each
+    component is branched on its highest degree vertex (excluded / included).
+
+    Args:
+        graph: networkx.Graph
+
+    Returns:
+        Set of nodes forming a maximum independent set
+    """
+    reduction = kernelize(graph)
+    kernel = reduction.kernel
+
+    kernel_solution = set()
+    for component in nx.connected_components(kernel):
+        kernel_solution |= _branch(kernel.subgraph(component).copy())
+
+    return reduction.lift(kernel_solution)
+
+
+def _branch(graph):
+    """Exact MIS of a connected, already reduced graph"""
+    if graph.number_of_nodes() == 0:
+        return set()
+
+    v = max(graph.nodes, key=graph.degree)
+
+    without_v = graph.copy()
+    without_v.remove_node(v)
+    best = solve_mis_exact(without_v)
+
+    with_v = graph.copy()
+    with_v.remove_nodes_from(list(graph.neighbors(v)) + [v])
+    candidate = solve_mis_exact(with_v)
+    candidate.add(v)
+
+    if len(candidate) > len(best):
+        best = candidate
+    return best
@@ -0,0 +1,297 @@
+import hashlib
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+
+logger = logging.getLogger('file_metadata_index')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Heap entries made stale by newer access times are compacted away past this ratio
+MAX_STALE_HEAP_RATIO = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size_mb REAL,
+    type TEXT,
+    inode INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    owner TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (path, owner)
+);
+"""
+
+# Owners are session ids, files stored without one are kept under this key in SQLite
+_ANONYMOUS_OWNER = ''
+
+
+def file_fingerprint(file_path):
+    """Cheap identity of a file's current content: (inode, size, mtime in nanoseconds)"""
+    stat = os.stat(file_path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FileMetadataIndex:
+    """
+    Metadata of the stored files, shared by the Streamlit threads and the cleanup job.
+
+    Entries live in memory for fast lookups and are written through to SQLite so
+    they survive restarts. Every access time is also pushed to a min-heap, so
+    finding the expired files costs the number of expired (or stale) heap entries
+    instead of a scan of the whole index. All methods take the index lock.
+    """
+
+    def __init__(self, db_path, storage_dir):
+        self.db_path = db_path
+        self.storage_dir = storage_dir
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._heap = []  # (accessed timestamp, path), stale when the entry was accessed again since
+
+        if not os.path.exists(db_path):
+            # The index names every stored file, keep it as private as the files
+            os.close(os.open(db_path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+
+        self.rebuild()
+
+    # Loading
+
+    def rebuild(self):
+        """
+        Load the index from SQLite and reconcile it with the files in the storage directory.
+        Rows whose file is gone are dropped, files the index does not know (left by a run
+        that stopped before saving its metadata) are added so they expire like any other
+        """
+        with self._lock:
+            self._entries.clear()
+            for path, file_hash, created, accessed, size_mb, file_type, inode, size, mtime_ns in self._db.execute(
+                    "SELECT path, hash, created, accessed, size_mb, type, inode, size, mtime_ns FROM files"):
+                self._entries[path] = {
+                    'hash': file_hash,
+                    'created': datetime.fromtimestamp(created),
+                    'accessed': datetime.fromtimestamp(accessed),
+                    'size_mb': size_mb,
+                    'type': file_type,
+                    'fingerprint': (inode, size, mtime_ns) if inode is not None else None,
+                    'refs': Counter(),
+                }
+            for path, owner, count in self._db.execute("SELECT path, owner, count FROM refs"):
+                if path in self._entries:
+                    self._entries[path]['refs'][None if owner == _ANONYMOUS_OWNER else owner] = count
+
+            missing = [path for path in self._entries if not os.path.isfile(path)]
+            for path in missing:
+                self._remove(path)
+
+            untracked = 0
+            for filename in os.listdir(self.storage_dir):
+                path = os.path.join(self.storage_dir, filename)
+                if path in self._entries or not os.path.isfile(path):
+                    continue
+                try:
+                    modified = datetime.fromtimestamp(os.path.getmtime(path))
+                    self._put(path, {
+                        'hash': _hash_file(path),
+                        'created': modified,
+                        'accessed': modified,
+                        'size_mb': os.path.getsize(path) / (1024 * 1024),
+                        'type': os.path.splitext(filename)[1].lstrip('.') or None,
+                        'fingerprint': file_fingerprint(path),
+                        'refs': Counter(),
+                    })
+                    untracked += 1
+                except OSError as e:
+                    logger.warning(f"Could not index {path}: {str(e)}")
+
+            self._heap = [(entry['accessed'].timestamp(), path) for path, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+        logger.info(f"File metadata index loaded: {len(self._entries)} files, "
+                    f"{len(missing)} missing dropped, {untracked} untracked added")
+
+    # Internal helpers, called with the lock held
+
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN")
+        try:
+            yield
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _put(self, path, entry):
+        fingerprint = entry.get('fingerprint') or (None, None, None)
+        with self._transaction():
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, hash, created, accessed, size_mb, type, inode, size, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, entry['hash'], entry['created'].timestamp(), entry['accessed'].timestamp(),
+                 entry.get('size_mb'), entry.get('type'), *fingerprint)
+            )
+            self._db.execute("DELETE FROM refs WHERE path = ?", (path,))
+            self._db.executemany(
+                "INSERT INTO refs (path, owner, count) VALUES (?, ?, ?)",
+                [(path, _ANONYMOUS_OWNER if owner is None else owner, count)
+                 for owner, count in entry['refs'].items()]
+            )
+        self._entries[path] = entry
+        heapq.heappush(self._heap, (entry['accessed'].timestamp(), path))
+
+    def _remove(self, path):
+        self._entries.pop(path, None)
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _save_refs(self, path, owner):
+        count = self._entries[path]['refs'].get(owner, 0)
+        key = _ANONYMOUS_OWNER if owner is None else owner
+        if count > 0:
+            self._db.execute("INSERT OR REPLACE INTO refs (path, owner, count) VALUES (?, ?, ?)", (path, key, count))
+        else:
+            self._db.execute("DELETE FROM refs WHERE path = ? AND owner = ?", (path, key))
+
+    def _compact_heap(self):
+        if len(self._heap) > MAX_STALE_HEAP_RATIO * max(len(self._entries), 16):
+            self._heap = [(entry['accessed'].timestamp(), path) for path, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    # Lookups
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, path):
+        """Copy of a file's metadata, or None"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            return dict(entry, refs=Counter(entry['refs']))
+
+    def owned_by(self, owner):
+        """Paths of the files an owner holds a reference on"""
+        with self._lock:
+            return [path for path, entry in self._entries.items() if entry['refs'].get(owner)]
+
+    # Changes
+
+    def add(self, path, entry):
+        """Add or replace a file's metadata"""
+        entry = dict(entry, refs=Counter(entry.get('refs') or ()))
+        with self._lock:
+            self._put(path, entry)
+
+    def remove(self, path):
+        with self._lock:
+            self._remove(path)
+
+    def touch(self, path, accessed=None):
+        """Record an access, which pushes the file's expiry back"""
+        accessed = accessed or datetime.now()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return False
+            entry['accessed'] = accessed
+            self._db.execute("UPDATE files SET accessed = ? WHERE path = ?", (accessed.timestamp(), path))
+            heapq.heappush(self._heap, (accessed.timestamp(), path))
+            self._compact_heap()
+            return True
+
+    def set_fingerprint(self, path, fingerprint):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            entry['fingerprint'] = fingerprint
+            self._db.execute("UPDATE files SET inode = ?, size = ?, mtime_ns = ? WHERE path = ?", (*fingerprint, path))
+
+    def add_reference(self, path, owner=None, unless_held=False):
+        """
+        Add a reference for owner, or only make sure it holds one when unless_held is set
+        Returns False if the file is not in the index
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return False
+            if not (unless_held and entry['refs'].get(owner)):
+                entry['refs'][owner] += 1
+                self._save_refs(path, owner)
+            self.touch(path)
+            return True
+
+    def release_reference(self, path, owner=None, all_references=False):
+        """
+        Drop one (or every) reference of owner
+        Returns the references left on the file, None if the file is not in the index
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            refs = entry['refs']
+            refs[owner] = 0 if all_references else refs.get(owner, 0) - 1
+            if refs[owner] <= 0:
+                del refs[owner]
+            self._save_refs(path, owner)
+            return sum(refs.values())
+
+    # Expiry
+
+    def pop_expired(self, cutoff):
+        """
+        Paths last accessed before cutoff (a datetime), oldest first.
+        They leave the expiry heap, call requeue for the ones that could not be deleted
+        """
+        cutoff = cutoff.timestamp()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] < cutoff:
+                accessed, path = heapq.heappop(self._heap)
+                entry = self._entries.get(path)
+                # Stale heap entry: the file was deleted or accessed again since
+                if entry is None or entry['accessed'].timestamp() != accessed:
+                    continue
+                expired.append(path)
+        return expired
+
+    def requeue(self, path):
+        """Put a file back in the expiry heap with its current access time"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                heapq.heappush(self._heap, (entry['accessed'].timestamp(), path))
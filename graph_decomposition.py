@@ -0,0 +1,294 @@
+import logging
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import networkx as nx
+
+from classical_mis import repair_independent_set, solve_mis_exact
+
+
+logger = logging.getLogger('graph_decomposition')
+
+# Largest piece handed to a solver in one go. The local simulator becomes
+# impractical beyond about a dozen atoms.
+MAX_PIECE_SIZE = 12
+
+# Largest separator whose independent subsets are enumerated when stitching
+MAX_SEPARATOR_SIZE = 10
+
+# QPU pieces of callers without a user are queued and rate limited as this one user
+DEFAULT_USER_ID = 'graph_decomposition'
+
+
+def classical_piece_solver(graph):
+    """Solve a piece exactly on the CPU"""
+    return solve_mis_exact(graph)
+
+
+def quantum_piece_solver(graph, mode='simulator', max_attempts=60, user_id=DEFAULT_USER_ID, reserved=False):
+    """
+    Solve a piece on the local simulator (mode='simulator') or on the QuEra QPU (mode='QuEra').
+
+    The piece must come from graph_from_coordinates so that every node carries its
+    atom position. The most frequent measured state is repaired into a maximal
+    independent set, since hardware noise can leave blockade violations. QPU pieces
+    take a token of the user's quantum rate limit, unless reserved says the caller
+    already took it, and go through the shared QPU job queue, like every other
+    submission to the device.
+    """
+    # Imported here so classical-only runs never create Braket sessions in the workers
+    from Quantum_API import quantum_simulator_execute
+
+    nodes = sorted(graph.nodes)
+    if not nodes:
+        return set()
+    if any('pos' not in graph.nodes[v] for v in nodes):
+        raise ValueError("Quantum piece solver needs atom positions on every node")
+
+    coordinates = [list(graph.nodes[v]['pos']) for v in nodes]
+    if mode == 'QuEra':
+        result = _queued_qpu_result(coordinates, user_id, max_attempts, reserved)
+    else:
+        result = quantum_simulator_execute(str(coordinates), mode)
+
+    label = result[0][0] if result else ""
+    measured = {v for v, state in zip(nodes, label) if state == "r"}
+    return repair_independent_set(graph, measured)
+
+
+def _queued_qpu_result(coordinates, user_id, max_attempts, reserved):
+    """Most frequent state of a piece run through the QPU job queue, raises if the run fails"""
+    from Quantum_API import (
+        acquire_qpu_submission, quantum_queue_get_result, quantum_queue_poll_interval, quantum_queue_status,
+        quantum_queue_submit
+    )
+
+    if not reserved:
+        acquire_qpu_submission(user_id)
+    request_id = quantum_queue_submit(coordinates, user_id)
+
+    state = quantum_queue_status(request_id)
+    attempt = 0
+    while state['status'] not in ('completed', 'failed') and attempt < max_attempts:
+        time.sleep(quantum_queue_poll_interval(state, attempt))
+        state = quantum_queue_status(request_id)
+        attempt += 1
+    if state['status'] == 'failed':
+        raise RuntimeError(f"QPU request {request_id} failed: {state['error']}")
+    if state['status'] != 'completed':
+        raise TimeoutError(f"QPU request {request_id} did not complete")
+
+    result = quantum_queue_get_result(request_id)
+    if result is None:
+        raise RuntimeError(f"QPU request {request_id} completed without a result")
+    return result
+
+
+def find_vertex_separator(graph, max_size=MAX_SEPARATOR_SIZE):
+    """
+    Find a small set of nodes whose removal splits a connected graph into balanced parts.
+
+    Uses the breadth-first level structure rooted at a pseudo-peripheral node:
+    every level separates the levels above it from the levels below it, so the
+    smallest level close to the middle is a good separator for the near-planar
+    unit disk graphs produced by atom arrangements.
+
+    Returns:
+        Set of separator nodes, or None if no level of at most max_size nodes
+        leaves two non-empty sides
+    """
+    start = next(iter(graph.nodes))
+    for _ in range(2):
+        distances = nx.single_source_shortest_path_length(graph, start)
+        start = max(distances, key=distances.get)
+
+    distances = nx.single_source_shortest_path_length(graph, start)
+    levels = {}
+    for node, level in distances.items():
+        levels.setdefault(level, set()).add(node)
+
+    total = graph.number_of_nodes()
+    best, best_score = None, None
+    above = 0
+    for level in sorted(levels)[1:-1]:
+        above += len(levels[level - 1])
+        size = len(levels[level])
+        if size > max_size:
+            continue
+        below = total - above - size
+        # Prefer small separators, then balanced sides
+        score = (size, abs(above - below))
+        if best_score is None or score < best_score:
+            best, best_score = levels[level], score
+
+    return best
+
+
+def _independent_subsets(graph, nodes):
+    """Yield every independent subset of the given nodes"""
+    nodes = list(nodes)
+
+    def extend(idx, chosen, blocked):
+        if idx == len(nodes):
+            yield set(chosen)
+            return
+        v = nodes[idx]
+        yield from extend(idx + 1, chosen, blocked)
+        if v not in blocked:
+            chosen.append(v)
+            yield from extend(idx + 1, chosen, blocked | set(graph.neighbors(v)))
+            chosen.pop()
+
+    yield from extend(0, [], frozenset())
+
+
+def _piece_submitter(solver, executor):
+    """
+    submit(graph, piece) running solver on the subgraph of a piece (a frozenset of nodes) in the
+    executor. Pieces are induced subgraphs of the same graph, so every distinct piece runs once
+    even when several separator assignments or recursion branches reach it.
+    """
+    futures = {}
+
+    def submit(graph, piece):
+        if piece not in futures:
+            futures[piece] = executor.submit(solver, graph.subgraph(piece).copy())
+        return futures[piece]
+
+    return submit
+
+
+def count_pieces(graph, max_piece_size=MAX_PIECE_SIZE, max_separator_size=MAX_SEPARATOR_SIZE):
+    """
+    Number of distinct pieces solve_mis_decomposed hands to its solver, i.e. the number of
+    QPU submissions of solver='QuEra'. The split depends on the graph only, so it is found
+    by a dry run answering every piece with an empty set.
+    """
+    pieces = set()
+
+    def record(graph, piece):
+        pieces.add(piece)
+        future = Future()
+        future.set_result(set())
+        return future
+
+    _solve(graph, record, max_piece_size, max_separator_size)
+    return len(pieces)
+
+
+def _solve_pieces(graph, pieces, submit, max_piece_size, max_separator_size):
+    """Solve every piece (a frozenset of nodes), small ones in parallel and large ones recursively"""
+    solutions = {}
+    futures = {}
+    for piece in pieces:
+        if len(piece) <= max_piece_size:
+            futures[piece] = submit(graph, piece)
+        else:
+            solutions[piece] = _solve(graph.subgraph(piece).copy(), submit, max_piece_size, max_separator_size)
+
+    for piece, future in futures.items():
+        solutions[piece] = repair_independent_set(graph.subgraph(piece), future.result())
+    return solutions
+
+
+def _solve(graph, submit, max_piece_size, max_separator_size):
+    """Solve a graph of any size by splitting it along vertex separators"""
+    components = [frozenset(c) for c in nx.connected_components(graph)]
+    small = [c for c in components if len(c) <= max_piece_size]
+    large = [c for c in components if len(c) > max_piece_size]
+
+    solution = set()
+    for piece_solution in _solve_pieces(graph, small, submit, max_piece_size, max_separator_size).values():
+        solution |= piece_solution
+
+    for component in large:
+        subgraph = graph.subgraph(component)
+        separator = find_vertex_separator(subgraph, max_separator_size)
+        if separator is None:
+            raise ValueError(
+                f"No vertex separator of at most {max_separator_size} nodes found for a "
+                f"{len(component)} node component, increase max_separator_size or max_piece_size"
+            )
+
+        # Every assignment of the separator fixes which remaining nodes are blocked,
+        # the pieces left over are solved once and shared between assignments
+        assignments = []
+        pieces = set()
+        for chosen in _independent_subsets(subgraph, separator):
+            blocked = set(separator)
+            for v in chosen:
+                blocked.update(subgraph.neighbors(v))
+            remaining = subgraph.subgraph(component - blocked)
+            parts = [frozenset(c) for c in nx.connected_components(remaining)]
+            assignments.append((chosen, parts))
+            pieces.update(parts)
+
+        logger.info(
+            f"Split {len(component)} nodes on a {len(separator)} node separator: "
+            f"{len(assignments)} assignments, {len(pieces)} distinct pieces"
+        )
+        piece_solutions = _solve_pieces(subgraph, pieces, submit, max_piece_size, max_separator_size)
+
+        best = None
+        for chosen, parts in assignments:
+            candidate = set(chosen)
+            for part in parts:
+                candidate |= piece_solutions[part]
+            if best is None or len(candidate) > len(best):
+                best = candidate
+        solution |= best
+
+    return solution
+
+
+def solve_mis_decomposed(graph, solver='classical', max_piece_size=MAX_PIECE_SIZE,
+                         max_separator_size=MAX_SEPARATOR_SIZE, max_workers=None, user_id=DEFAULT_USER_ID):
+    """
+    Solve the Maximum Independent Set problem on graphs too large for one register.
+
+    The graph is split along small vertex separators until every piece fits in
+    max_piece_size nodes. Pieces are solved independently and in parallel, then
+    stitched by enumerating the independent subsets of each separator and
+    keeping the best combination. The result is exact when the piece solver is.
+
+    Args:
+        graph: networkx.Graph, with 'pos' node attributes for the quantum solvers
+               (see graph_reduction.graph_from_coordinates)
+        solver: 'classical', 'simulator', 'QuEra' or a picklable function
+                taking a graph and returning a set of nodes
+        max_piece_size: Largest piece solved directly
+        max_separator_size: Largest separator enumerated when stitching
+        max_workers: Number of parallel workers
+        user_id: User the QPU pieces are queued and rate limited for. The tokens of every
+                 piece are taken at once before the first submission, so a graph needing more
+                 QPU runs than the user's quota is refused up front rather than partway through
+
+    Returns:
+        Set of nodes forming an independent set of the graph
+    """
+    if solver == 'classical':
+        solver = classical_piece_solver
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    elif solver == 'simulator':
+        solver = partial(quantum_piece_solver, mode='simulator')
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    elif solver == 'QuEra':
+        from Quantum_API import acquire_qpu_submission
+
+        pieces = count_pieces(graph, max_piece_size, max_separator_size)
+        acquire_qpu_submission(user_id, cost=pieces)
+        logger.info(f"Reserved {pieces} QPU submissions for {user_id}")
+        # QPU pieces spend their time waiting on the device, threads are enough
+        solver = partial(quantum_piece_solver, mode='QuEra', user_id=user_id, reserved=True)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    elif callable(solver):
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError(f"Unknown solver: {solver}")
+
+    with executor:
+        solution = _solve(graph, _piece_submitter(solver, executor), max_piece_size, max_separator_size)
+
+    logger.info(f"Decomposed MIS solution: {len(solution)} of {graph.number_of_nodes()} nodes")
+    return solution
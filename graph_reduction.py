@@ -0,0 +1,278 @@
+import logging
+from itertools import combinations, count
+
+import networkx as nx
+import numpy as np
+
+
+logger = logging.getLogger('graph_reduction')
+
+# Atoms closer than this (in grid units, before scaling by the lattice constant)
+# are inside each other's blockade radius and therefore connected in the graph.
+# The atom arrangement prompt places connected nodes at distance 1 and never on
+# diagonals (distance sqrt(2)), so any value in between separates both cases.
+UNIT_DISK_RADIUS = 1.2
+
+
+def graph_from_coordinates(coordinates, radius=UNIT_DISK_RADIUS):
+    """
+    Build the unit disk graph implied by an atom arrangement.
+
+    Args:
+        coordinates: List of [x, y] atom positions in grid units
+        radius: Maximum distance between two connected atoms
+
+    Returns:
+        networkx.Graph with one node per atom (labelled by its index) and a
+        'pos' attribute holding its coordinates
+    """
+    graph = nx.Graph()
+    points = np.array(coordinates, dtype=float).reshape(-1, 2)
+    for idx, point in enumerate(points):
+        graph.add_node(idx, pos=tuple(point))
+
+    for i, j in combinations(range(len(points)), 2):
+        if np.linalg.norm(points[i] - points[j]) <= radius:
+            graph.add_edge(i, j)
+
+    return graph
+
+
+class GraphReduction:
+    """
+    Result of kernelizing a graph for the Maximum Independent Set problem.
+
+    Holds the irreducible kernel and the ordered list of reductions applied,
+    so that any independent set of the kernel can be lifted back to an
+    independent set of the original graph. If the kernel solution is maximum,
+    the lifted solution is maximum too.
+    """
+
+    def __init__(self, graph):
+        self.original = graph
+        self.kernel = graph.copy()
+        self.steps = []
+        # Numbered per reduction, after the folded vertices of the input when it is itself a kernel,
+        # so the labels of a kernel depend on its graph only
+        self._fold_labels = count(1 + max((v[1] for v in graph if _is_fold_label(v)), default=0))
+
+    @property
+    def offset(self):
+        """Number of vertices the reductions add to any lifted solution"""
+        gain = {'include': 1, 'exclude': 0, 'fold': 1, 'twin': 2}
+        return sum(gain[step[0]] for step in self.steps)
+
+    def new_vertex(self):
+        """Label for a vertex created by folding, never clashing with original labels"""
+        return ('fold', next(self._fold_labels))
+
+    def lift(self, kernel_solution):
+        """
+        Map an independent set of the kernel to one of the original graph.
+
+        Args:
+            kernel_solution: Iterable of kernel vertices in the independent set
+
+        Returns:
+            Set of original graph vertices
+        """
+        solution = set(kernel_solution)
+
+        for step in reversed(self.steps):
+            kind = step[0]
+            if kind == 'include':
+                solution.add(step[1])
+            elif kind == 'fold':
+                _, v, neighbours, folded = step
+                if folded in solution:
+                    solution.discard(folded)
+                    solution.update(neighbours)
+                else:
+                    solution.add(v)
+            elif kind == 'twin':
+                _, twins, neighbours, folded = step
+                if folded in solution:
+                    solution.discard(folded)
+                    solution.update(neighbours)
+                else:
+                    solution.update(twins)
+
+        return solution
+
+    def to_dict(self):
+        """JSON serializable form of the reduction, read back with from_dict"""
+        return {
+            'original': _graph_to_dict(self.original),
+            'kernel': _graph_to_dict(self.kernel),
+            'steps': [list(step) for step in self.steps],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        reduction = cls(_graph_from_dict(data['original']))
+        reduction.kernel = _graph_from_dict(data['kernel'])
+        reduction.steps = [_as_label(step) for step in data['steps']]
+        return reduction
+
+
+def _is_fold_label(v):
+    return isinstance(v, tuple) and len(v) == 2 and v[0] == 'fold'
+
+
+def _as_label(value):
+    """Vertex labels and steps read back from JSON: lists become the tuples they were"""
+    return tuple(_as_label(item) for item in value) if isinstance(value, list) else value
+
+
+def _graph_to_dict(graph):
+    return {
+        'nodes': [[v, {key: list(value) if isinstance(value, tuple) else value for key, value in data.items()}]
+                  for v, data in graph.nodes(data=True)],
+        'edges': [[u, v] for u, v in graph.edges],
+    }
+
+
+def _graph_from_dict(data):
+    graph = nx.Graph()
+    for v, attributes in data['nodes']:
+        graph.add_node(_as_label(v), **{key: _as_label(value) for key, value in attributes.items()})
+    graph.add_edges_from((_as_label(u), _as_label(v)) for u, v in data['edges'])
+    return graph
+
+
+def _include(reduction, v):
+    """Put v in the solution and remove its closed neighbourhood"""
+    graph = reduction.kernel
+    reduction.steps.append(('include', v))
+    graph.remove_nodes_from(list(graph.neighbors(v)) + [v])
+
+
+def _exclude(reduction, v):
+    """Remove v, which some maximum independent set avoids"""
+    reduction.steps.append(('exclude', v))
+    reduction.kernel.remove_node(v)
+
+
+def _contract(reduction, vertices, removed):
+    """Replace `vertices` by a single new vertex adjacent to all their neighbours"""
+    graph = reduction.kernel
+    neighbours = set()
+    for u in vertices:
+        neighbours.update(graph.neighbors(u))
+    neighbours.difference_update(vertices)
+    neighbours.difference_update(removed)
+
+    graph.remove_nodes_from(list(vertices) + list(removed))
+    folded = reduction.new_vertex()
+    graph.add_node(folded)
+    graph.add_edges_from((folded, u) for u in neighbours)
+    return folded
+
+
+def _apply_degree_rules(reduction, allow_folding):
+    """Apply the isolated, pendant and degree-2 folding rules once. Returns True if the graph changed"""
+    graph = reduction.kernel
+    changed = False
+
+    for v in list(graph.nodes):
+        if v not in graph:
+            continue
+        degree = graph.degree(v)
+
+        if degree <= 1:
+            # An isolated or pendant vertex is always in some maximum independent set
+            _include(reduction, v)
+            changed = True
+
+        elif degree == 2 and allow_folding:
+            a, b = graph.neighbors(v)
+            if graph.has_edge(a, b):
+                # Triangle: v is dominated by both neighbours, leave it to the domination rule
+                continue
+            folded = _contract(reduction, (a, b), (v,))
+            reduction.steps.append(('fold', v, (a, b), folded))
+            changed = True
+
+    return changed
+
+
+def _apply_domination_rule(reduction):
+    """Remove vertices u that have a neighbour v with N[v] contained in N[u]. Returns True if the graph changed"""
+    graph = reduction.kernel
+    changed = False
+
+    for u in list(graph.nodes):
+        if u not in graph:
+            continue
+        closed_u = set(graph.neighbors(u))
+        closed_u.add(u)
+        for v in graph.neighbors(u):
+            if graph.degree(v) > graph.degree(u):
+                continue
+            closed_v = set(graph.neighbors(v))
+            closed_v.add(v)
+            if closed_v <= closed_u:
+                _exclude(reduction, u)
+                changed = True
+                break
+
+    return changed
+
+
+def _apply_twin_rule(reduction):
+    """Reduce non-adjacent degree-3 vertices sharing the same neighbourhood. Returns True if the graph changed"""
+    graph = reduction.kernel
+    by_neighbourhood = {}
+
+    for v in graph.nodes:
+        if graph.degree(v) == 3:
+            key = frozenset(graph.neighbors(v))
+            if key in by_neighbourhood:
+                u = by_neighbourhood[key]
+                neighbours = tuple(key)
+                if graph.subgraph(neighbours).number_of_edges() > 0:
+                    # Both twins are in some maximum independent set
+                    _include(reduction, u)
+                    _include(reduction, v)
+                else:
+                    folded = _contract(reduction, neighbours, (u, v))
+                    reduction.steps.append(('twin', (u, v), neighbours, folded))
+                return True
+            by_neighbourhood[key] = v
+
+    return False
+
+
+def kernelize(graph, allow_folding=True):
+    """
+    Shrink a graph with exact Maximum Independent Set reduction rules.
+
+    Rules applied until none matches: isolated and pendant vertex inclusion,
+    domination, degree-2 folding and degree-3 twin reduction.
+
+    Folding merges vertices into new ones, so the kernel is no longer an induced
+    subgraph of the input and has no atom positions. Pass allow_folding=False to
+    keep only the rules that delete vertices, when the kernel has to be placed
+    on the original atom coordinates.
+
+    Args:
+        graph: networkx.Graph to reduce, left unmodified
+        allow_folding: Whether to apply the degree-2 folding and twin rules
+
+    Returns:
+        GraphReduction with the kernel and the steps to lift a solution back
+    """
+    reduction = GraphReduction(graph)
+
+    changed = True
+    while changed:
+        changed = _apply_degree_rules(reduction, allow_folding)
+        changed = _apply_domination_rule(reduction) or changed
+        if allow_folding and not changed:
+            changed = _apply_twin_rule(reduction)
+
+    logger.debug(
+        f"Kernelized graph from {graph.number_of_nodes()} to "
+        f"{reduction.kernel.number_of_nodes()} vertices ({len(reduction.steps)} reductions)"
+    )
+    return reduction
@@ -0,0 +1,260 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from scipy.sparse.linalg import expm_multiply
+
+from shot_matrix import ShotMatrix
+
+
+logger = logging.getLogger('hamiltonian_cache')
+
+# Same van der Waals coefficient as the Braket local simulator, in rad * um^6 / us
+RYDBERG_INTERACTION_COEF = 5.42e-24 * 1e36 / 1e6
+
+# Simulation units: microseconds and micrometers, as in the Braket local simulator
+TIME_UNIT = 1e-6
+SPACE_UNIT = 1e-6
+
+# Operator cache limits, least recently used geometries are evicted first
+MAX_CACHED_GEOMETRIES = 32
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+DEFAULT_STEPS = 500
+
+
+class RydbergOperators:
+    """
+    Time independent parts of the Rydberg Hamiltonian of one register geometry.
+
+    H(t) = Omega(t)/2 (e^{i phi(t)} R^dagger + e^{-i phi(t)} R) - Delta(t) N + V
+
+    where R raises one atom from the ground to the Rydberg state, N counts the
+    Rydberg atoms and V is the van der Waals interaction. Only the drive
+    coefficients change between runs on the same register.
+    """
+
+    def __init__(self, configurations, raising, occupation, interaction):
+        self.configurations = configurations  # (states, atoms) array of 0 (g) / 1 (r)
+        self.raising = raising                # sparse R
+        self.occupation = occupation          # diagonal of N
+        self.interaction = interaction        # diagonal of V
+        self.lowering = raising.T.tocsr()     # sparse R^dagger
+        self.rabi = (raising + self.lowering).tocsr()  # drive term for a zero phase
+
+    @property
+    def nbytes(self):
+        sparse_bytes = sum(op.data.nbytes + op.indices.nbytes + op.indptr.nbytes
+                           for op in (self.raising, self.lowering, self.rabi))
+        return self.configurations.nbytes + self.occupation.nbytes + self.interaction.nbytes + sparse_bytes
+
+
+_operator_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _blockade_configurations(positions, blockade_radius):
+    """All 0/1 configurations with no two Rydberg atoms closer than the blockade radius"""
+    atom_count = len(positions)
+    if blockade_radius <= 0:
+        states = np.arange(2 ** atom_count)
+        return ((states[:, None] >> np.arange(atom_count - 1, -1, -1)) & 1).astype(np.int8)
+
+    conflicts = [
+        {j for j in range(atom_count) if j != i and np.linalg.norm(positions[i] - positions[j]) < blockade_radius}
+        for i in range(atom_count)
+    ]
+    configurations = []
+
+    def extend(idx, config, blocked):
+        if idx == atom_count:
+            configurations.append(list(config))
+            return
+        config.append(0)
+        extend(idx + 1, config, blocked)
+        config.pop()
+        if idx not in blocked:
+            config.append(1)
+            extend(idx + 1, config, blocked | conflicts[idx])
+            config.pop()
+
+    extend(0, [], frozenset())
+    return np.array(configurations, dtype=np.int8).reshape(-1, atom_count)
+
+
+def _build_operators(positions, blockade_radius, interaction_coef):
+    """Build the sparse operators of a register, positions in micrometers"""
+    configurations = _blockade_configurations(positions, blockade_radius)
+    state_count, atom_count = configurations.shape
+
+    occupation = configurations.sum(axis=1).astype(float)
+
+    interaction = np.zeros(state_count)
+    for i in range(atom_count):
+        for j in range(i + 1, atom_count):
+            distance = np.linalg.norm(positions[i] - positions[j])
+            interaction += interaction_coef / distance ** 6 * (configurations[:, i] & configurations[:, j])
+
+    # R |c> = sum over atoms in g of |c with that atom in r>, kept only if the target is a valid configuration
+    weights = 1 << np.arange(atom_count - 1, -1, -1)
+    keys = configurations.astype(np.int64) @ weights
+    index_of = dict(zip(keys.tolist(), range(state_count)))
+    rows, cols = [], []
+    for i in range(atom_count):
+        sources = np.nonzero(configurations[:, i] == 0)[0]
+        for source, target_key in zip(sources, (keys[sources] + weights[i]).tolist()):
+            target = index_of.get(target_key)
+            if target is not None:
+                rows.append(target)
+                cols.append(source)
+    raising = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(state_count, state_count))
+
+    return RydbergOperators(configurations, raising, occupation, interaction)
+
+
+def get_operators(coordinates, blockade_radius=0.0, interaction_coef=RYDBERG_INTERACTION_COEF):
+    """
+    Return the operators of a register geometry, building them only on a cache miss.
+
+    Args:
+        coordinates: Atom positions in meters
+        blockade_radius: Blockade radius in meters; configurations with two Rydberg atoms
+                         closer than this are dropped (0 keeps the full Hilbert space)
+        interaction_coef: C6 coefficient in rad * um^6 / us
+
+    Returns:
+        RydbergOperators
+    """
+    positions = np.array(coordinates, dtype=float).reshape(-1, 2) / SPACE_UNIT
+    key = (tuple(np.round(positions, 4).ravel().tolist()), round(blockade_radius / SPACE_UNIT, 4), interaction_coef)
+
+    with _cache_lock:
+        operators = _operator_cache.get(key)
+        if operators is not None:
+            _operator_cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return operators
+        _cache_stats['misses'] += 1
+
+    operators = _build_operators(positions, blockade_radius / SPACE_UNIT, interaction_coef)
+
+    with _cache_lock:
+        _operator_cache[key] = operators
+        _operator_cache.move_to_end(key)
+        while len(_operator_cache) > 1 and (
+            len(_operator_cache) > MAX_CACHED_GEOMETRIES
+            or sum(ops.nbytes for ops in _operator_cache.values()) > MAX_CACHE_BYTES
+        ):
+            _operator_cache.popitem(last=False)
+            _cache_stats['evictions'] += 1
+
+    logger.info(f"Built Rydberg operators for {positions.shape[0]} atoms ({len(operators.occupation)} states)")
+    return operators
+
+
+def cache_info():
+    """Hit, miss and eviction counters plus the current cache size"""
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_operator_cache),
+                    nbytes=sum(ops.nbytes for ops in _operator_cache.values()))
+
+
+def clear_operator_cache():
+    """Drop every cached operator"""
+    with _cache_lock:
+        _operator_cache.clear()
+
+
+def time_series_values(field, times):
+    """Piecewise linear interpolation of a Braket field at the given times (seconds)"""
+    series = field.time_series
+    return np.interp(times, np.array(series.times(), dtype=float), np.array(series.values(), dtype=float))
+
+
+def evolve(operators, drive, steps=DEFAULT_STEPS):
+    """
+    Evolve the all-ground state under a Braket DrivingField.
+
+    The schedule is split into equal steps, each propagated exactly with the
+    Hamiltonian at its midpoint.
+
+    Returns:
+        Final state vector over operators.configurations
+    """
+    duration = float(drive.amplitude.time_series.times()[-1])
+    edges = np.linspace(0.0, duration, steps + 1)
+    midpoints = (edges[:-1] + edges[1:]) / 2
+    dt = (duration / steps) / TIME_UNIT
+
+    # Drive coefficients in rad/us
+    omegas = time_series_values(drive.amplitude, midpoints) * TIME_UNIT
+    deltas = time_series_values(drive.detuning, midpoints) * TIME_UNIT
+    phases = time_series_values(drive.phase, midpoints)
+
+    state = np.zeros(len(operators.occupation), dtype=complex)
+    state[np.nonzero(operators.occupation == 0)[0][0]] = 1.0
+
+    for omega, delta, phi in zip(omegas, deltas, phases):
+        if phi == 0:
+            drive_term = (omega / 2) * operators.rabi
+        else:
+            drive_term = (omega / 2) * (np.exp(1j * phi) * operators.lowering + np.exp(-1j * phi) * operators.raising)
+        hamiltonian = drive_term + diags(operators.interaction - delta * operators.occupation, format='csr')
+        state = expm_multiply(-1j * dt * hamiltonian, state)
+
+    return state
+
+
+class CachedSimulation:
+    """Final state distribution of a run, sampled as many times as needed without evolving again"""
+
+    def __init__(self, operators, state, seed=None):
+        self.operators = operators
+        self.probabilities = np.abs(state) ** 2
+        self.probabilities /= self.probabilities.sum()
+        self._rng = np.random.default_rng(seed)
+        self._labels = np.array(
+            ["".join("r" if bit else "g" for bit in config) for config in operators.configurations]
+        )
+        # Every site is filled, the post sequence is 1 for the atoms left in the ground state
+        n_atoms = operators.configurations.shape[1]
+        self._packed_post = np.packbits(1 - operators.configurations.astype(np.uint8), axis=1)
+        self._packed_pre = np.packbits(np.ones((1, n_atoms), dtype=np.uint8), axis=1)
+
+    def sample(self, shots):
+        """Return `shots` state labels ('r' / 'g' per atom) drawn from the final distribution"""
+        indices = self._rng.choice(len(self.probabilities), size=shots, p=self.probabilities)
+        return self._labels[indices].tolist()
+
+    def sample_shots(self, shots):
+        """ShotMatrix of `shots` shots drawn from the final distribution"""
+        indices = self._rng.choice(len(self.probabilities), size=shots, p=self.probabilities)
+        return ShotMatrix(
+            np.repeat(self._packed_pre, shots, axis=0), self._packed_post[indices],
+            self.operators.configurations.shape[1]
+        )
+
+    def counts(self, shots):
+        """Counter of `shots` sampled state labels"""
+        return self.sample_shots(shots).counts()
+
+
+def simulate(coordinates, drive, blockade_radius=0.0, steps=DEFAULT_STEPS, seed=None):
+    """
+    Simulate a register under a driving field reusing cached operators.
+
+    Args:
+        coordinates: Atom positions in meters
+        drive: braket.ahs.driving_field.DrivingField
+        blockade_radius: Blockade radius in meters, 0 for the full Hilbert space
+        steps: Number of time steps
+        seed: Seed for the shot sampling
+
+    Returns:
+        CachedSimulation
+    """
+    operators = get_operators(coordinates, blockade_radius)
+    return CachedSimulation(operators, evolve(operators, drive, steps), seed)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# Third party libraries and application modules whose import time matters for the app start up
+MODULES = [
+    'streamlit',
+    'boto3',
+    'numpy',
+    'scipy.sparse',
+    'networkx',
+    'matplotlib.pyplot',
+    'PIL.Image',
+    'braket.ahs.analog_hamiltonian_simulation',
+    'braket.devices',
+    'braket.aws',
+    'graph_reduction',
+    'hamiltonian_cache',
+    'simulation_worker_pool',
+    'secure_file_handler',
+    'Quantum_API',
+    'bedrock_backend_functions',
+]
+
+_TIMER = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def time_import(module, repeat=3, detail=False):
+    """
+    Time the import of a module in fresh interpreters, so nothing is already cached in sys.modules.
+
+    Args:
+        module: Dotted module name
+        repeat: Number of fresh interpreters to run, the fastest one is reported
+        detail: Also return the slowest entries of python -X importtime for the module
+
+    Returns:
+        dict with the import time in seconds (None if the import failed), the error and the detail
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    error = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-c', _TIMER.format(module=module)],
+            capture_output=True, text=True, cwd=here
+        )
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed'
+            break
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+
+    report = {'module': module, 'seconds': min(timings) if timings and not error else None, 'error': error}
+
+    if detail and not error:
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, cwd=here
+        )
+        # Lines look like "import time:      self [us] |    cumulative | imported package"
+        entries = []
+        for line in result.stderr.splitlines():
+            parts = line.split('|')
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            entries.append((int(parts[1].strip()), parts[2].strip()))
+        entries.sort(reverse=True)
+        report['slowest'] = [{'module': name, 'cumulative_ms': us / 1000} for us, name in entries[:10]]
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold import time of the application modules')
+    parser.add_argument('modules', nargs='*', help='Modules to time (defaults to the app dependencies)')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per module')
+    parser.add_argument('--detail', action='store_true', help='Show the slowest nested imports')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reports = [time_import(module, args.repeat, args.detail) for module in (args.modules or MODULES)]
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    for report in reports:
+        if report['error']:
+            print(f"{report['module']:<45} failed: {report['error']}")
+            continue
+        print(f"{report['module']:<45} {report['seconds'] * 1000:9.1f} ms")
+        for entry in report.get('slowest', []):
+            print(f"    {entry['module']:<41} {entry['cumulative_ms']:9.1f} ms")
+    print(f"Benchmark finished in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import itertools
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+logger = logging.getLogger('local_device')
+
+STAND_IN_ARN_PREFIX = 'arn:aws:braket:local::quantum-task/stand-in-'
+
+
+class StandInTask:
+    """Quantum task of the stand-in device, with the part of the AwsQuantumTask interface the app uses"""
+
+    def __init__(self, task_id, future, queued_seconds):
+        self.id = task_id
+        self._future = future
+        self._ready_at = time.monotonic() + queued_seconds
+        self._cancelled = False
+
+    def state(self):
+        if self._cancelled:
+            return 'CANCELLED'
+        if time.monotonic() < self._ready_at:
+            return 'QUEUED'
+        if not self._future.done():
+            return 'RUNNING'
+        return 'FAILED' if self._future.exception() else 'COMPLETED'
+
+    def metadata(self):
+        return {'quantumTaskArn': self.id, 'status': self.state()}
+
+    def result(self):
+        delay = self._ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self._future.result()
+
+    def cancel(self):
+        self._cancelled = self._future.cancel() or not self._future.done()
+
+
+class LocalStandInDevice:
+    """
+    Stand-in for the Aquila QPU that runs programs on the Braket local AHS simulator.
+
+    It mimics the parts of AwsDevice that matter for scheduling: availability
+    windows (is_available), a queue delay before a task runs and task handles
+    that are polled by id. Used to exercise the QPU job queue without paying for
+    hardware time.
+
+    Args:
+        availability_windows: List of (start_hour, end_hour) UTC windows when the device
+                              accepts tasks, None for always available
+        queued_seconds: Time a task reports QUEUED before it starts
+        max_concurrent: Tasks simulated at the same time
+    """
+
+    def __init__(self, availability_windows=None, queued_seconds=0.0, max_concurrent=1):
+        self.name = 'Aquila (local stand-in)'
+        self.availability_windows = availability_windows
+        self.queued_seconds = queued_seconds
+        self.online = True  # switch off to simulate a device outage
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='stand-in-device')
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._simulator = None
+
+    @property
+    def is_available(self):
+        if not self.online:
+            return False
+        if not self.availability_windows:
+            return True
+        hour = datetime.now(timezone.utc).hour
+        return any(start <= hour < end for start, end in self.availability_windows)
+
+    def _run_program(self, program, shots):
+        if self._simulator is None:
+            from braket.devices import LocalSimulator
+            self._simulator = LocalSimulator("braket_ahs")
+        return self._simulator.run(program, shots=shots).result()
+
+    def run(self, program, shots):
+        """Queue a program, returns a StandInTask"""
+        if not self.is_available:
+            raise RuntimeError(f"{self.name} is offline")
+        task_id = f"{STAND_IN_ARN_PREFIX}{next(self._counter)}-{uuid.uuid4().hex[:8]}"
+        future = self._executor.submit(self._run_program, program, shots)
+        task = StandInTask(task_id, future, self.queued_seconds)
+        with self._lock:
+            self._tasks[task_id] = task
+        logger.info(f"Stand-in task {task_id} queued with {shots} shots")
+        return task
+
+    def get_task(self, task_id):
+        """Task handle by id, None if this device did not run it"""
+        with self._lock:
+            return self._tasks.get(task_id)
@@ -0,0 +1,423 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger('qpu_job_queue')
+
+# Private to the user running the app (0700): the queue holds what every request asked for
+QPU_QUEUE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qpu_queue')
+QPU_QUEUE_DB_NAME = 'queue.sqlite3'
+
+POLL_INTERVAL_SECONDS = 15
+MAX_IN_FLIGHT_TASKS = 1
+
+# A job claimed for submission that was never marked submitted (the process died during the call) is
+# failed after this long rather than submitted again, as the device may have run it
+SUBMISSION_TIMEOUT_SECONDS = 600
+
+# Results of an identical program are shared with new requests for this long instead of paying for a new task
+RESULT_REUSE_SECONDS = 24 * 3600
+
+TERMINAL_TASK_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    program TEXT NOT NULL,
+    shots INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    task_arn TEXT,
+    created REAL NOT NULL,
+    submitted REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL REFERENCES jobs(job_id),
+    user_id TEXT NOT NULL,
+    context TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_job ON requests (job_id);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    last_served REAL NOT NULL
+);
+"""
+
+
+def program_fingerprint(program_json, shots):
+    """Job id of a program: hash of its canonical IR and the shot count"""
+    canonical = json.dumps(json.loads(program_json), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{canonical}|{shots}".encode()).hexdigest()
+
+
+def private_directory(path):
+    """Create path readable by the current user only, refusing a directory another user controls"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        info = os.stat(path)
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"{path} belongs to another user")
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+def _load_program(program_json):
+    from braket.ahs.analog_hamiltonian_simulation import AnalogHamiltonianSimulation
+    from braket.ir.ahs.program_v1 import Program
+
+    return AnalogHamiltonianSimulation.from_ir(Program.parse_raw(program_json))
+
+
+class QPUJobQueue:
+    """
+    Persistent queue of QPU programs shared by every user of the app.
+
+    Requests for an identical program (same IR and shots) are attached to one job,
+    so the device runs it once and every waiting request gets the same result,
+    including requests arriving after it completed (for RESULT_REUSE_SECONDS).
+    Jobs wait in the queue while the device is not available and are submitted,
+    at most max_in_flight at a time, in round robin order between users: the
+    next job is the oldest one of the user served least recently. Jobs, requests
+    and results are kept in SQLite, so a restart resumes polling the tasks in flight.
+    Several queues (processes) can share the database: a job is claimed in the
+    database before its task is created, so only one of them submits it.
+
+    Args:
+        device: Device with is_available and run(program, shots), e.g. AwsDevice or LocalStandInDevice
+        encode_result: Function turning a task result into JSON serializable data (the stored result)
+        load_task: Function returning a task handle from its ARN, to resume tasks after a restart
+        check_states: Function returning {task ARN: state} for many ARNs in one call, used instead
+                      of asking each task handle for its state
+        db_path: SQLite file of the queue, by default in QPU_QUEUE_DIR
+        max_in_flight: Tasks submitted to the device at the same time
+        poll_interval: Seconds between two scheduling passes of the background thread
+    """
+
+    def __init__(self, device, encode_result, load_task=None, check_states=None, db_path=None,
+                 max_in_flight=MAX_IN_FLIGHT_TASKS, poll_interval=POLL_INTERVAL_SECONDS):
+        self.device = device
+        self.encode_result = encode_result
+        self.load_task = load_task or getattr(device, 'get_task', None)
+        self.check_states = check_states
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+
+        # _lock guards the database connection only, device calls are made without it so status
+        # checks never wait on a submission. _pump_lock keeps scheduling passes one at a time.
+        self._lock = threading.RLock()
+        self._pump_lock = threading.Lock()
+        self._tasks = {}  # job id -> task handle of the jobs in flight
+        self._thread = None
+        self._stop = threading.Event()
+
+        if db_path is None:
+            db_path = os.path.join(private_directory(QPU_QUEUE_DIR), QPU_QUEUE_DB_NAME)
+        if not os.path.exists(db_path):
+            os.close(os.open(db_path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    # Requests
+
+    def submit(self, user_id, program, shots, context=None):
+        """
+        Request a run of program, deduplicated against the queued, running and recent jobs.
+
+        Args:
+            user_id: Requesting user, the key of the round robin (a stable client identity, so that new
+                     tabs and reloads of the same user share their turn)
+            program: AnalogHamiltonianSimulation, already discretized for the device
+            shots: Number of shots
+            context: Optional JSON serializable data stored with the request and returned with its result
+                     (identical programs can come from different requests, e.g. the kernel of different graphs)
+
+        Returns:
+            request id
+        """
+        program_json = program.to_ir().json()
+        job_id = program_fingerprint(program_json, shots)
+        request_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT status, finished FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                reusable = row is not None and (
+                    row[0] in ('queued', 'submitting', 'submitted')
+                    or (row[0] == 'completed' and now - row[1] < RESULT_REUSE_SECONDS)
+                )
+                if row is not None and not reusable:
+                    # A failed or expired run of the program: it moves to an archive id with its requests,
+                    # which keep their status, result and error, and the program is queued again
+                    archive_id = f"{job_id}.{uuid.uuid4().hex[:12]}"
+                    self._db.execute("UPDATE jobs SET job_id = ? WHERE job_id = ?", (archive_id, job_id))
+                    self._db.execute("UPDATE requests SET job_id = ? WHERE job_id = ?", (archive_id, job_id))
+                if not reusable:
+                    self._db.execute(
+                        "INSERT INTO jobs (job_id, program, shots, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                        (job_id, program_json, shots, now)
+                    )
+                self._db.execute(
+                    "INSERT INTO requests (request_id, job_id, user_id, context, created) VALUES (?, ?, ?, ?, ?)",
+                    (request_id, job_id, user_id, None if context is None else json.dumps(context), now)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+        logger.info(f"Request {request_id} of {user_id} for job {job_id[:12]} "
+                    f"({'shared with an existing job' if reusable else 'new job'})")
+        return request_id
+
+    def request_status(self, request_id):
+        """
+        Status of a request: its job state ('queued', 'submitting', 'submitted', 'completed' or 'failed'),
+        task ARN, queue position (0 once claimed for submission)
+        and the number of requests sharing the job. None for an unknown request
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT j.job_id, j.status, j.task_arn, j.error FROM requests r JOIN jobs j ON j.job_id = r.job_id "
+                "WHERE r.request_id = ?", (request_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, status, task_arn, error = row
+            sharing = self._db.execute("SELECT COUNT(*) FROM requests WHERE job_id = ?", (job_id,)).fetchone()[0]
+            position = self._scheduling_order().index(job_id) + 1 if status == 'queued' else 0
+
+        return {
+            'request_id': request_id,
+            'job_id': job_id,
+            'status': status,
+            'task_arn': task_arn,
+            'queue_position': position,
+            'shared_with': sharing - 1,
+            'error': error,
+        }
+
+    def request_result(self, request_id):
+        """(result, context) of a completed request, None while it is not completed"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT j.status, j.result, r.context FROM requests r JOIN jobs j ON j.job_id = r.job_id "
+                "WHERE r.request_id = ?", (request_id,)
+            ).fetchone()
+        if row is None or row[0] != 'completed':
+            return None
+        return json.loads(row[1]), None if row[2] is None else json.loads(row[2])
+
+    def wait(self, request_id, timeout=None, interval=None):
+        """Block until a request completes or fails, returns its final status"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._thread is None:
+                self.pump()
+            status = self.request_status(request_id)
+            if status is None or status['status'] in ('completed', 'failed'):
+                return status
+            if deadline is not None and time.monotonic() >= deadline:
+                return status
+            time.sleep(interval or min(self.poll_interval, 1.0))
+
+    # Scheduling
+
+    def _scheduling_order(self):
+        """Queued job ids in the order they will be submitted. Called with the lock held"""
+        rows = self._db.execute(
+            "SELECT r.job_id, r.user_id, MIN(r.created), COALESCE(u.last_served, 0) "
+            "FROM requests r JOIN jobs j ON j.job_id = r.job_id LEFT JOIN users u ON u.user_id = r.user_id "
+            "WHERE j.status = 'queued' GROUP BY r.job_id, r.user_id"
+        ).fetchall()
+
+        # A job shared by several users is scheduled for the one it suits best
+        candidates = {}
+        for job_id, user_id, first_request, last_served in rows:
+            key = (last_served, first_request, user_id)
+            if job_id not in candidates or key < candidates[job_id]:
+                candidates[job_id] = key
+
+        # Round robin between users: every round takes the next job of each user,
+        # users served least recently first, each user's jobs oldest first
+        per_user = {}
+        for job_id, key in sorted(candidates.items(), key=lambda item: item[1]):
+            per_user.setdefault(key[2], []).append(job_id)
+
+        order = []
+        queues = list(per_user.values())
+        for round_number in range(max(map(len, queues), default=0)):
+            order.extend(queue[round_number] for queue in queues if round_number < len(queue))
+        return order
+
+    def _fail_interrupted_submissions(self):
+        """Fail jobs claimed for submission long ago and never marked submitted"""
+        with self._lock:
+            stale = self._db.execute(
+                "SELECT job_id FROM jobs WHERE status = 'submitting' AND submitted < ?",
+                (time.time() - SUBMISSION_TIMEOUT_SECONDS,)
+            ).fetchall()
+            for (job_id,) in stale:
+                self._finish(job_id, 'failed', error="Submission interrupted, the task may exist on the device",
+                             from_status='submitting')
+
+    def _poll_in_flight(self):
+        with self._lock:
+            in_flight = self._db.execute("SELECT job_id, task_arn FROM jobs WHERE status = 'submitted'").fetchall()
+        states = {}
+        if self.check_states is not None and in_flight:
+            try:
+                states = self.check_states([task_arn for _, task_arn in in_flight])
+            except Exception as e:
+                logger.warning(f"Bulk state check failed, asking each task: {str(e)}")
+
+        for job_id, task_arn in in_flight:
+            task = self._tasks.get(job_id)
+            if task is None and self.load_task is not None:
+                task = self.load_task(task_arn)
+            if task is None:
+                self._finish(job_id, 'failed', error=f"Task {task_arn} could not be found")
+                continue
+            self._tasks[job_id] = task
+
+            state = states.get(task_arn) or task.state()
+            if state not in TERMINAL_TASK_STATES:
+                continue
+            self._tasks.pop(job_id, None)
+            if state == 'COMPLETED':
+                try:
+                    result = json.dumps(self.encode_result(task.result()))
+                except Exception as e:
+                    self._finish(job_id, 'failed', error=f"Could not read the result: {str(e)}")
+                else:
+                    self._finish(job_id, 'completed', result=result)
+            else:
+                self._finish(job_id, 'failed', error=f"Task {task_arn} ended {state}")
+
+    def _finish(self, job_id, status, result=None, error=None, from_status='submitted'):
+        # Only the queue that holds the job in from_status finishes it
+        with self._lock:
+            finished = self._db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE job_id = ? AND status = ?",
+                (status, time.time(), result, error, job_id, from_status)
+            ).rowcount
+            if not finished:
+                return
+            waiting = self._db.execute("SELECT COUNT(*) FROM requests WHERE job_id = ?", (job_id,)).fetchone()[0]
+        logger.info(f"Job {job_id[:12]} {status}, result fanned out to {waiting} requests")
+
+    def _claim_next(self):
+        """
+        Move the next queued job to 'submitting' and return its (job id, program, shots), None when
+        nothing may be submitted. The claim is one IMMEDIATE transaction, so when several queues
+        share the database exactly one of them gets each job.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = None
+                in_flight = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('submitting', 'submitted')").fetchone()[0]
+                order = self._scheduling_order() if in_flight < self.max_in_flight else []
+                if order:
+                    job_id = order[0]
+                    changed = self._db.execute(
+                        "UPDATE jobs SET status = 'submitting', submitted = ? WHERE job_id = ? AND status = 'queued'",
+                        (time.time(), job_id)
+                    ).rowcount
+                    if changed == 1:
+                        program_json, shots = self._db.execute(
+                            "SELECT program, shots FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                        claimed = job_id, program_json, shots
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def _submit_next(self):
+        while True:
+            with self._lock:
+                queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if not queued:
+                return
+            if not self.device.is_available:
+                logger.info(f"Device not available, holding {queued} queued jobs")
+                return
+
+            claimed = self._claim_next()
+            if claimed is None:
+                return
+            job_id, program_json, shots = claimed
+            # The claimed job is 'submitting', no other pass touches it while the device call runs unlocked
+            try:
+                task = self.device.run(_load_program(program_json), shots=shots)
+            except Exception as e:
+                # The device may have gone offline between the check and the submission, retry later
+                if not self.device.is_available:
+                    logger.warning(f"Submission of job {job_id[:12]} deferred: {str(e)}")
+                    with self._lock:
+                        self._db.execute("UPDATE jobs SET status = 'queued', submitted = NULL "
+                                         "WHERE job_id = ? AND status = 'submitting'", (job_id,))
+                    return
+                self._finish(job_id, 'failed', error=f"Submission failed: {str(e)}", from_status='submitting')
+                continue
+
+            now = time.time()
+            self._tasks[job_id] = task
+            with self._lock:
+                self._db.execute("UPDATE jobs SET status = 'submitted', task_arn = ?, submitted = ? WHERE job_id = ?",
+                                 (task.id, now, job_id))
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO users (user_id, last_served) VALUES (?, ?)",
+                    [(user_id, now) for (user_id,) in self._db.execute(
+                        "SELECT DISTINCT user_id FROM requests WHERE job_id = ?", (job_id,)).fetchall()]
+                )
+            logger.info(f"Job {job_id[:12]} submitted as {task.id}")
+
+    def pump(self):
+        """One scheduling pass: collect finished tasks, then submit queued jobs if the device is available"""
+        with self._pump_lock:
+            self._fail_interrupted_submissions()
+            self._poll_in_flight()
+            self._submit_next()
+
+    # Background scheduling
+
+    def start(self):
+        """Run pump every poll_interval seconds on a daemon thread"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='qpu-job-queue')
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.pump()
+            except Exception as e:
+                logger.error(f"QPU queue scheduling pass failed: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=self.poll_interval + 5)
@@ -0,0 +1,397 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import time
+import uuid
+from collections import Counter
+
+from classical_mis import solve_mis_exact
+from graph_reduction import graph_from_coordinates
+from Quantum_API import (
+    acquire_qpu_submission, build_kernel_program, get_local_simulator, lift_state_counts, quantum_queue_get_shots,
+    quantum_queue_poll_interval, quantum_queue_status, quantum_queue_submit, record_run, schedule_parameters
+)
+from shot_matrix import ShotMatrix
+from task_status import TERMINAL_STATES, poll_interval
+
+
+logger = logging.getLogger('quantum_backends')
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+
+STAND_IN_POLL_SECONDS = 0.2
+
+# QPU requests of backends created without a user are queued and rate limited as this one user
+DEFAULT_USER_ID = 'quantum_backends'
+
+
+class BackendResult:
+    """Result of any backend: state counts over every atom of the graph"""
+
+    def __init__(self, backend, counts, shots=None, kernel_nodes=None, task_id=None, elapsed_seconds=0.0,
+                 metadata=None):
+        self.backend = backend
+        self.counts = counts                # Counter of state labels ('e', 'r', 'g') over every graph node
+        self.shots = shots                  # ShotMatrix of the measured atoms, None for classical solvers
+        self.kernel_nodes = kernel_nodes    # graph nodes of the measured atoms
+        self.task_id = task_id
+        self.elapsed_seconds = elapsed_seconds
+        self.metadata = metadata or {}
+
+    @property
+    def n_shots(self):
+        return sum(self.counts.values())
+
+    def most_common(self, n=1):
+        return self.counts.most_common(n)
+
+    def solution(self):
+        """Graph nodes in the Rydberg state in the most frequent label"""
+        if not self.counts:
+            return set()
+        label = self.counts.most_common(1)[0][0]
+        return {node for node, state in enumerate(label) if state == 'r'}
+
+    def __repr__(self):
+        return (f"BackendResult(backend='{self.backend}', shots={self.n_shots}, distinct_states={len(self.counts)}, "
+                f"elapsed_seconds={self.elapsed_seconds:.2f})")
+
+
+def _full_graph_counts(shots_or_counts, reduction):
+    """Counts over every graph node, lifting kernel labels through the reduction"""
+    counts = shots_or_counts.counts() if isinstance(shots_or_counts, ShotMatrix) else shots_or_counts
+    if reduction is None:
+        return Counter(counts)
+    lifted = Counter()
+    for label, count in lift_state_counts(list(counts.items()), reduction):
+        lifted[label] += count
+    return lifted
+
+
+class Backend(ABC):
+    """
+    Asynchronous execution backend for the MIS problem of a graph.
+
+    submit() starts a run on the atom coordinates of a graph and returns a job
+    id right away, status() reports QUEUED, RUNNING, COMPLETED, FAILED or
+    CANCELLED and result() waits for the BackendResult. Blocking SDK calls run
+    in worker threads, so several backends can run concurrently on one event
+    loop.
+
+    Args:
+        reduce_graph: Run the kernel left by the exact MIS reductions
+        user_id: User the runs are stored for, and on the QPU queued and rate limited for
+    """
+
+    name = None
+
+    def __init__(self, reduce_graph=True, user_id=None):
+        self.reduce_graph = reduce_graph
+        self.user_id = user_id
+        self._jobs = {}
+
+    def _job(self, job_id):
+        try:
+            return self._jobs[job_id]
+        except KeyError:
+            raise KeyError(f"Unknown {self.name} job {job_id}") from None
+
+    @abstractmethod
+    async def submit(self, nodes_list, shots=1000):
+        """Start a run, returns its job id"""
+
+    @abstractmethod
+    async def status(self, job_id):
+        """QUEUED, RUNNING, COMPLETED, FAILED or CANCELLED"""
+
+    @abstractmethod
+    async def result(self, job_id):
+        """BackendResult of the job, once it completed"""
+
+    async def run(self, nodes_list, shots=1000):
+        """submit() then result()"""
+        return await self.result(await self.submit(nodes_list, shots))
+
+
+class ThreadedBackend(Backend):
+    """Backend whose whole run is one blocking call, executed in a worker thread"""
+
+    @abstractmethod
+    def _execute(self, nodes_list, shots):
+        """Run synchronously and return a BackendResult"""
+
+    def _timed_execute(self, nodes_list, shots):
+        start = time.monotonic()
+        result = self._execute(nodes_list, shots)
+        result.elapsed_seconds = time.monotonic() - start
+        return result
+
+    async def submit(self, nodes_list, shots=1000):
+        job_id = f"{self.name}-{uuid.uuid4().hex[:12]}"
+        self._jobs[job_id] = asyncio.create_task(asyncio.to_thread(self._timed_execute, nodes_list, shots))
+        return job_id
+
+    async def status(self, job_id):
+        task = self._job(job_id)
+        if not task.done():
+            return RUNNING
+        if task.cancelled():
+            return CANCELLED
+        return FAILED if task.exception() is not None else COMPLETED
+
+    async def result(self, job_id):
+        return await self._job(job_id)
+
+
+class LocalAHSBackend(ThreadedBackend):
+    """Braket local AHS simulator on the graph kernel"""
+
+    name = 'local_ahs'
+
+    def _execute(self, nodes_list, shots):
+        ahs_program, drive, kernel_nodes, reduction = build_kernel_program(
+            nodes_list, self.reduce_graph, keep_full_register=False
+        )
+        if not kernel_nodes:
+            # The reductions solved the whole graph
+            return BackendResult(self.name, _full_graph_counts(Counter({"": shots}), reduction),
+                                 kernel_nodes=kernel_nodes)
+
+        result = get_local_simulator().run(ahs_program, shots=shots).result()
+        shot_matrix = ShotMatrix.from_measurements(result.measurements)
+        record_run(nodes_list, kernel_nodes, shot_matrix, 'simulator', schedule=schedule_parameters(drive),
+                   user_id=self.user_id)
+        return BackendResult(self.name, _full_graph_counts(shot_matrix, reduction), shot_matrix, kernel_nodes)
+
+
+class EmulatorBackend(ThreadedBackend):
+    """Classical Monte Carlo emulator of the register under the same drive, for large graphs"""
+
+    name = 'emulator'
+
+    def _execute(self, nodes_list, shots):
+        from rydberg_annealer import emulate
+
+        ahs_program, drive, kernel_nodes, reduction = build_kernel_program(
+            nodes_list, self.reduce_graph, keep_full_register=False
+        )
+        if not kernel_nodes:
+            return BackendResult(self.name, _full_graph_counts(Counter({"": shots}), reduction),
+                                 kernel_nodes=kernel_nodes)
+
+        register = ahs_program.register
+        coordinates = list(zip(register.coordinate_list(0), register.coordinate_list(1)))
+        shot_matrix = emulate(coordinates, drive, shots=shots)
+        record_run(nodes_list, kernel_nodes, shot_matrix, 'emulator', schedule=schedule_parameters(drive),
+                   user_id=self.user_id)
+        return BackendResult(self.name, _full_graph_counts(shot_matrix, reduction), shot_matrix, kernel_nodes)
+
+
+class ClassicalExactBackend(ThreadedBackend):
+    """Exact MIS by branch and reduce, reported as if every shot measured the optimum"""
+
+    name = 'classical_exact'
+
+    def _execute(self, nodes_list, shots):
+        solution = solve_mis_exact(graph_from_coordinates(nodes_list))
+        label = "".join("r" if node in solution else "g" for node in range(len(nodes_list)))
+        return BackendResult(self.name, Counter({label: shots}), metadata={'mis_size': len(solution)})
+
+
+class _PolledJob:
+    def __init__(self, job_id, nodes_list, task=None, kernel_nodes=None, reduction=None, schedule=None):
+        self.id = job_id
+        self.nodes_list = nodes_list
+        self.task = task
+        self.kernel_nodes = kernel_nodes
+        self.reduction = reduction
+        self.schedule = schedule
+        self.started = time.monotonic()
+        self.state = None   # last state reported by the queue or the device
+        self.result = None
+
+
+class PolledBackend(Backend):
+    """Backend whose runs are tasks outside this process, polled until they end"""
+
+    @abstractmethod
+    def _submit(self, nodes_list, shots):
+        """Start the run, blocking. Returns a _PolledJob"""
+
+    @abstractmethod
+    def _task_state(self, job):
+        """(state, queue position or None) of the job, blocking"""
+
+    @abstractmethod
+    def _poll_delay(self, job, state, queue_position, attempt):
+        """Seconds before checking the job again"""
+
+    @abstractmethod
+    def _collect(self, job):
+        """BackendResult of a completed job, blocking"""
+
+    async def submit(self, nodes_list, shots=1000):
+        job = await asyncio.to_thread(self._submit, nodes_list, shots)
+        self._jobs[job.id] = job
+        logger.info(f"{self.name} job {job.id} submitted with {shots} shots")
+        return job.id
+
+    async def status(self, job_id):
+        job = self._job(job_id)
+        state, _ = await asyncio.to_thread(self._task_state, job)
+        return state
+
+    async def result(self, job_id):
+        job = self._job(job_id)
+        if job.result is not None:
+            return job.result
+
+        attempt = 0
+        while True:
+            state, queue_position = await asyncio.to_thread(self._task_state, job)
+            if state in TERMINAL_STATES:
+                break
+            await asyncio.sleep(self._poll_delay(job, state, queue_position, attempt))
+            attempt += 1
+        if state != COMPLETED:
+            raise RuntimeError(f"{self.name} job {job_id} ended {state}")
+
+        job.result = await asyncio.to_thread(self._collect, job)
+        job.result.elapsed_seconds = time.monotonic() - job.started
+        return job.result
+
+
+class AquilaBackend(PolledBackend):
+    """
+    QuEra Aquila QPU, through the shared QPU job queue: identical programs run
+    once, users take turns, and every submission takes a token of the user's
+    quantum rate limit
+    """
+
+    name = 'aquila'
+
+    # Queue request states as backend states
+    _REQUEST_STATES = {'queued': QUEUED, 'submitting': QUEUED, 'submitted': RUNNING,
+                       'completed': COMPLETED, 'failed': FAILED}
+
+    def _submit(self, nodes_list, shots):
+        user_id = self.user_id if self.user_id is not None else DEFAULT_USER_ID
+        acquire_qpu_submission(user_id)
+        request_id = quantum_queue_submit(nodes_list, user_id, shots=shots, reduce_graph=self.reduce_graph)
+        return _PolledJob(request_id, nodes_list)
+
+    def _task_state(self, job):
+        job.state = quantum_queue_status(job.id)
+        if job.state['status'] == 'failed':
+            logger.warning(f"{self.name} job {job.id} failed: {job.state['error']}")
+        return self._REQUEST_STATES[job.state['status']], job.state['queue_position']
+
+    def _poll_delay(self, job, state, queue_position, attempt):
+        return quantum_queue_poll_interval(job.state, attempt)
+
+    def _collect(self, job):
+        # The queue stores the run, once for every request sharing the task
+        shot_matrix, kernel_nodes, reduction = quantum_queue_get_shots(job.id)
+        return BackendResult(self.name, _full_graph_counts(shot_matrix, reduction), shot_matrix, kernel_nodes,
+                             task_id=job.state['task_arn'])
+
+
+class DeviceBackend(PolledBackend):
+    """Backend submitting AHS programs to a device object and polling the task"""
+
+    mode = 'QuEra'  # mode of the runs in the run store
+
+    def __init__(self, device=None, reduce_graph=True, user_id=None):
+        super().__init__(reduce_graph, user_id)
+        self._device = device
+
+    @property
+    def device(self):
+        if self._device is None:
+            self._device = self._default_device()
+        return self._device
+
+    @abstractmethod
+    def _default_device(self):
+        """Device used when none is given"""
+
+    @abstractmethod
+    def _fetch_shots(self, job):
+        """ShotMatrix of a completed task, blocking"""
+
+    def _poll_delay(self, job, state, queue_position, attempt):
+        return poll_interval(state, attempt, queue_position, self.device.is_available)
+
+    def _submit(self, nodes_list, shots):
+        ahs_program, drive, kernel_nodes, reduction = build_kernel_program(nodes_list, self.reduce_graph)
+        # Only the real QPU publishes the discretization it expects
+        if hasattr(self.device, 'properties'):
+            ahs_program = ahs_program.discretize(self.device)
+        task = self.device.run(ahs_program, shots=shots)
+        return _PolledJob(task.id, nodes_list, task, kernel_nodes, reduction, schedule_parameters(drive))
+
+    def _collect(self, job):
+        shot_matrix = self._fetch_shots(job)
+        record_run(job.nodes_list, job.kernel_nodes, shot_matrix, self.mode, schedule=job.schedule,
+                   task_arn=job.id, user_id=self.user_id)
+        return BackendResult(self.name, _full_graph_counts(shot_matrix, job.reduction), shot_matrix,
+                             job.kernel_nodes, task_id=job.id)
+
+
+class StandInBackend(DeviceBackend):
+    """Local stand-in for Aquila: the Braket local simulator behind a device and task interface"""
+
+    name = 'stand_in'
+
+    def _default_device(self):
+        from local_device import LocalStandInDevice
+
+        return LocalStandInDevice()
+
+    def _task_state(self, job):
+        return job.task.state(), None
+
+    def _poll_delay(self, job, state, queue_position, attempt):
+        return STAND_IN_POLL_SECONDS
+
+    def _fetch_shots(self, job):
+        return ShotMatrix.from_measurements(job.task.result().measurements)
+
+
+BACKENDS = {
+    backend.name: backend for backend in (
+        LocalAHSBackend, EmulatorBackend, ClassicalExactBackend, AquilaBackend, StandInBackend
+    )
+}
+
+
+def get_backend(name, **kwargs):
+    """New backend by name: 'local_ahs', 'emulator', 'classical_exact', 'aquila' or 'stand_in'"""
+    try:
+        return BACKENDS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown backend {name}, expected one of {', '.join(BACKENDS)}") from None
+
+
+async def run_backends(nodes_list, backends, shots=1000, user_id=None):
+    """
+    Run the same graph on several backends concurrently.
+
+    Args:
+        nodes_list: Atom coordinates of the graph (grid units)
+        backends: Backend instances or names
+        shots: Shots per backend
+        user_id: User of the backends created from names
+
+    Returns:
+        Dictionary of backend name to BackendResult, or to the exception its run raised
+    """
+    backends = [get_backend(backend, user_id=user_id) if isinstance(backend, str) else backend for backend in backends]
+    results = await asyncio.gather(
+        *(backend.run(nodes_list, shots) for backend in backends), return_exceptions=True
+    )
+    return {backend.name: result for backend, result in zip(backends, results)}
@@ -0,0 +1,205 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger('rate_limiter')
+
+# Shared by every session and process of the app on this host
+RATE_LIMIT_DB_PATH = os.path.join(tempfile.gettempdir(), 'bedrock_braket_rate_limits.sqlite3')
+
+# Buckets of users idle for this many time frames are full again and their rows are dropped
+IDLE_BUCKET_TIME_FRAMES = 2
+PRUNE_EVERY_CALLS = 1000
+
+# QPU submissions, whether they come from the app or from code (backends, decomposed solvers)
+QUANTUM_CALLS_PER_HOUR = 5          # per user
+QUANTUM_GLOBAL_CALLS_PER_HOUR = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated);
+"""
+
+
+class RateLimitDecision:
+    """Result of a rate limit check"""
+
+    def __init__(self, allowed, wait_seconds, user_remaining, global_remaining):
+        self.allowed = allowed
+        self.wait_seconds = wait_seconds          # estimated wait until the call would be allowed
+        self.user_remaining = user_remaining      # whole calls left in the user's bucket
+        self.global_remaining = global_remaining  # whole calls left in the shared bucket, None without one
+
+    def __bool__(self):
+        return self.allowed
+
+    def __repr__(self):
+        return (f"RateLimitDecision(allowed={self.allowed}, wait_seconds={self.wait_seconds:.1f}, "
+                f"user_remaining={self.user_remaining}, global_remaining={self.global_remaining})")
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket rate limiter with a per-user and an optional global bucket, stored in SQLite.
+
+    A bucket holds up to max_calls tokens and refills continuously at
+    max_calls / time_frame tokens per second. A call is allowed when both the
+    user's bucket and the global bucket hold a token, and then takes one from
+    each. Buckets are rows refilled lazily from their last update time, so a
+    check is two primary key lookups in one IMMEDIATE transaction whatever the
+    number of past calls, and the limits hold across sessions and processes.
+    clock returns the current time in seconds, time.time unless a test injects another.
+    """
+
+    def __init__(self, name, max_calls, time_frame, global_max_calls=None, global_time_frame=None,
+                 db_path=RATE_LIMIT_DB_PATH, clock=time.time):
+        self.name = name
+        self.max_calls = max_calls
+        self.time_frame = time_frame  # in seconds
+        self.global_max_calls = global_max_calls
+        self.global_time_frame = global_time_frame or time_frame
+        self.db_path = db_path
+        self.clock = clock
+
+        self._local = threading.local()
+        self._calls = 0
+
+        if not os.path.exists(db_path):
+            os.close(os.open(db_path, os.O_WRONLY | os.O_CREAT, 0o600))
+        db = self._connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(_SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections are not shared between threads, one per thread
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def _buckets(self, user_id):
+        """(key, capacity, refill per second) of the buckets a call of user_id draws from"""
+        buckets = [(f"{self.name}:user:{user_id}", self.max_calls, self.max_calls / self.time_frame)]
+        if self.global_max_calls:
+            buckets.append((f"{self.name}:global", self.global_max_calls,
+                            self.global_max_calls / self.global_time_frame))
+        return buckets
+
+    def _check(self, user_id, cost, consume):
+        buckets = self._buckets(user_id)
+        now = self.clock()
+        db = self._connection()
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            stored = dict(
+                (key, (tokens, updated)) for key, tokens, updated in db.execute(
+                    f"SELECT key, tokens, updated FROM buckets WHERE key IN ({','.join('?' * len(buckets))})",
+                    [key for key, _, _ in buckets]
+                )
+            )
+
+            levels = []
+            for key, capacity, rate in buckets:
+                tokens, updated = stored.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + max(0.0, now - updated) * rate))
+
+            allowed = all(level >= cost for level in levels)
+            if allowed and consume:
+                levels = [level - cost for level in levels]
+                db.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    [(key, level, now) for (key, _, _), level in zip(buckets, levels)]
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        wait_seconds = 0.0 if allowed else max(
+            (cost - level) / rate for (_, _, rate), level in zip(buckets, levels) if level < cost
+        )
+        return RateLimitDecision(
+            allowed, wait_seconds, int(levels[0]),
+            int(levels[1]) if len(levels) > 1 else None
+        )
+
+    def acquire(self, user_id, cost=1):
+        """
+        Take cost tokens for a call of user_id if both buckets allow it
+        Returns a RateLimitDecision, with the estimated wait when the call is refused
+        """
+        decision = self._check(user_id, cost, consume=True)
+        if not decision.allowed:
+            logger.info(f"Rate limit {self.name} refused a call of {user_id}, retry in {decision.wait_seconds:.1f}s")
+
+        self._calls += 1
+        if self._calls % PRUNE_EVERY_CALLS == 0:
+            self.prune()
+        return decision
+
+    def is_allowed(self, user_id):
+        """Same as acquire, as a boolean"""
+        return self.acquire(user_id).allowed
+
+    def status(self, user_id):
+        """Current state of the buckets of user_id, without taking a token"""
+        return self._check(user_id, 1, consume=False)
+
+    def prune(self):
+        """Drop the rows of buckets idle long enough to be full again"""
+        cutoff = self.clock() - IDLE_BUCKET_TIME_FRAMES * max(self.time_frame, self.global_time_frame)
+        self._connection().execute(
+            "DELETE FROM buckets WHERE key LIKE ? AND updated < ?", (f"{self.name}:%", cutoff)
+        )
+
+
+def client_identity(session_id, user_id=None, headers=None, ip_address=None):
+    """
+    Key of a client's per-user buckets: the authenticated user, else the client
+    address, else the session id. A session id alone is renewed by every new
+    tab or reload, which would hand out a fresh quota each time.
+    """
+    if user_id:
+        return f"user:{user_id}"
+    # Proxies in front of the app appending the client address to X-Forwarded-For (trusted_proxy_hops
+    # in env.local). Without any, the header, which clients can set, is ignored
+    proxy_hops = int(os.getenv('trusted_proxy_hops') or 0)
+    forwarded = (headers or {}).get('X-Forwarded-For') if proxy_hops else None
+    if forwarded:
+        addresses = [address.strip() for address in forwarded.split(',') if address.strip()]
+        if addresses:
+            # The entry added by the farthest trusted proxy, the ones before it come from the client
+            return f"ip:{addresses[-min(proxy_hops, len(addresses))]}"
+    if ip_address:
+        return f"ip:{ip_address}"
+    return f"session:{session_id}"
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, max_calls, time_frame, global_max_calls=None, global_time_frame=None):
+    """Process-wide limiter for name, created on first use"""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = TokenBucketLimiter(name, max_calls, time_frame, global_max_calls, global_time_frame)
+            _limiters[name] = limiter
+        return limiter
+
+
+def get_quantum_limiter():
+    """Limiter of the QPU submissions, shared by the app and every programmatic path to the device"""
+    return get_rate_limiter('quantum', max_calls=QUANTUM_CALLS_PER_HOUR, time_frame=3600,
+                            global_max_calls=QUANTUM_GLOBAL_CALLS_PER_HOUR)
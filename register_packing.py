@@ -0,0 +1,135 @@
+import logging
+from collections import Counter
+
+import numpy as np
+
+
+logger = logging.getLogger('register_packing')
+
+# Aquila field of view and capacity (from the device properties in May 2025)
+AQUILA_FIELD_WIDTH = 75e-6  # meters
+AQUILA_FIELD_HEIGHT = 76e-6  # meters
+AQUILA_MAX_ATOMS = 256
+
+# The local simulator evolves the full state vector, 2^n amplitudes for n atoms,
+# so packed registers run locally stay small
+LOCAL_SIMULATOR_MAX_ATOMS = 12
+
+# Empty grid units left between the bounding boxes of two sub-registers. At three
+# lattice constants the van der Waals interaction between neighbouring
+# sub-registers is 3^6 = 729 times weaker than along an edge, so they evolve
+# independently.
+SUB_REGISTER_GAP = 3
+
+
+class PackedRegister:
+    """
+    Several atom arrangements tiled into a single register.
+
+    Each slot records which input graph it holds and the range of atom indices it
+    occupies in the packed register, so that every measured shot can be split back
+    into one shot per sub-register.
+    """
+
+    def __init__(self, graph_count):
+        self.graph_count = graph_count
+        self.coordinates = []
+        self.slots = []  # (graph index, first atom, last atom + 1)
+
+    def add(self, graph_index, coordinates):
+        """Append a sub-register whose coordinates are already placed in the packed grid"""
+        start = len(self.coordinates)
+        self.coordinates.extend(coordinates)
+        self.slots.append((graph_index, start, len(self.coordinates)))
+
+    def copies(self, graph_index):
+        """Number of copies of a graph present in the register"""
+        return sum(1 for idx, _, _ in self.slots if idx == graph_index)
+
+    def demultiplex(self, state_labels):
+        """
+        Split full-register state labels into per-graph counts.
+
+        Every copy of a graph contributes its own sample, so a task of N shots
+        yields N * copies samples for each graph.
+
+        Args:
+            state_labels: Iterable of state labels, one letter per atom of the packed register
+
+        Returns:
+            List with one Counter of sub-register labels per input graph
+        """
+        counts = [Counter() for _ in range(self.graph_count)]
+        for label in state_labels:
+            for graph_index, start, stop in self.slots:
+                counts[graph_index][label[start:stop]] += 1
+        return counts
+
+
+def pack_registers(coordinate_sets, copies=None, lattice_constant=7e-6,
+                   field_width=AQUILA_FIELD_WIDTH, field_height=AQUILA_FIELD_HEIGHT,
+                   max_atoms=AQUILA_MAX_ATOMS, gap=SUB_REGISTER_GAP):
+    """
+    Tile several atom arrangements into one register with safe blockade spacing.
+
+    Sub-registers are placed row by row (shelf packing), one copy of every graph
+    per round, until `copies` rounds are placed or the field of view is full.
+
+    Args:
+        coordinate_sets: List of atom arrangements, each a list of [x, y] in grid units
+        copies: Copies of each graph to place, or None to fill the field of view
+        lattice_constant: Meters per grid unit
+        field_width: Usable register width in meters
+        field_height: Usable register height in meters
+        max_atoms: Maximum number of atoms in the register
+        gap: Empty grid units between sub-registers
+
+    Returns:
+        PackedRegister with coordinates in grid units
+    """
+    width_limit = field_width / lattice_constant
+    height_limit = field_height / lattice_constant
+
+    shapes = []
+    for coordinates in coordinate_sets:
+        points = np.array(coordinates, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            shapes.append((points, 0.0, 0.0))
+            continue
+        points = points - points.min(axis=0)
+        width, height = points.max(axis=0)
+        if width > width_limit or height > height_limit:
+            raise ValueError(f"Atom arrangement of {width}x{height} grid units does not fit in the field of view")
+        shapes.append((points, width, height))
+
+    packed = PackedRegister(len(coordinate_sets))
+    x = y = shelf_height = 0.0
+    rounds = 0
+
+    while copies is None or rounds < copies:
+        placed = 0
+        for graph_index, (points, width, height) in enumerate(shapes):
+            if len(points) == 0 or len(packed.coordinates) + len(points) > max_atoms:
+                continue
+            if x + width > width_limit:
+                x, y, shelf_height = 0.0, y + shelf_height + gap, 0.0
+            if y + height > height_limit:
+                continue
+            packed.add(graph_index, (points + [x, y]).tolist())
+            x += width + gap
+            shelf_height = max(shelf_height, height)
+            placed += 1
+
+        if placed == 0:
+            break
+        rounds += 1
+
+    for graph_index, (points, _, _) in enumerate(shapes):
+        if len(points) and packed.copies(graph_index) == 0:
+            raise ValueError(f"Atom arrangement {graph_index} does not fit in the packed register")
+
+    logger.info(
+        f"Packed {len(packed.slots)} sub-registers ({len(packed.coordinates)} atoms) "
+        f"from {len(coordinate_sets)} arrangements"
+    )
+    return packed
@@ -0,0 +1,219 @@
+import codecs
+import json
+import logging
+import re
+from collections import Counter
+
+import numpy as np
+
+from shot_analytics import AnalyticsAccumulator
+from shot_matrix import ShotMatrix
+
+
+logger = logging.getLogger('result_stream')
+
+# Bytes read from the result object at a time
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+# Shots decoded into one ShotMatrix before they are counted
+SHOT_BATCH_SIZE = 4096
+
+RESULTS_FILENAME = 'results.json'
+
+_MEASUREMENTS_START = re.compile(r'"measurements"\s*:\s*\[')
+_SEPARATORS = ' \t\r\n,'
+
+
+class IngestedResult:
+    """Counts and analytics of a result read as a stream"""
+
+    def __init__(self, counts, analytics, shots, failed_shots, peak_buffer_bytes):
+        self.counts = counts                        # Counter of state labels
+        self.analytics = analytics                  # RunAnalytics, None without a register graph
+        self.shots = shots                          # ShotMatrix of every shot, None unless kept
+        self.failed_shots = failed_shots            # shots reported without measurements
+        self.peak_buffer_bytes = peak_buffer_bytes  # largest amount of undecoded text held
+
+    @property
+    def n_shots(self):
+        return sum(self.counts.values())
+
+    def __repr__(self):
+        return (f"IngestedResult(shots={self.n_shots}, distinct_states={len(self.counts)}, "
+                f"failed_shots={self.failed_shots}, peak_buffer_bytes={self.peak_buffer_bytes})")
+
+
+def iter_measurements(stream, chunk_size=STREAM_CHUNK_BYTES, stats=None):
+    """
+    Yield the measurement objects of an AHS result JSON one at a time.
+
+    The document is read chunk_size bytes at a time and only the text of the
+    measurement being decoded is buffered, so the whole result never has to be
+    in memory. stats, if given, is a dict updated with 'peak_buffer_bytes'.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    eof = False
+    peak = 0
+
+    def read_more():
+        nonlocal buffer, pos, eof, peak
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            buffer = buffer[pos:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + (text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        pos = 0
+        peak = max(peak, len(buffer))
+        if stats is not None:
+            stats['peak_buffer_bytes'] = peak
+
+    # Skip everything before the measurements array, keeping a tail in case its key is split between chunks
+    while True:
+        read_more()
+        match = _MEASUREMENTS_START.search(buffer)
+        if match:
+            pos = match.end()
+            break
+        if eof:
+            raise ValueError("The result has no measurements")
+        pos = max(0, len(buffer) - 64)
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("The result ends inside the measurements")
+            read_more()
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            measurement, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The measurement continues in the next chunk
+            if eof:
+                raise ValueError("The result ends inside a measurement")
+            read_more()
+            continue
+        yield measurement
+
+
+def iter_shot_batches(stream, batch_size=SHOT_BATCH_SIZE, chunk_size=STREAM_CHUNK_BYTES, stats=None):
+    """
+    Yield ShotMatrix batches of at most batch_size shots from an AHS result JSON stream.
+    Shots without pre and post sequences (failed shots) are counted in stats['failed_shots'].
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('failed_shots', 0)
+    pre, post = [], []
+
+    for measurement in iter_measurements(stream, chunk_size, stats):
+        result = measurement.get('shotResult') or {}
+        if result.get('preSequence') is None or result.get('postSequence') is None:
+            stats['failed_shots'] += 1
+            continue
+        pre.append(result['preSequence'])
+        post.append(result['postSequence'])
+        if len(pre) == batch_size:
+            yield ShotMatrix.from_arrays(pre, post)
+            pre, post = [], []
+
+    if pre:
+        yield ShotMatrix.from_arrays(pre, post)
+
+
+def ingest_result_stream(stream, edges=None, optimum=None, keep_shots=False,
+                         batch_size=SHOT_BATCH_SIZE, chunk_size=STREAM_CHUNK_BYTES):
+    """
+    Count the shots of an AHS result JSON stream and compute its analytics batch by batch.
+
+    Args:
+        stream: Binary or text file-like object with a read(size) method (file, S3 body...)
+        edges: (edges, 2) atom pairs of the register graph, analytics are skipped if None
+        optimum: Maximum independent set size of the register, for the approximation ratio
+        keep_shots: Also return every shot as a bit-packed ShotMatrix (2 bits per atom and shot)
+        batch_size: Shots decoded and counted at a time
+        chunk_size: Bytes read at a time
+
+    Returns:
+        IngestedResult
+    """
+    stats = {}
+    counts = Counter()
+    accumulator = None
+    kept = []
+
+    for batch in iter_shot_batches(stream, batch_size, chunk_size, stats):
+        counts.update(batch.counts())
+        if edges is not None:
+            if accumulator is None:
+                accumulator = AnalyticsAccumulator(batch.n_atoms, edges, optimum)
+            accumulator.update(batch)
+        if keep_shots:
+            kept.append(batch)
+
+    shots = None
+    if keep_shots:
+        shots = ShotMatrix.concatenate(kept) if kept else ShotMatrix.from_arrays(np.zeros((0, 0)), np.zeros((0, 0)))
+    analytics = accumulator.result() if accumulator is not None else None
+
+    ingested = IngestedResult(counts, analytics, shots, stats['failed_shots'], stats.get('peak_buffer_bytes', 0))
+    logger.info(f"Ingested {ingested}")
+    return ingested
+
+
+def ingest_result_file(path, **kwargs):
+    """ingest_result_stream on a local result file"""
+    with open(path, 'rb') as f:
+        return ingest_result_stream(f, **kwargs)
+
+
+def open_task_result_stream(task_arn, aws_session):
+    """Streaming body of the results.json object a Braket task wrote to S3"""
+    metadata = aws_session.get_quantum_task(task_arn)
+    if metadata['status'] != 'COMPLETED':
+        raise RuntimeError(f"Task {task_arn} is {metadata['status']}, it has no result")
+    key = f"{metadata['outputS3Directory']}/{RESULTS_FILENAME}"
+    response = aws_session.s3_client.get_object(Bucket=metadata['outputS3Bucket'], Key=key)
+    return response['Body']
+
+
+def ingest_task_result(task_arn, aws_session, **kwargs):
+    """ingest_result_stream on the result of a completed Braket task, read from S3 as it downloads"""
+    body = open_task_result_stream(task_arn, aws_session)
+    try:
+        return ingest_result_stream(body, **kwargs)
+    finally:
+        body.close()
+
+
+def write_result_file(path, shots, task_arn='local-result', device_id='braket_ahs', failed_shots=0):
+    """
+    Write a ShotMatrix as an AHS result JSON file, in the schema Braket stores in S3.
+    Used to exercise the streaming ingestion with results of any size.
+    """
+    with open(path, 'w') as f:
+        f.write('{"braketSchemaHeader": {"name": "braket.task_result.analog_hamiltonian_simulation_task_result", '
+                '"version": "1"}, ')
+        f.write(f'"taskMetadata": {json.dumps({"id": task_arn, "deviceId": device_id, "shots": shots.n_shots + failed_shots})}, ')
+        f.write('"measurements": [')
+        for start in range(0, shots.n_shots, SHOT_BATCH_SIZE):
+            batch = shots[start:start + SHOT_BATCH_SIZE]
+            for idx, (pre, post) in enumerate(zip(batch.pre_sequence().tolist(), batch.post_sequence().tolist())):
+                if start or idx:
+                    f.write(', ')
+                f.write(json.dumps({
+                    'shotMetadata': {'shotStatus': 'Success'},
+                    'shotResult': {'preSequence': pre, 'postSequence': post},
+                }))
+        for idx in range(failed_shots):
+            f.write(', ' if shots.n_shots or idx else '')
+            f.write(json.dumps({'shotMetadata': {'shotStatus': 'Failure'},
+                                'shotResult': {'preSequence': None, 'postSequence': None}}))
+        f.write(']}')
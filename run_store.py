@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from shot_matrix import ShotMatrix
+
+
+logger = logging.getLogger('run_store')
+
+# Runs are history, kept next to the app rather than in the temporary directory
+RUN_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_store')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    mode TEXT NOT NULL,
+    task_arn TEXT,
+    user_id TEXT,
+    graph_hash TEXT NOT NULL,
+    atoms INTEGER NOT NULL,
+    measured_atoms INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    top_label TEXT,
+    top_count INTEGER,
+    schedule TEXT,
+    metadata TEXT,
+    file TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_task ON runs (task_arn);
+CREATE INDEX IF NOT EXISTS runs_graph ON runs (graph_hash, created);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+"""
+
+def graph_hash(coordinates):
+    """Identity of a register geometry, used to find every run of the same graph"""
+    coordinates = np.round(np.asarray(coordinates, dtype=float).reshape(-1, 2), 6)
+    return hashlib.sha256(coordinates.tobytes()).hexdigest()
+
+
+class StoredRun:
+    """One run loaded from the store"""
+
+    def __init__(self, record, arrays):
+        self.run_id = record['run_id']
+        self.record = record
+        self.coordinates = arrays['coordinates']    # full graph, grid units
+        self.edges = arrays['edges']                # (edges, 2) node indices of the full graph
+        self.kernel_nodes = arrays['kernel_nodes']  # graph nodes of the measured atoms, in register order
+        self.shots = ShotMatrix(arrays['packed_pre'], arrays['packed_post'], int(arrays['n_atoms']))
+        self.schedule = json.loads(record['schedule']) if record['schedule'] else None
+        self.metadata = json.loads(record['metadata']) if record['metadata'] else {}
+
+    @property
+    def pre_sequence(self):
+        return self.shots.pre_sequence()
+
+    @property
+    def post_sequence(self):
+        return self.shots.post_sequence()
+
+    def state_labels(self):
+        return self.shots.state_labels()
+
+    def counts(self):
+        return self.shots.counts()
+
+    def __repr__(self):
+        return (f"StoredRun(run_id='{self.run_id}', mode='{self.record['mode']}', atoms={self.record['atoms']}, "
+                f"shots={self.record['shots']})")
+
+
+class RunStore:
+    """
+    Durable history of runs: the graph, the register, the schedule and every shot.
+
+    Each run is one compressed .npz file with the arrays, indexed in SQLite by
+    mode, task ARN, graph and date, so runs are found and reloaded without going
+    back to Braket. Safe to use from several threads and processes.
+    """
+
+    def __init__(self, directory=RUN_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._local = threading.local()
+        db = self._connection()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(_SCHEMA)
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.directory, 'runs.sqlite3'), timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def save_run(self, coordinates, shots, mode, kernel_nodes=None, edges=None,
+                 schedule=None, task_arn=None, user_id=None, metadata=None):
+        """
+        Store a run.
+
+        Args:
+            coordinates: Node coordinates of the full graph (grid units)
+            shots: ShotMatrix of the measured atoms
+            mode: Backend that produced the shots ('simulator', 'QuEra'...)
+            kernel_nodes: Graph nodes of the measured atoms, all nodes if None
+            edges: Edges of the graph as node pairs
+            schedule: JSON serializable description of the driving field
+            task_arn: Braket task ARN, if any
+            user_id: Session that requested the run
+            metadata: Any other JSON serializable details
+
+        Returns:
+            run id
+        """
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        if kernel_nodes is None:
+            kernel_nodes = range(len(coordinates))
+        kernel_nodes = np.asarray(list(kernel_nodes), dtype=np.int32)
+        edges = np.asarray(list(edges) if edges is not None else [], dtype=np.int32).reshape(-1, 2)
+
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        filename = f"{run_id}.npz"
+        path = os.path.join(self.directory, filename)
+        partial_path = f"{path}.partial"
+        with open(partial_path, 'wb') as f:
+            np.savez_compressed(f, coordinates=coordinates, edges=edges, kernel_nodes=kernel_nodes,
+                                packed_pre=shots.packed_pre, packed_post=shots.packed_post, n_atoms=shots.n_atoms)
+        os.replace(partial_path, path)
+
+        top = shots.counts().most_common(1)
+        self._connection().execute(
+            "INSERT INTO runs (run_id, created, mode, task_arn, user_id, graph_hash, atoms, measured_atoms, shots, "
+            "top_label, top_count, schedule, metadata, file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, time.time(), mode, task_arn, user_id, graph_hash(coordinates), len(coordinates),
+             len(kernel_nodes), shots.n_shots, top[0][0] if top else None, top[0][1] if top else None,
+             json.dumps(schedule) if schedule is not None else None,
+             json.dumps(metadata) if metadata else None, filename)
+        )
+        logger.info(f"Stored run {run_id}: {mode}, {len(coordinates)} atoms, {shots.n_shots} shots")
+        return run_id
+
+    def load_run(self, run_id):
+        """StoredRun with its arrays, None for an unknown run"""
+        row = self._connection().execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        with np.load(os.path.join(self.directory, row['file'])) as arrays:
+            return StoredRun(dict(row), {name: arrays[name] for name in arrays.files})
+
+    def find_runs(self, mode=None, task_arn=None, coordinates=None, user_id=None, since=None,
+                  min_atoms=None, max_atoms=None, limit=100):
+        """
+        Index records matching every given filter, newest first.
+        since is a Unix timestamp, coordinates selects the runs of that exact graph
+        """
+        clauses, params = [], []
+        for column, value in (('mode', mode), ('task_arn', task_arn), ('user_id', user_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if coordinates is not None:
+            clauses.append("graph_hash = ?")
+            params.append(graph_hash(coordinates))
+        if since is not None:
+            clauses.append("created >= ?")
+            params.append(since)
+        if min_atoms is not None:
+            clauses.append("atoms >= ?")
+            params.append(min_atoms)
+        if max_atoms is not None:
+            clauses.append("atoms <= ?")
+            params.append(max_atoms)
+
+        query = "SELECT * FROM runs"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created DESC LIMIT ?"
+        return [dict(row) for row in self._connection().execute(query, (*params, limit))]
+
+    def find_by_task(self, task_arn):
+        """Stored run of a Braket task, None if it was never stored"""
+        records = self.find_runs(task_arn=task_arn, limit=1)
+        return self.load_run(records[0]['run_id']) if records else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_run_store():
+    """Process-wide run store, in run_store_dir from env.local or RUN_STORE_DIR"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RunStore(os.getenv('run_store_dir') or RUN_STORE_DIR)
+        return _store
@@ -0,0 +1,77 @@
+import logging
+
+import numpy as np
+
+from hamiltonian_cache import RYDBERG_INTERACTION_COEF, SPACE_UNIT, TIME_UNIT, time_series_values
+from shot_matrix import ShotMatrix
+
+
+logger = logging.getLogger('rydberg_annealer')
+
+DEFAULT_SWEEPS = 200
+
+# The Rabi drive is what lets the atoms change state; the emulator turns it into a temperature
+# T(t) = TEMPERATURE_SCALE * Omega(t), which falls to MIN_TEMPERATURE when the drive is switched off
+DEFAULT_TEMPERATURE_SCALE = 0.5
+MIN_TEMPERATURE = 1e-3  # rad/us
+
+
+def interaction_matrix(coordinates, interaction_coef=RYDBERG_INTERACTION_COEF):
+    """(atoms, atoms) van der Waals interactions in rad/us, coordinates in meters"""
+    positions = np.array(coordinates, dtype=float).reshape(-1, 2) / SPACE_UNIT
+    distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=-1)
+    np.fill_diagonal(distances, np.inf)
+    return interaction_coef / distances ** 6
+
+
+def emulate(coordinates, drive, shots=1000, sweeps=DEFAULT_SWEEPS, temperature_scale=DEFAULT_TEMPERATURE_SCALE,
+            seed=None):
+    """
+    Classical Monte Carlo preview of a Rydberg register under a driving field.
+
+    Each shot is an independent simulated annealing chain over the classical
+    Rydberg energy E(n) = -Delta(t) sum_i n_i + sum_i<j V_ij n_i n_j, following
+    the detuning sweep of the drive with a temperature proportional to the Rabi
+    frequency. All chains are updated together with NumPy, one atom at a time,
+    so registers of hundreds of atoms run in seconds where the state vector
+    simulators stop at about 15 atoms. It captures the blockade and the
+    preference for large independent sets, not quantum coherence.
+
+    Args:
+        coordinates: Atom positions in meters
+        drive: braket.ahs.driving_field.DrivingField
+        shots: Number of chains, one sample each
+        sweeps: Metropolis sweeps over every atom along the schedule
+        temperature_scale: Temperature per unit of Rabi frequency
+        seed: Seed of the chains
+
+    Returns:
+        ShotMatrix with every site filled
+    """
+    interactions = interaction_matrix(coordinates)
+    n_atoms = len(interactions)
+    rng = np.random.default_rng(seed)
+
+    duration = float(drive.amplitude.time_series.times()[-1])
+    times = (np.arange(sweeps) + 0.5) / sweeps * duration
+    deltas = time_series_values(drive.detuning, times) * TIME_UNIT
+    temperatures = np.maximum(temperature_scale * time_series_values(drive.amplitude, times) * TIME_UNIT,
+                              MIN_TEMPERATURE)
+
+    rydberg = np.zeros((shots, n_atoms), dtype=bool)  # every atom starts in the ground state
+    fields = np.zeros((shots, n_atoms))               # interaction of each atom with the Rydberg atoms
+
+    for delta, temperature in zip(deltas, temperatures):
+        thresholds = rng.random((n_atoms, shots))
+        for step, atom in enumerate(rng.permutation(n_atoms)):
+            excited = rydberg[:, atom].copy()
+            # Energy change of flipping the atom: exciting it costs V - Delta, relaxing it Delta - V
+            change = np.where(excited, delta - fields[:, atom], fields[:, atom] - delta)
+            accept = (change <= 0) | (thresholds[step] < np.exp(-np.maximum(change, 0) / temperature))
+            if not accept.any():
+                continue
+            rydberg[accept, atom] = ~excited[accept]
+            fields[accept] += np.where(excited[accept], -1.0, 1.0)[:, None] * interactions[atom]
+
+    logger.info(f"Emulated {shots} shots of {n_atoms} atoms with {sweeps} sweeps")
+    return ShotMatrix.from_arrays(np.ones((shots, n_atoms), dtype=np.uint8), (~rydberg).astype(np.uint8))
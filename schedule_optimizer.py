@@ -0,0 +1,214 @@
+import logging
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from classical_mis import solve_mis_exact
+from graph_reduction import UNIT_DISK_RADIUS, graph_from_coordinates, kernelize
+
+
+logger = logging.getLogger('schedule_optimizer')
+
+LATTICE_CONSTANT = 7e-6  # meters per grid unit, as in Quantum_API
+
+# Limits of the schedules explored, within what Aquila accepts
+OMEGA_MAX = 15800000          # rad/s
+TIME_RAMP = 5e-08             # s
+TIME_MAX_RANGE = (1.0e-6, 4.0e-6)
+
+# Schedule parameters and their bounds:
+#   omega_fraction   Rabi frequency plateau, as a fraction of OMEGA_MAX
+#   delta_start      detuning at the start of the sweep, in units of OMEGA_MAX
+#   delta_end        detuning at the end of the sweep, in units of OMEGA_MAX
+#   knot_1, knot_2   detuning at 1/3 and 2/3 of the sweep, as a fraction of the way from start to end
+#   time_max         duration of the program, seconds
+PARAMETER_NAMES = ('omega_fraction', 'delta_start', 'delta_end', 'knot_1', 'knot_2', 'time_max')
+PARAMETER_BOUNDS = [(0.4, 1.0), (-3.0, -0.5), (0.5, 3.0), (0.0, 1.0), (0.0, 1.0), TIME_MAX_RANGE]
+
+# The schedule of create_driving_field: full Rabi frequency and a linear sweep from -2.7 to 2.7 OMEGA_MAX
+DEFAULT_PARAMETERS = (1.0, -2.7, 2.7, 1 / 3, 2 / 3, 4e-6)
+
+OBJECTIVES = ('mis_probability', 'energy')
+VIOLATION_PENALTY = 2.0  # energy of each blockade violation, in units of one atom of the independent set
+
+DEFAULT_STEPS = 200
+MAX_WORKERS = 4
+
+
+def schedule_points(parameters):
+    """(times, amplitude values, detuning values) of the piecewise linear schedule"""
+    omega_fraction, delta_start, delta_end, knot_1, knot_2, time_max = parameters
+    knot_1, knot_2 = sorted((knot_1, knot_2))  # the sweep never goes back
+
+    start, end = delta_start * OMEGA_MAX, delta_end * OMEGA_MAX
+    sweep = time_max - 2 * TIME_RAMP
+    times = [0.0, TIME_RAMP, TIME_RAMP + sweep / 3, TIME_RAMP + 2 * sweep / 3, time_max - TIME_RAMP, time_max]
+    amplitude = [0.0] + [omega_fraction * OMEGA_MAX] * 4 + [0.0]
+    detuning = [start, start, start + knot_1 * (end - start), start + knot_2 * (end - start), end, end]
+    return times, amplitude, detuning
+
+
+def build_driving_field(parameters):
+    """Braket DrivingField of a schedule parameter vector"""
+    from braket.ahs.driving_field import DrivingField
+    from braket.timings.time_series import TimeSeries
+
+    times, amplitude, detuning = schedule_points(parameters)
+    omega = TimeSeries()
+    delta = TimeSeries()
+    for t, value in zip(times, amplitude):
+        omega.put(t, value)
+    for t, value in zip(times, detuning):
+        delta.put(t, value)
+    phi = TimeSeries().put(0.0, 0.0).put(times[-1], 0.0)
+    return DrivingField(amplitude=omega, phase=phi, detuning=delta)
+
+
+@lru_cache(maxsize=32)
+def _register(coordinates, blockade_subspace):
+    """Operators, independent set sizes and blockade violations of every configuration of a register"""
+    from hamiltonian_cache import get_operators
+
+    positions = np.array(coordinates, dtype=float) * LATTICE_CONSTANT
+    blockade_radius = UNIT_DISK_RADIUS * LATTICE_CONSTANT if blockade_subspace else 0.0
+    operators = get_operators(positions, blockade_radius)
+
+    configurations = operators.configurations.astype(bool)
+    edges = np.array(list(graph_from_coordinates(coordinates).edges), dtype=np.int64).reshape(-1, 2)
+    violations = (configurations[:, edges[:, 0]] & configurations[:, edges[:, 1]]).sum(axis=1)
+    sizes = configurations.sum(axis=1)
+    return operators, sizes, violations
+
+
+def evaluate_schedule(parameters, coordinates, optimum, steps=DEFAULT_STEPS, blockade_subspace=True):
+    """
+    Simulate a schedule on a register and score the final state.
+
+    Returns:
+        (probability of a maximum independent set, expected energy), where the
+        energy is -size for an independent set plus VIOLATION_PENALTY per
+        violated edge
+    """
+    from hamiltonian_cache import evolve
+
+    operators, sizes, violations = _register(tuple(map(tuple, coordinates)), blockade_subspace)
+    state = evolve(operators, build_driving_field(parameters), steps)
+    probabilities = np.abs(state) ** 2
+    probabilities /= probabilities.sum()
+
+    mis_probability = float(probabilities[(sizes == optimum) & (violations == 0)].sum())
+    energy = float(np.dot(probabilities, -sizes + VIOLATION_PENALTY * violations))
+    return mis_probability, energy
+
+
+def _objective(parameters, coordinates, optimum, steps, blockade_subspace, objective):
+    mis_probability, energy = evaluate_schedule(parameters, coordinates, optimum, steps, blockade_subspace)
+    return -mis_probability if objective == 'mis_probability' else energy
+
+
+class OptimizedSchedule:
+    """Best schedule found for a register, with the default schedule's scores for comparison"""
+
+    def __init__(self, parameters, mis_probability, energy, baseline_mis_probability, baseline_energy,
+                 evaluations, elapsed_seconds):
+        self.parameters = dict(zip(PARAMETER_NAMES, (float(value) for value in parameters)))
+        self.mis_probability = mis_probability
+        self.energy = energy
+        self.baseline_mis_probability = baseline_mis_probability
+        self.baseline_energy = baseline_energy
+        self.evaluations = evaluations
+        self.elapsed_seconds = elapsed_seconds
+
+    def driving_field(self):
+        return build_driving_field([self.parameters[name] for name in PARAMETER_NAMES])
+
+    def as_dict(self):
+        return {
+            'parameters': self.parameters,
+            'mis_probability': self.mis_probability,
+            'energy': self.energy,
+            'baseline_mis_probability': self.baseline_mis_probability,
+            'baseline_energy': self.baseline_energy,
+            'evaluations': self.evaluations,
+            'elapsed_seconds': self.elapsed_seconds,
+        }
+
+    def __repr__(self):
+        return (f"OptimizedSchedule(mis_probability={self.mis_probability:.3f} "
+                f"(default {self.baseline_mis_probability:.3f}), evaluations={self.evaluations}, "
+                f"elapsed_seconds={self.elapsed_seconds:.1f})")
+
+
+def optimize_schedule(nodes_list, objective='mis_probability', reduce_graph=True, steps=DEFAULT_STEPS,
+                      blockade_subspace=True, workers=None, max_generations=15, population_size=8,
+                      seed=None):
+    """
+    Search the detuning and Rabi schedule that works best for a graph on the cached local simulator.
+
+    Candidates are evolved with differential evolution; each generation is
+    evaluated in parallel on a pool of warm worker processes, which keep the
+    Hamiltonian operators of the register cached between candidates.
+
+    Args:
+        nodes_list: Atom coordinates of the graph (grid units)
+        objective: 'mis_probability' (maximized) or 'energy' (expected MIS energy, minimized)
+        reduce_graph: Optimize for the kernel left by the exact MIS reductions, as it is simulated and run
+        steps: Time steps of each simulation
+        blockade_subspace: Simulate only configurations without two Rydberg atoms within the blockade
+                           radius, much faster for large registers
+        workers: Worker processes, one per CPU up to MAX_WORKERS by default; 1 evaluates in this process
+        max_generations: Generations of the differential evolution
+        population_size: Candidates per generation, per parameter
+        seed: Seed of the search
+
+    Returns:
+        OptimizedSchedule, None when the reductions leave nothing to simulate
+    """
+    from scipy.optimize import differential_evolution
+
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective}, expected one of {', '.join(OBJECTIVES)}")
+
+    graph = graph_from_coordinates(nodes_list)
+    nodes = sorted(kernelize(graph, allow_folding=False).kernel.nodes) if reduce_graph else sorted(graph.nodes)
+    if not nodes:
+        return None
+    coordinates = [tuple(float(value) for value in nodes_list[node]) for node in nodes]
+    optimum = len(solve_mis_exact(graph_from_coordinates(coordinates)))
+
+    start = time.monotonic()
+    baseline = evaluate_schedule(DEFAULT_PARAMETERS, coordinates, optimum, steps, blockade_subspace)
+
+    if workers is None:
+        workers = min(os.cpu_count() or 1, MAX_WORKERS)
+
+    pool = None
+    if workers > 1:
+        from simulation_worker_pool import SimulationWorkerPool
+
+        pool = SimulationWorkerPool(workers=workers).start()
+
+        def evaluate_generation(func, candidates):
+            futures = [pool.submit(func, candidate) for candidate in candidates]
+            return [future.result() for future in futures]
+    else:
+        evaluate_generation = 1
+
+    try:
+        search = differential_evolution(
+            _objective, PARAMETER_BOUNDS,
+            args=(coordinates, optimum, steps, blockade_subspace, objective),
+            x0=DEFAULT_PARAMETERS, maxiter=max_generations, popsize=population_size,
+            updating='deferred', workers=evaluate_generation, polish=False, seed=seed, tol=1e-3
+        )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    mis_probability, energy = evaluate_schedule(search.x, coordinates, optimum, steps, blockade_subspace)
+    result = OptimizedSchedule(search.x, mis_probability, energy, baseline[0], baseline[1], search.nfev,
+                               time.monotonic() - start)
+    logger.info(f"Schedule optimized for {len(coordinates)} atoms: {result}")
+    return result
@@ -5,11 +5,16 @@ import tempfile
 import hashlib
 import logging
 import time
+import random
 from datetime import datetime, timedelta
 import threading
+import io
+import mmap
 from io import BytesIO
-from PIL import Image
-import imghdr
+from collections import Counter, OrderedDict
+from file_metadata_index import FileMetadataIndex, file_fingerprint
+from temp_cleanup import CleanupEngine
+import struct
 
 
 # Configure logging
@@ -24,81 +29,175 @@ logger = logging.getLogger('secure_file_handler')
 MAX_FILE_SIZE_MB = 5
 ALLOWED_IMAGE_TYPES = ['png', 'jpeg', 'jpg']
 ALLOWED_MIME_TYPES = ["image/png", "image/jpeg", "image/jpg"]
+MAX_IMAGE_DIMENSION = 4000  # pixels per side
+MAX_IMAGE_PIXELS = MAX_IMAGE_DIMENSION * MAX_IMAGE_DIMENSION
+
+# Files are hashed, written and overwritten in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+IMAGE_HEADER_BYTES = 64 * 1024  # enough for the PNG / JPEG header of the images we accept
+_ZERO_CHUNK = bytes(CHUNK_SIZE)
 
 # Create a secure temporary directory with restricted permissions
 TEMP_DIR = os.path.join(tempfile.gettempdir(), 'bedrock_braket_secure_files')
 if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR, mode=0o700)  # Only owner can access
 
+# Integrity checks trust an unchanged stat fingerprint (inode, size, mtime) and only
+# re-hash the file when it changed, when forced, on a random sample of checks or
+# when the last full check is older than the interval
+INTEGRITY_REHASH_PROBABILITY = 0.05
+INTEGRITY_REHASH_INTERVAL_SECONDS = 900
+
 # File retention settings
 FILE_RETENTION_HOURS = 24  # Files older than this will be deleted
 CLEANUP_INTERVAL_SECONDS = 3600  # Run cleanup every hour
+# Each scheduled pass deletes at most this many files (rate capped, see temp_cleanup),
+# a remaining backlog is picked up again after the shorter interval
+CLEANUP_PASS_MAX_FILES = 500
+CLEANUP_BACKLOG_INTERVAL_SECONDS = 30
+
+# Store file metadata for tracking, persisted next to (not inside) the storage directory
+# so it survives restarts and is not removed with the files
+METADATA_DB_PATH = os.path.join(tempfile.gettempdir(), 'bedrock_braket_secure_files.sqlite3')
+file_metadata = FileMetadataIndex(METADATA_DB_PATH, TEMP_DIR)
+
+# Uploads already validated and stored, keyed by content hash, so Streamlit reruns reuse them
+MAX_CACHED_UPLOADS = 64
+validated_uploads = OrderedDict()
+validated_uploads_lock = threading.Lock()
 
-# Store file metadata for tracking
-file_metadata = {}
+# Serializes stores, reference changes and deletes of the content addressed files
+storage_lock = threading.RLock()
 
 class SecureFile:
     """Class to handle secure file operations"""
     
-    def __init__(self, file_data=None, file_path=None, file_type=None):
-        """Initialize with either file data or path"""
+    def __init__(self, file_data=None, file_path=None, file_type=None, file_hash=None, owner=None):
+        """
+        Initialize with either file data or path, file_hash skips hashing data already hashed by the caller
+        owner (usually the Streamlit session id) is the reference holder of the stored blob
+        """
         self.file_data = file_data
+        self.owner = owner
         self.file_path = file_path
         self.file_type = file_type
-        self.file_hash = None
+        self.file_hash = file_hash
         self.created_at = datetime.now()
         self.last_accessed = self.created_at
         self.size_mb = None
+        self.fingerprint = None       # (inode, size, mtime_ns) when the file was written or last hashed
+        self.last_full_check = None   # time.monotonic() of the last full re-hash
         
-        if file_data:
+        # file_data may also be a binary file object, which is hashed while it is written to disk
+        if isinstance(file_data, (bytes, bytearray, memoryview)) and len(file_data):
             self.size_mb = len(file_data) / (1024 * 1024)
-            self.file_hash = hashlib.sha256(file_data).hexdigest()
+            if not self.file_hash:
+                self.file_hash = hashlib.sha256(file_data).hexdigest()
             
     def save_to_disk(self):
-        """Save file data to secure temporary storage"""
-        if not self.file_data:
+        """
+        Save file data to secure temporary storage
+        Files are stored once per content (named after their SHA-256), storing bytes that
+        are already on disk only adds a reference for this file's owner. The data is
+        written in chunks and dropped from memory once it is on disk
+        """
+        if self.file_data is None or (not hasattr(self.file_data, 'read') and not len(self.file_data)):
             logger.error("No file data to save")
             return False
             
-        # Create unique filename with hash prefix for tracking
-        unique_id = str(uuid.uuid4())
         if not self.file_type:
-            self.file_type = imghdr.what(None, h=self.file_data)
-            
-        filename = f"{self.file_hash[:10]}_{unique_id}.{self.file_type}"
-        self.file_path = os.path.join(TEMP_DIR, filename)
+            header = read_image_header(_read_head(self.file_data, IMAGE_HEADER_BYTES))
+            self.file_type = header[0] if header else 'bin'
+
+        # Known content already on disk: only a reference is added
+        if self.file_hash and self._reference_stored_copy():
+            self.file_data = None
+            logger.debug(f"File already stored, reference added: {self.file_path}")
+            return True
         
+        # Write file with secure permissions, through a temporary name so readers
+        # of the same blob never see a partial file
+        partial_path = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex}.partial")
         try:
-            # Write file with secure permissions
-            with open(self.file_path, 'wb') as f:
-                f.write(self.file_data)
-                
-            # Set secure permissions (only owner can read/write)
-            os.chmod(self.file_path, 0o600)
-            
-            # Store metadata
-            file_metadata[self.file_path] = {
-                'hash': self.file_hash,
-                'created': self.created_at,
-                'accessed': self.last_accessed,
-                'size_mb': self.size_mb,
-                'type': self.file_type
-            }
-            
-            logger.info(f"File saved securely: {self.file_path}")
+            sha256 = hashlib.sha256()
+            size = 0
+            # Created with owner only permissions before any data is written
+            with os.fdopen(os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+                for chunk in _iter_chunks(self.file_data):
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            file_hash = sha256.hexdigest()
+            if self.file_hash and file_hash != self.file_hash:
+                raise ValueError("File data changed while it was being stored")
+            self.file_hash = file_hash
+            self.size_mb = size / (1024 * 1024)
+
+            with storage_lock:
+                if self._reference_stored_copy():
+                    os.remove(partial_path)
+                else:
+                    self.file_path = os.path.join(TEMP_DIR, f"{self.file_hash}.{self.file_type}")
+                    os.replace(partial_path, self.file_path)
+                    self.fingerprint = file_fingerprint(self.file_path)
+                    self.last_full_check = time.monotonic()
+                    
+                    # Store metadata
+                    file_metadata.add(self.file_path, {
+                        'hash': self.file_hash,
+                        'created': self.created_at,
+                        'accessed': self.last_accessed,
+                        'size_mb': self.size_mb,
+                        'type': self.file_type,
+                        'fingerprint': self.fingerprint,
+                        'refs': Counter({self.owner: 1})
+                    })
+                    logger.info(f"File saved securely: {self.file_path}")
+
+            self.file_data = None
             return True
             
         except Exception as e:
             logger.error(f"Error saving file: {str(e)}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
             return False
+
+    def _reference_stored_copy(self):
+        """Add a reference to an intact stored copy of this content, if there is one"""
+        file_path = os.path.join(TEMP_DIR, f"{self.file_hash}.{self.file_type}")
+        with storage_lock:
+            metadata = file_metadata.get(file_path)
+            if not metadata or not os.path.exists(file_path) \
+                    or file_fingerprint(file_path) != metadata['fingerprint']:
+                return False
+            file_metadata.add_reference(file_path, self.owner)
+            self.file_path = file_path
+            self.size_mb = metadata['size_mb']
+            self.fingerprint = metadata['fingerprint']
+            self.last_full_check = time.monotonic()
+            return True
+
+    def add_reference(self):
+        """Add a reference for this file's owner unless it already holds one"""
+        return file_metadata.add_reference(self.file_path, self.owner, unless_held=True)
+
+    def release(self):
+        """Drop this file's owner reference, the file is deleted once nobody references it"""
+        with storage_lock:
+            if file_metadata.release_reference(self.file_path, self.owner) == 0:
+                self.delete()
     
+    def _touch(self):
+        self.last_accessed = datetime.now()
+        file_metadata.touch(self.file_path, self.last_accessed)
+
     def get_data(self):
-        """Get file data, either from memory or disk"""
-        if self.file_data:
-            self.last_accessed = datetime.now()
-            if self.file_path in file_metadata:
-                file_metadata[self.file_path]['accessed'] = self.last_accessed
-            return self.file_data
+        """Get file data, either from memory or disk (as a new bytes copy, open_view avoids it)"""
+        if isinstance(self.file_data, (bytes, bytearray, memoryview)) and len(self.file_data):
+            self._touch()
+            return bytes(self.file_data)
             
         if not self.file_path or not os.path.exists(self.file_path):
             logger.warning(f"Attempted to access nonexistent file: {self.file_path}")
@@ -106,43 +205,81 @@ class SecureFile:
             
         try:
             with open(self.file_path, 'rb') as f:
-                self.file_data = f.read()
-                
-            self.last_accessed = datetime.now()
-            if self.file_path in file_metadata:
-                file_metadata[self.file_path]['accessed'] = self.last_accessed
+                file_data = f.read()
                 
-            return self.file_data
+            self._touch()
+            return file_data
             
         except Exception as e:
             logger.error(f"Error reading file {self.file_path}: {str(e)}")
             return None
+
+    def open_view(self):
+        """
+        Read only, memory mapped file object over the stored file
+        Returns a MappedFile (to be closed by the caller) or None if the file is not on disk
+        """
+        if not self.file_path or not os.path.exists(self.file_path):
+            logger.warning(f"Attempted to access nonexistent file: {self.file_path}")
+            return None
+
+        try:
+            view = MappedFile(self.file_path)
+            self._touch()
+            return view
+        except Exception as e:
+            logger.error(f"Error mapping file {self.file_path}: {str(e)}")
+            return None
     
-    def verify_integrity(self):
-        """Verify file integrity using stored hash"""
+    def verify_integrity(self, force=False):
+        """
+        Verify file integrity using stored hash
+        Unless force is set, a file whose stat fingerprint did not change since it was
+        written or last hashed is trusted without reading it (see INTEGRITY_REHASH_*)
+        """
         if not self.file_path or not os.path.exists(self.file_path):
             logger.warning(f"Cannot verify integrity of nonexistent file: {self.file_path}")
             return False
             
         try:
-            with open(self.file_path, 'rb') as f:
-                file_data = f.read()
-                
-            current_hash = hashlib.sha256(file_data).hexdigest()
             stored_hash = None
+            stored_fingerprint = self.fingerprint
+            metadata = file_metadata.get(self.file_path)
             
-            if self.file_path in file_metadata:
-                stored_hash = file_metadata[self.file_path]['hash']
+            if metadata:
+                stored_hash = metadata['hash']
+                stored_fingerprint = metadata['fingerprint'] or stored_fingerprint
             elif self.file_hash:
                 stored_hash = self.file_hash
                 
             if not stored_hash:
                 logger.warning(f"No hash available to verify file: {self.file_path}")
                 return False
+
+            current_fingerprint = file_fingerprint(self.file_path)
+            full_check_due = (
+                force
+                or self.last_full_check is None
+                or time.monotonic() - self.last_full_check > INTEGRITY_REHASH_INTERVAL_SECONDS
+                or random.random() < INTEGRITY_REHASH_PROBABILITY
+            )
+            if not full_check_due and stored_fingerprint and current_fingerprint == stored_fingerprint:
+                return True
+
+            sha256 = hashlib.sha256()
+            with open(self.file_path, 'rb') as f:
+                for chunk in _iter_chunks(f):
+                    sha256.update(chunk)
+            current_hash = sha256.hexdigest()
                 
             if current_hash != stored_hash:
                 logger.warning(f"File integrity check failed for {self.file_path}")
                 return False
+
+            # Same content, remember the current stat so the next checks take the fast path
+            self.fingerprint = current_fingerprint
+            self.last_full_check = time.monotonic()
+            file_metadata.set_fingerprint(self.file_path, current_fingerprint)
                 
             return True
             
@@ -151,69 +288,278 @@ class SecureFile:
             return False
     
     def delete(self):
-        """Securely delete the file"""
+        """
+        Securely delete the file
+        Returns the number of bytes reclaimed, 0 if there was no file, None if the deletion failed
+        """
         if not self.file_path or not os.path.exists(self.file_path):
-            return
+            return 0
             
         try:
-            # Overwrite file with zeros before deleting (basic secure deletion)
-            file_size = os.path.getsize(self.file_path)
-            with open(self.file_path, 'wb') as f:
-                f.write(b'\0' * file_size)
+            with storage_lock:
+                # Take the file out of its content address first, so a store of the same
+                # bytes while it is overwritten writes a fresh copy. The overwrite itself
+                # runs outside the lock and several deletions can proceed in parallel
+                doomed_path = f"{self.file_path}.{uuid.uuid4().hex}.deleting"
+                os.replace(self.file_path, doomed_path)
+                
+                # The metadata follows the file to its new name, already expired and without references,
+                # and is removed with the file. Should the overwrite or the removal fail, the next
+                # cleanup pass retries the renamed file instead of leaving it on disk untracked
+                metadata = file_metadata.get(self.file_path)
+                file_metadata.remove(self.file_path)
+                if metadata is not None:
+                    file_metadata.add(doomed_path, dict(metadata, accessed=datetime.fromtimestamp(0), refs=Counter()))
+
+            # Overwrite file with zeros before deleting (basic secure deletion),
+            # in place and one fixed size chunk at a time
+            file_size = remaining = os.path.getsize(doomed_path)
+            with open(doomed_path, 'r+b') as f:
+                while remaining > 0:
+                    written = f.write(_ZERO_CHUNK[:min(remaining, CHUNK_SIZE)])
+                    remaining -= written
+                f.flush()
+                os.fsync(f.fileno())
                 
             # Delete the file
-            os.remove(self.file_path)
-            
-            # Remove from metadata
-            if self.file_path in file_metadata:
-                del file_metadata[self.file_path]
+            os.remove(doomed_path)
+            file_metadata.remove(doomed_path)
                 
             logger.info(f"File securely deleted: {self.file_path}")
+            return file_size
             
         except Exception as e:
             logger.error(f"Error deleting file {self.file_path}: {str(e)}")
+            return None
+
+
+class MappedFile(io.RawIOBase):
+    """Read only file object backed by a memory map of a stored file, so readers share the page cache instead of copies"""
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.name = os.path.basename(file_path)
+        self._position = 0
+        with open(file_path, 'rb') as f:
+            self._size = os.fstat(f.fileno()).st_size
+            # Empty files cannot be mapped
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), self._size - self._position))
+        if count:
+            buffer[:count] = self._map[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def getbuffer(self):
+        """Zero copy memoryview of the whole file, released before close"""
+        return memoryview(self._map) if self._map is not None else memoryview(b'')
+
+    def getvalue(self):
+        """Copy of the whole file, for callers expecting a BytesIO"""
+        return self._map[:] if self._map is not None else b''
+
+    def close(self):
+        if self._map is not None and not self.closed:
+            try:
+                self._map.close()
+            except BufferError:
+                # A memoryview from getbuffer is still alive, the map is freed with it
+                pass
+        super().close()
+
+
+def _iter_chunks(source):
+    """Yield the content of bytes-like data or a binary file object in CHUNK_SIZE pieces"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), CHUNK_SIZE):
+            yield view[start:start + CHUNK_SIZE]
+        return
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _read_head(source, size):
+    """First bytes of bytes-like data or a binary file object, leaving the file position unchanged"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(memoryview(source)[:size])
+    position = source.tell()
+    source.seek(0)
+    head = source.read(size)
+    source.seek(position)
+    return head
+
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start of frame markers, the ones carrying the image dimensions
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
 
-def validate_and_store_file(file_obj):
+def read_image_header(file_data):
     """
-    Validates and securely stores an uploaded file
+    Read the format and dimensions of a PNG or JPEG image from its header, without decoding it
+    Returns (format, width, height) or None if the data is not a well formed PNG / JPEG header
+    """
+    data = memoryview(file_data)
+
+    if bytes(data[:8]) == _PNG_SIGNATURE:
+        # The IHDR chunk always comes first: length, type, width, height
+        if len(data) < 24 or bytes(data[12:16]) != b'IHDR':
+            return None
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+
+    if bytes(data[:2]) == b'\xff\xd8':
+        # Walk the marker segments up to the start of frame, skipping the segment bodies
+        position = 2
+        while position + 4 <= len(data):
+            if data[position] != 0xFF:
+                return None
+            marker = data[position + 1]
+            if marker == 0xFF:  # fill byte
+                position += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # segments without a length
+                position += 2
+                continue
+            if marker in (0xD9, 0xDA):  # end of image or start of scan before any frame
+                return None
+            segment_length = struct.unpack('>H', data[position + 2:position + 4])[0]
+            if marker in _JPEG_SOF_MARKERS:
+                if position + 9 > len(data):
+                    return None
+                height, width = struct.unpack('>HH', data[position + 5:position + 9])
+                return 'jpeg', width, height
+            position += 2 + segment_length
+        return None
+
+    return None
+
+
+def get_validated_upload(file_hash, owner=None):
+    """
+    Return the stored SecureFile of an already validated upload, or None if it is unknown or was cleaned up
+    The owner gets its own reference to the stored file
+    """
+    with validated_uploads_lock:
+        cached_file = validated_uploads.get(file_hash)
+        if cached_file is None:
+            return None
+        if cached_file.file_path not in file_metadata or not os.path.exists(cached_file.file_path):
+            del validated_uploads[file_hash]
+            return None
+        validated_uploads.move_to_end(file_hash)
+
+    secure_file = cached_file if cached_file.owner == owner else SecureFile(
+        file_type=cached_file.file_type,
+        file_hash=cached_file.file_hash, owner=owner
+    )
+    secure_file.file_path = cached_file.file_path
+    secure_file.fingerprint = cached_file.fingerprint
+    secure_file.last_full_check = cached_file.last_full_check
+    if not secure_file.add_reference():
+        return None
+
+    logger.debug(f"Reusing validated upload: {secure_file.file_path}")
+    return secure_file
+
+
+def remember_validated_upload(secure_file):
+    """Remember a validated and stored upload by its content hash"""
+    with validated_uploads_lock:
+        validated_uploads[secure_file.file_hash] = secure_file
+        validated_uploads.move_to_end(secure_file.file_hash)
+        while len(validated_uploads) > MAX_CACHED_UPLOADS:
+            validated_uploads.popitem(last=False)
+
+
+def validate_and_store_file(file_obj, owner=None):
+    """
+    Validates and securely stores an uploaded file, referenced by owner (the session id)
     Returns (is_valid, error_message, secure_file)
     """
     if file_obj is None:
         return False, "No file uploaded", None
-        
+
+    file_data = None
     try:
-        # Get file data
-        file_data = file_obj.getvalue()
-        
+        # Check file size before reading the upload, Streamlit uploads report it
+        declared_size = getattr(file_obj, 'size', None)
+        if declared_size is not None and declared_size / (1024 * 1024) > MAX_FILE_SIZE_MB:
+            logger.warning(f"File size exceeds limit: {declared_size / (1024 * 1024)}MB")
+            return False, f"File size exceeds maximum allowed ({MAX_FILE_SIZE_MB}MB)", None
+
+        # Get file data, without a copy when the upload is a BytesIO (as Streamlit uploads are)
+        file_data = file_obj.getbuffer() if hasattr(file_obj, 'getbuffer') else file_obj.getvalue()
+
         # Check file size
         file_size_mb = len(file_data) / (1024 * 1024)
         if file_size_mb > MAX_FILE_SIZE_MB:
             logger.warning(f"File size exceeds limit: {file_size_mb}MB")
             return False, f"File size exceeds maximum allowed ({MAX_FILE_SIZE_MB}MB)", None
+
+        # Streamlit reruns the script on every interaction with the same upload,
+        # reuse the file validated and stored the first time
+        file_hash = hashlib.sha256(file_data).hexdigest()
+        cached_file = get_validated_upload(file_hash, owner)
+        if cached_file is not None:
+            return True, "", cached_file
         
-        # Check file type
-        img_format = imghdr.what(None, h=file_data)
-        if img_format not in ALLOWED_IMAGE_TYPES:
-            logger.warning(f"Invalid image format: {img_format}")
+        # Check file type and dimensions from the header, before anything is decoded
+        header = read_image_header(file_data)
+        if header is None or header[0] not in ALLOWED_IMAGE_TYPES:
+            logger.warning("Invalid image format")
             return False, "File does not appear to be a valid image", None
+
+        img_format, width, height = header
+        if width == 0 or height == 0 or width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION \
+                or width * height > MAX_IMAGE_PIXELS:
+            logger.warning(f"Image dimensions too large: {width}x{height}")
+            return False, f"Image dimensions too large (max {MAX_IMAGE_DIMENSION}x{MAX_IMAGE_DIMENSION})", None
         
-        # Verify it's a valid image with PIL
+        # Verify it's a valid image with PIL, once the limits are known to hold.
+        # PIL is only loaded for an upload that got this far, not when the app starts
+        from PIL import Image
+
         try:
-            img = Image.open(BytesIO(file_data))
+            file_obj.seek(0)
+            img = Image.open(file_obj)
+            if img.size != (width, height):
+                logger.warning(f"Image header mismatch: {width}x{height} declared, {img.width}x{img.height} decoded")
+                return False, "Invalid image file: inconsistent header", None
             img.verify()  # Verify it's a valid image
             
-            # Reopen the image after verify (which closes it)
-            img = Image.open(BytesIO(file_data))
-            
-            # Check image dimensions
-            if img.width > 4000 or img.height > 4000:
-                logger.warning(f"Image dimensions too large: {img.width}x{img.height}")
-                return False, "Image dimensions too large (max 4000x4000)", None
-            
             # Create and store secure file
-            secure_file = SecureFile(file_data=file_data, file_type=img_format)
+            secure_file = SecureFile(file_data=file_data, file_type=img_format, file_hash=file_hash, owner=owner)
             if secure_file.save_to_disk():
+                remember_validated_upload(secure_file)
                 return True, "", secure_file
             else:
                 return False, "Failed to securely store file", None
@@ -226,10 +572,15 @@ def validate_and_store_file(file_obj):
         logger.error(f"Error processing uploaded file: {str(e)}")
         return False, f"Error processing file: {str(e)}", None
 
+    finally:
+        # The stored file no longer needs the upload buffer
+        if isinstance(file_data, memoryview):
+            file_data.release()
 
-def store_generated_image(image_data, image_type="png"):
+
+def store_generated_image(image_data, image_type="png", owner=None):
     """
-    Securely store an image generated by the application
+    Securely store an image generated by the application, referenced by owner (the session id)
     Returns a SecureFile object
     """
     if not image_data:
@@ -237,14 +588,11 @@ def store_generated_image(image_data, image_type="png"):
         return None
         
     try:
-        # Convert BytesIO to bytes if needed
-        if hasattr(image_data, 'getvalue'):
-            file_data = image_data.getvalue()
-        else:
-            file_data = image_data
+        # BytesIO and other file objects are streamed to disk as they are
+        file_data = image_data
             
         # Create and store secure file
-        secure_file = SecureFile(file_data=file_data, file_type=image_type)
+        secure_file = SecureFile(file_data=file_data, file_type=image_type, owner=owner)
         if secure_file.save_to_disk():
             return secure_file
         else:
@@ -257,60 +605,100 @@ def store_generated_image(image_data, image_type="png"):
 
 def get_file_as_bytesio(secure_file):
     """
-    Get file data as BytesIO object for processing
-    Returns BytesIO object or None if file not found
+    Get file data as a read only file object for processing, memory mapped when the file is on disk
+    Returns a MappedFile or BytesIO object, or None if file not found
     """
     if not secure_file:
         return None
+
+    if secure_file.file_path and os.path.exists(secure_file.file_path):
+        return secure_file.open_view()
         
     file_data = secure_file.get_data()
     if not file_data:
         return None
         
     file_obj = BytesIO(file_data)
-    if secure_file.file_path:
-        file_obj.name = os.path.basename(secure_file.file_path)
-    else:
-        file_obj.name = f"file.{secure_file.file_type}" if secure_file.file_type else "file.bin"
+    file_obj.name = f"file.{secure_file.file_type}" if secure_file.file_type else "file.bin"
         
     return file_obj
 
 
-def cleanup_old_files():
-    """Remove files older than retention period"""
+def release_session_files(owner):
+    """Drop every reference held by a session, deleting the files nobody else references"""
+    owned = file_metadata.owned_by(owner)
+    deleted = 0
+    for file_path in owned:
+        with storage_lock:
+            if file_metadata.release_reference(file_path, owner, all_references=True) == 0:
+                SecureFile(file_path=file_path).delete()
+                deleted += 1
+    logger.info(f"Released {len(owned)} files of session {owner}, deleted {deleted}")
+
+
+def _delete_stored_file(file_path):
+    """Secure deletion for the cleanup engine, raising when it fails"""
+    reclaimed = SecureFile(file_path=file_path).delete()
+    if reclaimed is None:
+        raise OSError(f"Could not delete {file_path}")
+    file_metadata.remove(file_path)
+    return reclaimed
+
+
+def _delete_expired_file(file_path):
+    """Delete a file queued as expired, unless it was accessed again while it waited"""
+    metadata = file_metadata.get(file_path)
+    if metadata is None and not os.path.exists(file_path):
+        # Already deleted while it waited, e.g. by a session release
+        return None
     cutoff_time = datetime.now() - timedelta(hours=FILE_RETENTION_HOURS)
-    files_to_remove = []
-    
-    # Find old files
-    for file_path, metadata in list(file_metadata.items()):
-        if metadata['accessed'] < cutoff_time:
-            files_to_remove.append(file_path)
-    
-    # Remove old files
-    for file_path in files_to_remove:
-        try:
-            secure_file = SecureFile(file_path=file_path)
-            secure_file.delete()
-            logger.info(f"Cleaned up old file: {file_path}")
-        except Exception as e:
-            logger.error(f"Error during cleanup of {file_path}: {str(e)}")
+    if metadata and metadata['accessed'] >= cutoff_time:
+        file_metadata.requeue(file_path)
+        return None
+    return _delete_stored_file(file_path)
+
+
+cleanup_engine = CleanupEngine(_delete_expired_file)
+
+
+def cleanup_old_files(max_files=CLEANUP_PASS_MAX_FILES):
+    """
+    Remove files older than retention period, together with the references sessions still hold on them
+    Only the expired entries are visited, taken from the index expiry heap, and queued for the
+    cleanup engine, which deletes up to max_files of them in this pass
+    Returns the CleanupReport of the pass
+    """
+    cutoff_time = datetime.now() - timedelta(hours=FILE_RETENTION_HOURS)
+    cleanup_engine.enqueue(file_metadata.pop_expired(cutoff_time))
+
+    report = cleanup_engine.run_pass(max_files=max_files)
+
+    # Still indexed means the delete failed before the file was renamed, try again on the next run.
+    # A failed overwrite or removal left the renamed file indexed as expired, the next pass picks it up
+    for file_path in report.failed:
+        if file_path in file_metadata:
+            file_metadata.requeue(file_path)
+
+    logger.info(f"Cleaned up {report.files_deleted} old files ({report.bytes_reclaimed} bytes), "
+                f"{report.remaining} waiting for the next pass")
+    return report
 
 
 def cleanup_all_files():
-    """Remove all files in the temporary directory"""
+    """
+    Remove all files in the temporary directory
+    Deletions run in parallel batches without the background rate cap, so shutdown is not held up
+    Returns the CleanupReport of the pass
+    """
     try:
+        with os.scandir(TEMP_DIR) as entries:
+            paths = [entry.path for entry in entries if entry.is_file()]
+
         # Delete all files in the directory
-        for filename in os.listdir(TEMP_DIR):
-            file_path = os.path.join(TEMP_DIR, filename)
-            if os.path.isfile(file_path):
-                try:
-                    # Create a SecureFile object for proper deletion
-                    secure_file = SecureFile(file_path=file_path)
-                    secure_file.delete()
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_path}: {str(e)}")
-                    
-        logger.info("All temporary files cleaned up")
+        report = cleanup_engine.run_pass(paths=paths, delete_file=_delete_stored_file, rate_limited=False)
+        logger.info(f"All temporary files cleaned up: {report.files_deleted} files, "
+                    f"{report.bytes_reclaimed} bytes, {len(report.failed)} failed")
+        return report
     except Exception as e:
         logger.error(f"Error during complete cleanup: {str(e)}")
 
@@ -334,8 +722,8 @@ def start_cleanup_scheduler():
                 logger.info(f"Cleanup succeeded after {consecutive_errors} consecutive errors")
                 consecutive_errors = 0
             
-            # Schedule next run with standard interval
-            interval = CLEANUP_INTERVAL_SECONDS
+            # Schedule next run with standard interval, sooner while expired files are still queued
+            interval = CLEANUP_BACKLOG_INTERVAL_SECONDS if cleanup_engine.pending else CLEANUP_INTERVAL_SECONDS
             
         except Exception as e:
             # Increment error counter
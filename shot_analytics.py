@@ -0,0 +1,198 @@
+from functools import lru_cache
+
+import numpy as np
+
+from classical_mis import solve_mis_exact
+from graph_reduction import graph_from_coordinates
+
+
+
+class RunAnalytics:
+    """Quality figures of a run, computed from every shot rather than the most frequent state"""
+
+    def __init__(self, shots, filling_rate, rydberg_probability, violation_rate, mean_violations,
+                 size_distribution, optimum_size):
+        self.shots = shots
+        self.filling_rate = filling_rate                # fraction of the sites found filled before the drive
+        self.rydberg_probability = rydberg_probability  # per atom, in register order
+        self.violation_rate = violation_rate            # fraction of shots with two neighbouring Rydberg atoms
+        self.mean_violations = mean_violations          # violated edges per shot
+        self.size_distribution = size_distribution      # size_distribution[k]: fraction of the shots that are
+                                                        # independent sets of size k
+        self.optimum_size = optimum_size                # maximum independent set size, None if not known
+
+    @property
+    def valid_rate(self):
+        return 1.0 - self.violation_rate
+
+    @property
+    def mean_size(self):
+        """Mean size of the independent sets measured, 0 without any"""
+        valid = self.size_distribution.sum()
+        if valid == 0:
+            return 0.0
+        return float(np.dot(np.arange(len(self.size_distribution)), self.size_distribution) / valid)
+
+    @property
+    def best_size(self):
+        nonzero = np.nonzero(self.size_distribution)[0]
+        return int(nonzero[-1]) if len(nonzero) else 0
+
+    @property
+    def approximation_ratio(self):
+        """Mean independent set size over the optimum, None if the optimum is not known"""
+        if not self.optimum_size:
+            return None
+        return self.mean_size / self.optimum_size
+
+    @property
+    def optimum_probability(self):
+        """Fraction of the shots that are maximum independent sets"""
+        if self.optimum_size is None:
+            return None
+        if self.optimum_size >= len(self.size_distribution):
+            return 0.0
+        return float(self.size_distribution[self.optimum_size])
+
+    def as_dict(self):
+        return {
+            'shots': self.shots,
+            'filling_rate': self.filling_rate,
+            'rydberg_probability': self.rydberg_probability.tolist(),
+            'violation_rate': self.violation_rate,
+            'mean_violations': self.mean_violations,
+            'size_distribution': self.size_distribution.tolist(),
+            'optimum_size': self.optimum_size,
+            'mean_size': self.mean_size,
+            'best_size': self.best_size,
+            'approximation_ratio': self.approximation_ratio,
+            'optimum_probability': self.optimum_probability,
+        }
+
+    def __repr__(self):
+        ratio = self.approximation_ratio
+        return (f"RunAnalytics(shots={self.shots}, violation_rate={self.violation_rate:.3f}, "
+                f"mean_size={self.mean_size:.2f}, optimum_size={self.optimum_size}, "
+                f"approximation_ratio={'n/a' if ratio is None else f'{ratio:.3f}'})")
+
+
+def register_edges(coordinates):
+    """(edges, 2) array of the atom pairs inside each other's blockade radius"""
+    graph = graph_from_coordinates(coordinates)
+    return np.array(list(graph.edges), dtype=np.int64).reshape(-1, 2)
+
+
+@lru_cache(maxsize=256)
+def _optimum_size(coordinates):
+    return len(solve_mis_exact(graph_from_coordinates(coordinates)))
+
+
+def optimum_size(coordinates):
+    """Maximum independent set size of a register, solved exactly once per geometry"""
+    return _optimum_size(tuple(map(tuple, np.asarray(coordinates, dtype=float).reshape(-1, 2).tolist())))
+
+
+class AnalyticsAccumulator:
+    """
+    Running sums behind RunAnalytics, updated one batch of shots at a time.
+    Memory does not depend on the number of shots.
+    """
+
+    def __init__(self, n_atoms, edges, optimum=None):
+        self.n_atoms = n_atoms
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.optimum = optimum
+        self.shots = 0
+        self.filled = 0
+        self.violations = 0
+        self.violating_shots = 0
+        self.rydberg_counts = np.zeros(n_atoms, dtype=np.int64)
+        self.size_counts = np.zeros(n_atoms + 1, dtype=np.int64)
+
+    def update(self, shots):
+        """Add a ShotMatrix of the register"""
+        if shots.n_shots == 0:
+            return
+        if shots.n_atoms != self.n_atoms:
+            raise ValueError(f"Shots of {shots.n_atoms} atoms added to analytics of {self.n_atoms} atoms")
+
+        rydberg = shots.rydberg()
+        violations = (rydberg[:, self.edges[:, 0]] & rydberg[:, self.edges[:, 1]]).sum(axis=1)
+        valid = violations == 0
+
+        self.shots += shots.n_shots
+        self.filled += int(shots.pre_sequence().sum())
+        self.violations += int(violations.sum())
+        self.violating_shots += int((~valid).sum())
+        self.rydberg_counts += rydberg.sum(axis=0)
+        self.size_counts += np.bincount(rydberg[valid].sum(axis=1), minlength=self.n_atoms + 1)
+
+    def result(self):
+        """RunAnalytics of the shots added so far"""
+        if self.shots == 0:
+            return RunAnalytics(0, 0.0, np.zeros(self.n_atoms), 0.0, 0.0, np.zeros(1), self.optimum)
+        return RunAnalytics(
+            shots=self.shots,
+            filling_rate=self.filled / (self.shots * self.n_atoms) if self.n_atoms else 1.0,
+            rydberg_probability=self.rydberg_counts / self.shots,
+            violation_rate=self.violating_shots / self.shots,
+            mean_violations=self.violations / self.shots,
+            size_distribution=self.size_counts / self.shots,
+            optimum_size=self.optimum,
+        )
+
+
+def analyze_shots(shots, edges, optimum=None):
+    """
+    Analytics of the shots of one register.
+
+    Args:
+        shots: ShotMatrix
+        edges: (edges, 2) atom index pairs of the register graph
+        optimum: Maximum independent set size of the register, if known
+
+    Returns:
+        RunAnalytics
+    """
+    accumulator = AnalyticsAccumulator(shots.n_atoms, edges, optimum)
+    accumulator.update(shots)
+    return accumulator.result()
+
+
+def analyze_register(shots, coordinates, with_optimum=True):
+    """Analytics of shots measured on a register given by its atom coordinates (grid units)"""
+    return analyze_shots(shots, register_edges(coordinates), optimum_size(coordinates) if with_optimum else None)
+
+
+def analyze_run(stored_run, with_optimum=True):
+    """Analytics of a StoredRun, over the atoms that were measured"""
+    coordinates = np.asarray(stored_run.coordinates)[np.asarray(stored_run.kernel_nodes, dtype=np.int64)]
+    return analyze_register(stored_run.shots, coordinates, with_optimum)
+
+
+def state_distributions(*shot_matrices):
+    """
+    Empirical distributions of several runs of the same register over their common support.
+    Returns a (runs, states) array of probabilities.
+    """
+    n_atoms = shot_matrices[0].n_atoms
+    if any(shots.n_atoms != n_atoms for shots in shot_matrices):
+        raise ValueError("Runs measured on different registers cannot be compared")
+
+    rows = np.concatenate(
+        [np.concatenate([shots.packed_pre, shots.packed_post], axis=1) for shots in shot_matrices]
+    )
+    _, state = np.unique(rows, axis=0, return_inverse=True)
+    state = state.reshape(-1)
+    run = np.repeat(np.arange(len(shot_matrices)), [shots.n_shots for shots in shot_matrices])
+
+    counts = np.zeros((len(shot_matrices), state.max() + 1 if len(state) else 0))
+    np.add.at(counts, (run, state), 1)
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+
+def total_variation_distance(shots_a, shots_b):
+    """Total variation distance between the measured state distributions of two runs (0 to 1)"""
+    distributions = state_distributions(shots_a, shots_b)
+    return float(0.5 * np.abs(distributions[0] - distributions[1]).sum())
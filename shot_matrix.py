@@ -0,0 +1,177 @@
+import base64
+import struct
+from collections import Counter
+
+import numpy as np
+
+
+# Atom states of a shot, as in the state labels: e (empty site), r (Rydberg) or g (ground)
+_STATE_CODES = np.frombuffer(b"erg", dtype=np.uint8)
+
+# n_shots, n_atoms in front of the packed bytes
+_HEADER = struct.Struct('<II')
+
+
+def labels_from_arrays(pre_sequence, post_sequence):
+    """State labels, one letter per atom: e (empty site), r (Rydberg) or g (ground)"""
+    state_idx = np.asarray(pre_sequence, dtype=np.int8) * (1 + np.asarray(post_sequence, dtype=np.int8))
+    if state_idx.ndim != 2 or state_idx.shape[1] == 0:
+        return [""] * (len(state_idx) if state_idx.ndim else 0)
+    # One byte per atom, each row read as a fixed-width string
+    letters = np.ascontiguousarray(_STATE_CODES[state_idx])
+    return letters.view(f"S{letters.shape[1]}").ravel().astype(f"U{letters.shape[1]}").tolist()
+
+
+def arrays_from_labels(state_labels):
+    """
+    Pre and post sequence arrays (shots x atoms) from state labels ('e', 'r', 'g' per atom)
+    An empty site is stored with a zero post sequence
+    """
+    if not state_labels:
+        return np.zeros((0, 0), dtype=np.uint8), np.zeros((0, 0), dtype=np.uint8)
+    letters = np.array([list(label) for label in state_labels])
+    return (letters != "e").astype(np.uint8), (letters == "g").astype(np.uint8)
+
+
+class ShotMatrix:
+    """
+    Shots of a run with the pre and post sequences packed 8 atoms per byte.
+
+    Two bits per atom and shot instead of a Python object per shot or one
+    character per atom in a label, so a run is stored, cached and sent between
+    processes at a fraction of the size. Counting and marginals work on the
+    packed rows and only the distinct states are turned into labels.
+    """
+
+    def __init__(self, packed_pre, packed_post, n_atoms):
+        self.packed_pre = np.ascontiguousarray(packed_pre, dtype=np.uint8)    # (shots, ceil(atoms / 8))
+        self.packed_post = np.ascontiguousarray(packed_post, dtype=np.uint8)
+        self.n_atoms = int(n_atoms)
+
+    @classmethod
+    def from_arrays(cls, pre_sequence, post_sequence):
+        """From (shots, atoms) 0/1 pre and post sequence arrays"""
+        pre_sequence = np.asarray(pre_sequence, dtype=np.uint8)
+        if pre_sequence.ndim != 2:
+            # Only an empty input (no shots) comes without a (shots, atoms) shape
+            pre_sequence = pre_sequence.reshape(0, 0)
+        post_sequence = np.asarray(post_sequence, dtype=np.uint8).reshape(pre_sequence.shape)
+        if pre_sequence.shape[1] == 0:
+            # Shots of an empty register, e.g. a graph solved by the reductions alone
+            empty = np.zeros((len(pre_sequence), 0), dtype=np.uint8)
+            return cls(empty, empty.copy(), 0)
+        return cls(np.packbits(pre_sequence, axis=1), np.packbits(post_sequence, axis=1), pre_sequence.shape[1])
+
+    @classmethod
+    def from_measurements(cls, measurements):
+        """From the measurements of a Braket AHS result"""
+        if not measurements:
+            return cls.from_arrays(np.zeros((0, 0)), np.zeros((0, 0)))
+        return cls.from_arrays(
+            [shot.pre_sequence for shot in measurements],
+            [shot.post_sequence for shot in measurements]
+        )
+
+    @classmethod
+    def from_labels(cls, state_labels):
+        """From state labels ('e', 'r', 'g' per atom)"""
+        return cls.from_arrays(*arrays_from_labels(list(state_labels)))
+
+    @classmethod
+    def concatenate(cls, matrices):
+        """Shots of several matrices of the same register, in order"""
+        matrices = list(matrices)
+        if not matrices:
+            return cls.from_arrays(np.zeros((0, 0)), np.zeros((0, 0)))
+        n_atoms = matrices[0].n_atoms
+        if any(matrix.n_atoms != n_atoms for matrix in matrices):
+            raise ValueError("Shot matrices of different registers cannot be concatenated")
+        return cls(
+            np.concatenate([matrix.packed_pre for matrix in matrices]),
+            np.concatenate([matrix.packed_post for matrix in matrices]),
+            n_atoms
+        )
+
+    @property
+    def n_shots(self):
+        return len(self.packed_pre)
+
+    @property
+    def nbytes(self):
+        return self.packed_pre.nbytes + self.packed_post.nbytes
+
+    def __len__(self):
+        return self.n_shots
+
+    def __getitem__(self, index):
+        """Shots selected by a slice, an index array or a boolean mask, as a ShotMatrix"""
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return ShotMatrix(self.packed_pre[index], self.packed_post[index], self.n_atoms)
+
+    def __eq__(self, other):
+        return (isinstance(other, ShotMatrix) and self.n_atoms == other.n_atoms
+                and np.array_equal(self.packed_pre, other.packed_pre)
+                and np.array_equal(self.packed_post, other.packed_post))
+
+    def __repr__(self):
+        return f"ShotMatrix(shots={self.n_shots}, atoms={self.n_atoms}, nbytes={self.nbytes})"
+
+    def pre_sequence(self):
+        """(shots, atoms) uint8 array, 1 where the site was filled"""
+        return np.unpackbits(self.packed_pre, axis=1, count=self.n_atoms)
+
+    def post_sequence(self):
+        """(shots, atoms) uint8 array, 1 where the atom was measured in the ground state"""
+        return np.unpackbits(self.packed_post, axis=1, count=self.n_atoms)
+
+    def rydberg(self):
+        """(shots, atoms) boolean array, True where the atom was measured in the Rydberg state"""
+        return np.unpackbits(self.packed_pre & ~self.packed_post, axis=1, count=self.n_atoms).astype(bool)
+
+    def state_labels(self):
+        return labels_from_arrays(self.pre_sequence(), self.post_sequence())
+
+    def counts(self):
+        """Counter of state labels, counted on the packed rows"""
+        if self.n_shots == 0:
+            return Counter()
+        rows = np.concatenate([self.packed_pre, self.packed_post], axis=1)
+        distinct, occurrences = np.unique(rows, axis=0, return_counts=True)
+        width = self.packed_pre.shape[1]
+        labels = labels_from_arrays(
+            np.unpackbits(distinct[:, :width], axis=1, count=self.n_atoms),
+            np.unpackbits(distinct[:, width:], axis=1, count=self.n_atoms)
+        )
+        return Counter(dict(zip(labels, occurrences.tolist())))
+
+    def marginals(self):
+        """(atoms, 3) array of the probability of each atom to be measured e, r and g"""
+        if self.n_shots == 0:
+            return np.zeros((self.n_atoms, 3))
+        pre = self.pre_sequence().sum(axis=0)
+        ground = np.unpackbits(self.packed_pre & self.packed_post, axis=1, count=self.n_atoms).sum(axis=0)
+        return np.stack([self.n_shots - pre, pre - ground, ground], axis=1) / self.n_shots
+
+    def rydberg_probability(self):
+        """Probability of each atom to be measured in the Rydberg state"""
+        return self.marginals()[:, 1]
+
+    def to_bytes(self):
+        """Compact serialization: header and packed rows"""
+        return _HEADER.pack(self.n_shots, self.n_atoms) + self.packed_pre.tobytes() + self.packed_post.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        n_shots, n_atoms = _HEADER.unpack_from(data)
+        width = (n_atoms + 7) // 8
+        packed = np.frombuffer(data, dtype=np.uint8, offset=_HEADER.size).reshape(2, n_shots, width)
+        return cls(packed[0], packed[1], n_atoms)
+
+    def to_json(self):
+        """to_bytes as a base64 string, for JSON payloads"""
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_bytes(base64.b64decode(data))
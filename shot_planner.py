@@ -0,0 +1,116 @@
+import logging
+import math
+
+from classical_mis import is_independent_set, solve_mis_exact
+
+
+logger = logging.getLogger('shot_planner')
+
+# Amazon Braket pricing for QuEra Aquila (per task and per shot, USD)
+AQUILA_PRICE_PER_TASK = 0.30
+AQUILA_PRICE_PER_SHOT = 0.01
+
+# Approximate Aquila repetition time per shot (atom loading, evolution and imaging)
+AQUILA_SECONDS_PER_SHOT = 0.3
+
+# Shots range accepted by Aquila for a single task
+AQUILA_MIN_SHOTS = 1
+AQUILA_MAX_SHOTS = 1000
+
+# Aquila per-atom fidelities (QuEra Aquila whitepaper, 2023): a site is filled with
+# probability ~0.993 and an atom is read out in the right state with probability ~0.99
+# in the ground state and ~0.93 in the Rydberg state, ~0.95 on average
+AQUILA_FILLING_FIDELITY = 0.993
+AQUILA_DETECTION_FIDELITY = 0.95
+
+# Fewest shots planned by default. The per-task fee is the price of 30 shots, so
+# smaller tasks save little, while a few shots cannot tell the best state from noise
+PLANNED_MIN_SHOTS = 100
+
+
+class ShotPlan:
+    """Number of QPU shots to request and what they are expected to cost"""
+
+    def __init__(self, shots, success_probability, target_probability, optimum_size):
+        self.shots = shots
+        self.success_probability = success_probability
+        self.target_probability = target_probability
+        self.optimum_size = optimum_size
+        self.estimated_cost = AQUILA_PRICE_PER_TASK + AQUILA_PRICE_PER_SHOT * shots
+        self.estimated_seconds = AQUILA_SECONDS_PER_SHOT * shots
+
+    def __repr__(self):
+        return (f"ShotPlan(shots={self.shots}, success_probability={self.success_probability:.3f}, "
+                f"estimated_cost=${self.estimated_cost:.2f}, estimated_seconds={self.estimated_seconds:.0f})")
+
+
+def best_state_probability(counts, graph, optimum_size=None):
+    """
+    Fraction of shots that measured a maximum independent set of the graph.
+
+    Args:
+        counts: Counter of state labels, one letter per node in sorted node order
+        graph: networkx.Graph the labels were measured on
+        optimum_size: Size of a maximum independent set, computed exactly if None
+
+    Returns:
+        (probability, optimum_size)
+    """
+    if optimum_size is None:
+        optimum_size = len(solve_mis_exact(graph))
+
+    nodes = sorted(graph.nodes)
+    total = sum(counts.values())
+    hits = 0
+    for label, count in counts.items():
+        chosen = [node for node, state in zip(nodes, label) if state == "r"]
+        if len(chosen) == optimum_size and is_independent_set(graph, chosen):
+            hits += count
+
+    return (hits / total if total else 0.0), optimum_size
+
+
+def aquila_shot_fidelity(n_atoms):
+    """Probability that a shot of n_atoms atoms is loaded and read out without any error"""
+    return (AQUILA_FILLING_FIDELITY * AQUILA_DETECTION_FIDELITY) ** n_atoms
+
+
+def plan_qpu_shots(counts, graph, target_probability=0.99, safety_factor=None,
+                   min_shots=PLANNED_MIN_SHOTS, max_shots=AQUILA_MAX_SHOTS):
+    """
+    Estimate the minimum number of QPU shots needed to observe a maximum independent set.
+
+    With a per-shot success probability p measured on the local simulator (or a
+    pilot run), n shots observe at least one optimal state with probability
+    1 - (1 - p)^n, so n = log(1 - target) / log(1 - p). The simulator is noiseless:
+    by default the estimate is divided by the probability that a shot of the
+    register is free of filling and readout errors on Aquila.
+
+    Args:
+        counts: Counter of state labels from the simulator or a pilot run
+        graph: networkx.Graph the labels were measured on
+        target_probability: Required probability of observing an optimal state
+        safety_factor: Multiplier applied to the estimated shot count,
+                       1 / aquila_shot_fidelity(atoms of the graph) if None
+        min_shots: Lower bound on the planned shots
+        max_shots: Upper bound on the planned shots
+
+    Returns:
+        ShotPlan
+    """
+    probability, optimum_size = best_state_probability(counts, graph)
+    if safety_factor is None:
+        safety_factor = 1 / aquila_shot_fidelity(graph.number_of_nodes())
+
+    if probability >= 1.0:
+        shots = 1
+    elif probability <= 0.0:
+        logger.warning("No optimal state observed in the distribution, planning the maximum shots")
+        shots = max_shots
+    else:
+        shots = math.ceil(math.log(1 - target_probability) / math.log(1 - probability))
+
+    shots = min(max(math.ceil(shots * safety_factor), min_shots), max_shots)
+    plan = ShotPlan(shots, probability, target_probability, optimum_size)
+    logger.info(f"QPU shot plan: {plan}")
+    return plan
@@ -0,0 +1,354 @@
+import atexit
+import importlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+logger = logging.getLogger('simulation_worker_pool')
+
+# Modules imported once per worker (or once in the fork server) instead of once per job
+PRELOAD_MODULES = [
+    'numpy',
+    'scipy.sparse',
+    'scipy.sparse.linalg',
+    'networkx',
+    'braket.ahs.atom_arrangement',
+    'braket.ahs.analog_hamiltonian_simulation',
+    'braket.ahs.driving_field',
+    'braket.timings.time_series',
+    'braket.devices',
+    'braket.analog_hamiltonian_simulator.rydberg.rydberg_simulator',
+    'graph_reduction',
+    'hamiltonian_cache',
+]
+
+DEFAULT_WORKERS = 2
+MAX_WORKER_RSS_MB = 2048  # workers exit and are replaced once their peak memory passes this
+MONITOR_INTERVAL_SECONDS = 1.0
+
+# Crashed workers are replaced after an exponential backoff, and not at all after this many
+# crashes in a row without a worker getting ready (e.g. a worker failing at import time)
+CRASH_BACKOFF_SECONDS = 1.0
+MAX_CRASH_BACKOFF_SECONDS = 60.0
+MAX_CONSECUTIVE_CRASHES = 5
+
+
+def _peak_rss_mb():
+    """Peak resident memory of the current process in MB"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _worker_main(worker_id, job_queue, event_queue, preload, max_rss_mb):
+    """Worker loop: preload the heavy modules, then run jobs until told to stop or memory grows too much"""
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            event_queue.put(('log', worker_id, f"Could not preload {module}: {e}"))
+
+    event_queue.put(('ready', worker_id, _peak_rss_mb()))
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        job_id, func, args, kwargs = job
+        try:
+            ok, value = True, func(*args, **kwargs)
+        except Exception as e:
+            ok, value = False, f"{e}\n{traceback.format_exc()}"
+
+        # Announce the retirement together with the result so no new job is sent to this worker
+        peak_rss = _peak_rss_mb()
+        retire = bool(max_rss_mb) and peak_rss > max_rss_mb
+        event_queue.put(('done', worker_id, job_id, ok, value, peak_rss, retire))
+        if retire:
+            break
+
+
+class SimulationWorkerPool:
+    """
+    Pool of long-lived worker processes for local quantum simulations.
+
+    Workers import the Braket simulator stack once and then serve jobs that the
+    pool dispatches to them one at a time, keeping heavy simulations out of the
+    Streamlit process. A worker whose peak memory passes max_rss_mb finishes its
+    current job and is replaced; a worker that dies fails its in-flight job and
+    is replaced after a backoff that grows with each crash in a row, until
+    MAX_CONSECUTIVE_CRASHES crashes stop the replacements.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_rss_mb=MAX_WORKER_RSS_MB, preload=None):
+        self.workers = workers
+        self.max_rss_mb = max_rss_mb
+        self.preload = list(PRELOAD_MODULES if preload is None else preload)
+
+        # Fork server children start from a process that already imported the preload list,
+        # so replacing a recycled worker does not pay the import cost again
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(self.preload)
+        else:
+            self._context = multiprocessing.get_context('spawn')
+
+        self._event_queue = self._context.Queue()
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._worker_ids = itertools.count(1)
+        self._pending = deque()   # jobs waiting for an idle worker
+        self._futures = {}        # job id -> Future, queued or running
+        self._workers = {}        # worker id -> state
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'recycled': 0, 'crashed': 0}
+        self._running = False
+        self._consecutive_crashes = 0
+        self._respawn_after = 0.0   # monotonic time before which crashed workers are not replaced
+        self._broken = None         # reason the workers are no longer replaced
+
+    def start(self):
+        """Start the workers and the background threads that collect results and watch the workers"""
+        with self._lock:
+            if self._running:
+                return self
+            self._running = True
+            for _ in range(self.workers):
+                self._spawn_worker()
+
+        threading.Thread(target=self._collect_events, daemon=True, name='simulation-pool-events').start()
+        threading.Thread(target=self._monitor_workers, daemon=True, name='simulation-pool-monitor').start()
+        logger.info(f"Simulation worker pool started with {self.workers} workers")
+        return self
+
+    def _spawn_worker(self):
+        worker_id = next(self._worker_ids)
+        job_queue = self._context.SimpleQueue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, job_queue, self._event_queue, self.preload, self.max_rss_mb),
+            daemon=True,
+            name=f'simulation-worker-{worker_id}'
+        )
+        process.start()
+        self._workers[worker_id] = {
+            'process': process, 'jobs': job_queue, 'ready': False, 'job': None,
+            'jobs_done': 0, 'peak_rss_mb': 0.0, 'started_at': time.time()
+        }
+
+    def _dispatch(self):
+        """Hand pending jobs to idle workers. Called with the lock held"""
+        for state in self._workers.values():
+            if not state['ready'] or state['job'] is not None or state.get('retiring'):
+                continue
+            while self._pending:
+                job = self._pending.popleft()
+                # Jobs cancelled while they waited are dropped
+                if self._futures[job[0]].set_running_or_notify_cancel():
+                    state['job'] = job[0]
+                    state['jobs'].put(job)
+                    break
+                del self._futures[job[0]]
+            if not self._pending:
+                return
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue a job for the workers.
+
+        Args:
+            func: Module-level (picklable) function to run in a worker
+            *args, **kwargs: Its arguments, which must be picklable too
+
+        Returns:
+            concurrent.futures.Future resolved with the function's return value
+        """
+        if not self._running:
+            self.start()
+
+        future = Future()
+        with self._lock:
+            if self._broken and not self._workers:
+                future.set_exception(RuntimeError(f"Simulation worker pool unavailable: {self._broken}"))
+                return future
+            job_id = next(self._job_ids)
+            self._futures[job_id] = future
+            self._stats['submitted'] += 1
+            self._pending.append((job_id, func, args, kwargs))
+            self._dispatch()
+        return future
+
+    def _finish(self, job_id, ok, value):
+        """Resolve a job's future. Called with the lock held"""
+        future = self._futures.pop(job_id, None)
+        if future is None:
+            return
+        self._stats['completed' if ok else 'failed'] += 1
+        # The caller may have cancelled it while it was still queued
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(f"Simulation job {job_id} failed: {value}"))
+
+    def _collect_events(self):
+        while self._running:
+            try:
+                event = self._event_queue.get(timeout=MONITOR_INTERVAL_SECONDS)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            kind, worker_id = event[0], event[1]
+            with self._lock:
+                state = self._workers.get(worker_id)
+                if kind == 'ready' and state:
+                    state['ready'] = True
+                    self._consecutive_crashes = 0
+                    state['peak_rss_mb'] = event[2]
+                elif kind == 'done':
+                    if state:
+                        state['job'] = None
+                        state['jobs_done'] += 1
+                        state['peak_rss_mb'] = event[5]
+                        state['retiring'] = event[6]
+                    if event[6]:
+                        logger.info(f"Recycling simulation worker {worker_id} at {event[5]:.0f}MB peak memory")
+                    self._finish(event[2], event[3], event[4])
+                elif kind == 'log':
+                    logger.warning(f"Simulation worker {worker_id}: {event[2]}")
+                self._dispatch()
+
+    def _record_crash(self):
+        """Back off the next replacement, or stop replacing workers. Called with the lock held"""
+        self._stats['crashed'] += 1
+        self._consecutive_crashes += 1
+        delay = min(CRASH_BACKOFF_SECONDS * 2 ** (self._consecutive_crashes - 1), MAX_CRASH_BACKOFF_SECONDS)
+        self._respawn_after = max(self._respawn_after, time.monotonic() + delay)
+        if self._consecutive_crashes >= MAX_CONSECUTIVE_CRASHES and self._broken is None:
+            self._broken = f"{self._consecutive_crashes} worker crashes in a row"
+            logger.error(f"Simulation workers are no longer replaced: {self._broken}")
+
+    def _monitor_workers(self):
+        while self._running:
+            time.sleep(MONITOR_INTERVAL_SECONDS)
+            with self._lock:
+                if not self._running:
+                    break
+                for worker_id, state in list(self._workers.items()):
+                    process = state['process']
+                    if process.is_alive():
+                        continue
+                    del self._workers[worker_id]
+                    process.join()
+
+                    # A clean exit is a recycled worker (or a stopped one): it posts the result of
+                    # its last job before exiting, so the event collector resolves that job.
+                    # Anything else lost the job it was running
+                    if process.exitcode == 0:
+                        self._stats['recycled'] += 1
+                    else:
+                        logger.error(f"Simulation worker {worker_id} exited with code {process.exitcode}")
+                        if state['job'] is not None:
+                            self._finish(state['job'], False, f"worker {worker_id} died while running it")
+                        self._record_crash()
+
+                if self._broken is None and time.monotonic() >= self._respawn_after:
+                    for _ in range(self.workers - len(self._workers)):
+                        try:
+                            self._spawn_worker()
+                        except Exception as e:
+                            logger.error(f"Could not start a simulation worker: {str(e)}")
+                            self._record_crash()
+                            break
+                elif self._broken is not None and not self._workers:
+                    # No worker left to run the queued jobs
+                    while self._pending:
+                        self._finish(self._pending.popleft()[0], False, f"pool unavailable: {self._broken}")
+                self._dispatch()
+
+    def status(self):
+        """Health snapshot: per-worker state, queue depth and job counters"""
+        with self._lock:
+            workers = [
+                {
+                    'worker_id': worker_id,
+                    'pid': state['process'].pid,
+                    'alive': state['process'].is_alive(),
+                    'ready': state['ready'],
+                    'current_job': state['job'],
+                    'jobs_done': state['jobs_done'],
+                    'peak_rss_mb': round(state['peak_rss_mb'], 1),
+                    'uptime_seconds': round(time.time() - state['started_at'], 1),
+                }
+                for worker_id, state in self._workers.items()
+            ]
+            queued = len(self._pending)
+            running = sum(1 for state in self._workers.values() if state['job'] is not None)
+            stats = dict(self._stats)
+
+        return {
+            'running': self._running,
+            'healthy': self._running and len(workers) == self.workers and all(w['alive'] for w in workers),
+            'broken': self._broken,
+            'workers': workers,
+            'queued_jobs': queued,
+            'running_jobs': running,
+            **stats,
+        }
+
+    def shutdown(self, wait=True):
+        """Stop the workers after their current job and fail the jobs not started yet"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            workers = list(self._workers.values())
+            self._pending.clear()
+
+        for state in workers:
+            state['jobs'].put(None)
+        if wait:
+            for state in workers:
+                state['process'].join(timeout=30)
+        for state in workers:
+            if state['process'].is_alive():
+                state['process'].terminate()
+
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Simulation worker pool shut down"))
+        logger.info("Simulation worker pool stopped")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_simulation_pool():
+    """Process-wide pool, started on first use and stopped at interpreter exit"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SimulationWorkerPool().start()
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -0,0 +1,212 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger('task_status')
+
+TERMINAL_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+# Poll intervals in seconds
+MIN_POLL_SECONDS = 5
+MAX_POLL_SECONDS = 120
+BACKOFF_FACTOR = 1.5
+SECONDS_PER_TASK_AHEAD = 30  # expected wait added by each task ahead in the device queue
+POLL_JITTER = 0.2            # intervals are spread by +/- 20% so clients do not poll in lockstep
+
+MAX_CACHED_HANDLES = 256
+MAX_CACHED_STATES = 4096
+
+# SearchQuantumTasks accepts at most 10 values per filter
+SEARCH_BATCH_SIZE = 10
+
+
+class TaskState:
+    """Status of a quantum task at the time it was checked"""
+
+    def __init__(self, task_arn, status, queue_position=None, queue_type=None, checked_at=None):
+        self.task_arn = task_arn
+        self.status = status
+        self.queue_position = queue_position  # tasks ahead in the device queue, None when not queued or unknown
+        self.queue_type = queue_type          # 'Normal' or 'Priority'
+        self.checked_at = checked_at or time.time()
+
+    @property
+    def terminal(self):
+        return self.status in TERMINAL_STATES
+
+    def __repr__(self):
+        return (f"TaskState(task_arn='{self.task_arn}', status='{self.status}', "
+                f"queue_position={self.queue_position})")
+
+
+def _parse_queue_position(position):
+    # Braket reports positions beyond 2000 as '>2000'
+    if position in (None, '', 'None'):
+        return None
+    position = str(position)
+    try:
+        return int(position[1:]) + 1 if position.startswith('>') else int(position)
+    except ValueError:
+        return None
+
+
+def poll_interval(status, attempt=0, queue_position=None, device_available=True, rng=random):
+    """
+    Seconds to wait before checking a task again.
+
+    A task queued behind many others is checked less often the further back it
+    is, a running task is checked often so its completion is seen quickly, and
+    nothing is expected to move while the device is unavailable. Without any
+    hint the interval grows exponentially with the attempt number. Every
+    interval gets random jitter.
+    """
+    if status in TERMINAL_STATES:
+        return 0.0
+    if not device_available:
+        interval = MAX_POLL_SECONDS
+    elif status == 'RUNNING':
+        interval = MIN_POLL_SECONDS
+    elif queue_position is not None:
+        interval = MIN_POLL_SECONDS + queue_position * SECONDS_PER_TASK_AHEAD
+    else:
+        interval = MIN_POLL_SECONDS * BACKOFF_FACTOR ** attempt
+    interval = min(max(interval, MIN_POLL_SECONDS), MAX_POLL_SECONDS)
+    return interval * rng.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+class TaskStatusService:
+    """
+    Status checks of Braket quantum tasks with as few API calls as possible.
+
+    Task handles are created once per ARN and kept in an LRU cache, tasks seen
+    in a terminal state are never checked again, callers can accept a state
+    checked recently, and bulk checks search many ARNs per SearchQuantumTasks
+    call instead of one GetQuantumTask per task.
+    """
+
+    def __init__(self, aws_session, max_cached_handles=MAX_CACHED_HANDLES):
+        self.aws_session = aws_session
+        self.max_cached_handles = max_cached_handles
+        self._handles = OrderedDict()
+        self._states = OrderedDict()  # task ARN -> last TaskState
+        self._lock = threading.Lock()
+        self.api_calls = 0
+
+    def handle(self, task_arn):
+        """AwsQuantumTask of task_arn, created on first use"""
+        with self._lock:
+            task = self._handles.get(task_arn)
+            if task is not None:
+                self._handles.move_to_end(task_arn)
+                return task
+
+        from braket.aws import AwsQuantumTask
+
+        task = AwsQuantumTask(task_arn, aws_session=self.aws_session)
+        with self._lock:
+            self._handles[task_arn] = task
+            while len(self._handles) > self.max_cached_handles:
+                self._handles.popitem(last=False)
+        return task
+
+    def _remember(self, state):
+        with self._lock:
+            self._states[state.task_arn] = state
+            self._states.move_to_end(state.task_arn)
+            while len(self._states) > MAX_CACHED_STATES:
+                self._states.popitem(last=False)
+        return state
+
+    def _known_state(self, task_arn, max_age):
+        """Last state of the task if it ended or was checked less than max_age seconds ago"""
+        with self._lock:
+            state = self._states.get(task_arn)
+        if state is not None and (state.terminal or time.time() - state.checked_at < max_age):
+            return state
+        return None
+
+    def status(self, task_arn, max_age=0):
+        """
+        TaskState of one task, with its queue position: one GetQuantumTask call unless
+        the task already ended or was checked less than max_age seconds ago
+        """
+        known = self._known_state(task_arn, max_age)
+        if known is not None:
+            return known
+
+        metadata = self.handle(task_arn).metadata()
+        self.api_calls += 1
+        queue_info = metadata.get('queueInfo') or {}
+        return self._remember(TaskState(
+            task_arn, metadata['status'],
+            queue_position=_parse_queue_position(queue_info.get('position')),
+            queue_type=queue_info.get('queuePriority')
+        ))
+
+    def statuses(self, task_arns, max_age=0):
+        """
+        TaskState of many tasks, SEARCH_BATCH_SIZE ARNs per SearchQuantumTasks call.
+        The search does not report queue positions. Tasks the search does not
+        return are checked one by one.
+        """
+        states = {}
+        pending = []
+        for task_arn in dict.fromkeys(task_arns):
+            known = self._known_state(task_arn, max_age)
+            if known is not None:
+                states[task_arn] = known
+            else:
+                pending.append(task_arn)
+
+        client = self.aws_session.braket_client
+        for start in range(0, len(pending), SEARCH_BATCH_SIZE):
+            batch = pending[start:start + SEARCH_BATCH_SIZE]
+            response = client.search_quantum_tasks(
+                filters=[{'name': 'quantumTaskArn', 'operator': 'EQUAL', 'values': batch}],
+                maxResults=len(batch)
+            )
+            self.api_calls += 1
+            for summary in response.get('quantumTasks', []):
+                states[summary['quantumTaskArn']] = self._remember(
+                    TaskState(summary['quantumTaskArn'], summary['status'])
+                )
+
+        missing = [task_arn for task_arn in pending if task_arn not in states]
+        for task_arn in missing:
+            states[task_arn] = self.status(task_arn)
+        logger.debug(f"Checked {len(pending)} tasks, {len(missing)} of them one by one")
+        return states
+
+    def wait(self, task_arn, timeout=None, device_available=None, on_update=None):
+        """
+        Poll a task until it ends or timeout seconds pass, with adaptive, jittered intervals.
+
+        Args:
+            task_arn: Task to wait for
+            timeout: Seconds to wait at most, None for no limit
+            device_available: Function returning whether the device accepts tasks
+            on_update: Function called with each TaskState
+
+        Returns:
+            Last TaskState
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            state = self.status(task_arn)
+            if on_update is not None:
+                on_update(state)
+            if state.terminal:
+                return state
+            available = device_available() if device_available is not None else True
+            delay = poll_interval(state.status, attempt, state.queue_position, available)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return state
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('temp_cleanup')
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_WORKERS = 4
+
+# Background passes are paced so secure deletion does not starve request I/O
+DEFAULT_MAX_FILES_PER_SECOND = 50
+DEFAULT_MAX_BYTES_PER_SECOND = 50 * 1024 * 1024
+
+
+class CleanupReport:
+    """What one cleanup pass did"""
+
+    def __init__(self):
+        self.files_deleted = 0
+        self.bytes_reclaimed = 0
+        self.files_skipped = 0
+        self.failed = []        # paths whose deletion raised
+        self.remaining = 0      # paths still in the backlog after the pass
+        self.elapsed_seconds = 0.0
+
+    def __repr__(self):
+        return (f"CleanupReport(files_deleted={self.files_deleted}, bytes_reclaimed={self.bytes_reclaimed}, "
+                f"files_skipped={self.files_skipped}, failed={len(self.failed)}, remaining={self.remaining}, "
+                f"elapsed_seconds={self.elapsed_seconds:.2f})")
+
+
+class CleanupEngine:
+    """
+    Deletes files in bounded batches on a thread pool.
+
+    Paths are queued in a backlog and each pass works through as much of it as
+    its file count and time budget allow, so a large cleanup is spread over
+    several passes. Rate limited passes sleep between batches to stay under
+    max_files_per_second and max_bytes_per_second.
+
+    delete_file(path) must return the number of bytes reclaimed, or None when
+    the file was deliberately left in place; an exception counts as a failure.
+    """
+
+    def __init__(self, delete_file, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_WORKERS,
+                 max_files_per_second=DEFAULT_MAX_FILES_PER_SECOND,
+                 max_bytes_per_second=DEFAULT_MAX_BYTES_PER_SECOND):
+        self.delete_file = delete_file
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_files_per_second = max_files_per_second
+        self.max_bytes_per_second = max_bytes_per_second
+
+        self._backlog = deque()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._pass_lock = threading.Lock()  # one pass at a time
+        self.last_report = None
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._backlog)
+
+    def enqueue(self, paths):
+        """Add paths to the backlog, ignoring the ones already queued"""
+        with self._lock:
+            for path in paths:
+                if path not in self._queued:
+                    self._queued.add(path)
+                    self._backlog.append(path)
+
+    def _next_batch(self, limit):
+        with self._lock:
+            batch = []
+            while self._backlog and len(batch) < limit:
+                path = self._backlog.popleft()
+                self._queued.discard(path)
+                batch.append(path)
+            return batch
+
+    def _delete(self, delete_file, path):
+        try:
+            return path, delete_file(path), None
+        except Exception as e:
+            return path, None, e
+
+    def run_pass(self, paths=None, delete_file=None, max_files=None, time_budget=None, rate_limited=True):
+        """
+        Delete files in batches.
+
+        Args:
+            paths: Paths to delete in this pass instead of the backlog (they are not queued)
+            delete_file: Deletion function for this pass, defaults to the engine's
+            max_files: Maximum number of files handled by this pass, None for no limit
+            time_budget: Seconds after which no new batch is started, None for no limit
+            rate_limited: Apply the files and bytes per second caps
+
+        Returns:
+            CleanupReport
+        """
+        delete_file = delete_file or self.delete_file
+        report = CleanupReport()
+        start = time.monotonic()
+
+        if paths is not None:
+            pending = deque(paths)
+
+            def next_batch(limit):
+                return [pending.popleft() for _ in range(min(limit, len(pending)))]
+        else:
+            pending = None
+            next_batch = self._next_batch
+
+        with self._pass_lock, ThreadPoolExecutor(max_workers=self.max_workers,
+                                                 thread_name_prefix='temp-cleanup') as executor:
+            handled = 0
+            while max_files is None or handled < max_files:
+                if time_budget is not None and time.monotonic() - start >= time_budget:
+                    break
+                limit = self.batch_size if max_files is None else min(self.batch_size, max_files - handled)
+                batch = next_batch(limit)
+                if not batch:
+                    break
+                handled += len(batch)
+
+                for path, reclaimed, error in executor.map(lambda p: self._delete(delete_file, p), batch):
+                    if error is not None:
+                        logger.error(f"Error deleting {path}: {str(error)}")
+                        report.failed.append(path)
+                    elif reclaimed is None:
+                        report.files_skipped += 1
+                    else:
+                        report.files_deleted += 1
+                        report.bytes_reclaimed += reclaimed
+
+                if rate_limited:
+                    # Sleep until the work done so far fits under both caps
+                    target = 0.0
+                    if self.max_files_per_second:
+                        target = max(target, (report.files_deleted + report.files_skipped) / self.max_files_per_second)
+                    if self.max_bytes_per_second:
+                        target = max(target, report.bytes_reclaimed / self.max_bytes_per_second)
+                    delay = target - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+
+        report.remaining = len(pending) if pending is not None else self.pending
+        report.elapsed_seconds = time.monotonic() - start
+        self.last_report = report
+        logger.info(f"Cleanup pass: {report}")
+        return report
@@ -0,0 +1,29 @@
+import os
+import sys
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import RateLimitDecision
+
+
+class StubLimiter:
+    """Quantum rate limiter allowing a fixed number of tokens, recording who asked and for how many"""
+
+    max_calls = 5
+    global_max_calls = 20
+    time_frame = 3600
+
+    def __init__(self, allowed_calls):
+        self.allowed_calls = allowed_calls
+        self.used = 0
+        self.keys = []
+        self.costs = []
+
+    def acquire(self, key, cost=1):
+        allowed = self.used + cost <= self.allowed_calls
+        if allowed:
+            self.used += cost
+        self.keys.append(key)
+        self.costs.append(cost)
+        return RateLimitDecision(allowed, 0.0 if allowed else 60.0, 0, 0)
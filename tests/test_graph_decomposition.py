@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import graph_decomposition
+import rate_limiter
+from classical_mis import solve_mis_exact
+from graph_decomposition import count_pieces, solve_mis_decomposed
+from graph_reduction import graph_from_coordinates
+
+from conftest import StubLimiter
+
+
+# A 3 x 8 grid of atoms, split along its columns into several pieces
+GRID = [(x, y) for x in range(8) for y in range(3)]
+
+
+@pytest.fixture
+def counting_qpu_solver(monkeypatch):
+    """QPU piece solver solving exactly on the CPU, recording the pieces and their reservation"""
+    calls = []
+    lock = threading.Lock()
+
+    def solver(graph, mode, user_id, reserved):
+        with lock:
+            calls.append((frozenset(graph.nodes), user_id, reserved))
+        return solve_mis_exact(graph)
+
+    monkeypatch.setattr(graph_decomposition, 'quantum_piece_solver', solver)
+    return calls
+
+
+def test_qpu_tokens_of_every_piece_are_reserved_at_once(counting_qpu_solver, monkeypatch):
+    graph = graph_from_coordinates(GRID)
+    pieces = count_pieces(graph, max_piece_size=6)
+    limiter = StubLimiter(allowed_calls=pieces)
+    limiter.max_calls = limiter.global_max_calls = pieces
+    monkeypatch.setattr(rate_limiter, 'get_quantum_limiter', lambda: limiter)
+
+    solution = solve_mis_decomposed(graph, solver='QuEra', max_piece_size=6, user_id='user-a')
+
+    assert limiter.keys == ['user-a'] and limiter.costs == [pieces]
+    # Every distinct piece runs once, on the reserved tokens
+    assert len(counting_qpu_solver) == len({piece for piece, _, _ in counting_qpu_solver}) == pieces
+    assert all(reserved and user_id == 'user-a' for _, user_id, reserved in counting_qpu_solver)
+    assert len(solution) == len(solve_mis_exact(graph))
+
+
+def test_graph_needing_more_qpu_runs_than_the_quota_is_refused_up_front(counting_qpu_solver, monkeypatch):
+    graph = graph_from_coordinates(GRID)
+    pieces = count_pieces(graph, max_piece_size=6)
+    assert pieces > StubLimiter.max_calls
+    limiter = StubLimiter(allowed_calls=100)
+    monkeypatch.setattr(rate_limiter, 'get_quantum_limiter', lambda: limiter)
+
+    with pytest.raises(RuntimeError, match=f"{pieces} QPU submissions exceed the quantum rate limit"):
+        solve_mis_decomposed(graph, solver='QuEra', max_piece_size=6)
+    assert limiter.costs == [] and counting_qpu_solver == []
+
+
+def test_refused_reservation_runs_nothing(counting_qpu_solver, monkeypatch):
+    # A 3 x 3 grid, split into no more pieces than the per-user quota
+    graph = graph_from_coordinates(GRID[:9])
+    pieces = count_pieces(graph, max_piece_size=6)
+    assert 1 < pieces <= StubLimiter.max_calls
+    limiter = StubLimiter(allowed_calls=pieces - 1)
+    monkeypatch.setattr(rate_limiter, 'get_quantum_limiter', lambda: limiter)
+
+    with pytest.raises(RuntimeError, match="Rate limit exceeded"):
+        solve_mis_decomposed(graph, solver='QuEra', max_piece_size=6)
+    assert counting_qpu_solver == []
@@ -0,0 +1,86 @@
+import json
+import random
+
+import networkx as nx
+import pytest
+
+from classical_mis import is_independent_set, solve_mis_exact
+from graph_reduction import GraphReduction, graph_from_coordinates, kernelize
+
+
+def random_unit_disk_graph(seed):
+    rng = random.Random(seed)
+    coordinates = [(rng.uniform(0, 4), rng.uniform(0, 4)) for _ in range(rng.randint(5, 18))]
+    return graph_from_coordinates(coordinates, radius=1.5)
+
+
+def lifted_kernel_mis(reduction):
+    return reduction.lift(solve_mis_exact(reduction.kernel))
+
+
+def assert_lift_is_maximum(graph, reduction):
+    solution = lifted_kernel_mis(reduction)
+    assert is_independent_set(graph, solution)
+    assert len(solution) == len(solve_mis_exact(graph))
+    assert len(solution) == len(solve_mis_exact(reduction.kernel)) + reduction.offset
+
+
+@pytest.mark.parametrize('allow_folding', [True, False])
+@pytest.mark.parametrize('seed', range(40))
+def test_lifted_kernel_mis_is_maximum_on_unit_disk_graphs(seed, allow_folding):
+    graph = random_unit_disk_graph(seed)
+    reduction = kernelize(graph, allow_folding=allow_folding)
+
+    assert_lift_is_maximum(graph, reduction)
+    if not allow_folding:
+        # Only deletions: the kernel keeps the atom positions of the graph
+        assert set(reduction.kernel.nodes) <= set(graph.nodes)
+
+
+def test_lifted_kernel_mis_is_maximum_through_fold_and_twin_reductions():
+    kinds = set()
+    # Cubic graphs leave no pendant vertices, the degree-2 fold and the twin rules do the work
+    for seed in range(60):
+        graph = nx.random_regular_graph(3, 10, seed=seed)
+        reduction = kernelize(graph)
+        kinds.update(step[0] for step in reduction.steps)
+        assert_lift_is_maximum(graph, reduction)
+    assert {'fold', 'twin'} <= kinds
+
+
+def test_fold_of_a_five_cycle():
+    graph = nx.cycle_graph(5)
+    reduction = kernelize(graph)
+
+    assert reduction.steps[0][0] == 'fold'
+    assert reduction.kernel.number_of_nodes() == 0
+    assert_lift_is_maximum(graph, reduction)
+
+
+def test_fold_labels_do_not_depend_on_earlier_reductions():
+    graph = nx.random_regular_graph(3, 10, seed=3)
+    first = kernelize(graph)
+    kernelize(nx.cycle_graph(7))
+    second = kernelize(graph)
+
+    assert first.steps == second.steps
+    assert set(first.kernel.nodes) == set(second.kernel.nodes)
+
+
+def test_folded_vertices_of_the_input_keep_their_labels():
+    # A five cycle holding a vertex folded by an earlier reduction, as when kernelizing part of a kernel
+    graph = nx.relabel_nodes(nx.cycle_graph(5), {0: ('fold', 1)})
+    reduction = kernelize(graph)
+
+    created = {step[-1] for step in reduction.steps if step[0] in ('fold', 'twin')}
+    assert created and ('fold', 1) not in created
+    assert_lift_is_maximum(graph, reduction)
+
+
+def test_reduction_survives_json():
+    graph = random_unit_disk_graph(7)
+    reduction = kernelize(graph)
+    restored = GraphReduction.from_dict(json.loads(json.dumps(reduction.to_dict())))
+
+    kernel_solution = solve_mis_exact(reduction.kernel)
+    assert restored.lift(kernel_solution) == reduction.lift(kernel_solution)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from braket.ahs.analog_hamiltonian_simulation import AnalogHamiltonianSimulation
+from braket.ahs.atom_arrangement import AtomArrangement
+
+from hamiltonian_cache import simulate
+from Quantum_API import create_driving_field, get_local_simulator
+from shot_analytics import total_variation_distance
+from shot_matrix import ShotMatrix
+
+
+LATTICE_CONSTANT = 7e-6
+SHOTS = 4000
+# Sampling noise of two 4000 shot runs over a few dozen states stays around 0.02
+MAX_DISTANCE = 0.06
+
+
+@pytest.mark.parametrize('grid', [
+    [(0, 0), (1, 0), (2, 0)],
+    [(0, 0), (1, 0), (1, 1), (0, 1)],
+    [(0, 0), (1, 0), (2, 0), (2, 1), (3, 1)],
+], ids=['line', 'square', 'tail'])
+def test_cached_simulation_matches_braket_local_simulator(grid):
+    coordinates = [(x * LATTICE_CONSTANT, y * LATTICE_CONSTANT) for x, y in grid]
+    drive = create_driving_field()
+
+    atoms = AtomArrangement()
+    for coordinate in coordinates:
+        atoms.add(np.array(coordinate))
+    program = AnalogHamiltonianSimulation(register=atoms, hamiltonian=drive)
+    braket_shots = ShotMatrix.from_measurements(get_local_simulator().run(program, shots=SHOTS).result().measurements)
+
+    cached_shots = simulate(coordinates, drive, seed=1).sample_shots(SHOTS)
+
+    assert total_variation_distance(braket_shots, cached_shots) < MAX_DISTANCE
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import Quantum_API
+import quantum_backends
+import rate_limiter
+import run_store
+from graph_decomposition import quantum_piece_solver
+from graph_reduction import graph_from_coordinates
+from local_device import LocalStandInDevice
+from qpu_job_queue import QPUJobQueue
+
+from conftest import StubLimiter
+
+
+# A ring of 8 atoms with a tail: the reductions take the pendant atom (9) and drop its neighbour (8),
+# the ring is left for the device
+NODES = [(0, 0), (1, 0), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1), (3, 1), (4, 1)]
+
+
+def encode_result(result):
+    return Quantum_API.ShotMatrix.from_measurements(result.measurements).to_json()
+
+
+class CountingDevice(LocalStandInDevice):
+    """Stand-in device counting the tasks it was asked to run"""
+
+    def __init__(self, fail=False):
+        super().__init__()
+        self.runs = 0
+        self.fail = fail
+        self._runs_lock = threading.Lock()
+
+    def run(self, program, shots):
+        with self._runs_lock:
+            self.runs += 1
+        if self.fail:
+            raise RuntimeError("program rejected")
+        return super().run(program, shots)
+
+
+@pytest.fixture
+def stand_in_queue(tmp_path, monkeypatch):
+    monkeypatch.setenv('qpu_stand_in', 'true')
+    monkeypatch.setenv('qpu_queue_dir', str(tmp_path / 'qpu_queue'))
+    monkeypatch.setenv('run_store_dir', str(tmp_path / 'run_store'))
+    monkeypatch.setattr(Quantum_API, '_qpu_queue', None)
+    monkeypatch.setattr(run_store, '_store', None)
+
+    queue = Quantum_API.get_qpu_queue()
+    # Scheduling passes are driven by wait() instead of the background thread
+    queue.stop()
+    yield queue
+    queue.device._executor.shutdown(wait=True)
+
+
+def program(shots=50):
+    ahs_program, _, _, _ = Quantum_API.build_kernel_program(NODES)
+    return ahs_program, shots
+
+
+def test_submit_deduplicate_poll_and_lift(stand_in_queue):
+    first = Quantum_API.quantum_queue_submit(str(NODES), 'user-a', shots=50)
+    second = Quantum_API.quantum_queue_submit(str(NODES), 'user-b', shots=50)
+
+    status = Quantum_API.quantum_queue_status(second)
+    assert status['job_id'] == Quantum_API.quantum_queue_status(first)['job_id']
+    assert status['status'] == 'queued'
+    assert status['shared_with'] == 1
+
+    assert stand_in_queue.wait(first, timeout=120)['status'] == 'completed'
+    task_arn = Quantum_API.quantum_queue_status(second)['task_arn']
+    assert task_arn is not None
+
+    for request_id in (first, second):
+        ((label, count),) = Quantum_API.quantum_queue_get_result(request_id)
+        assert len(label) == len(NODES)
+        # Lifted through the reduction: the pendant atom is in the set, its neighbour is not
+        assert label[9] == 'r' and label[8] == 'g'
+        assert 0 < count <= 50
+
+    # One task for both requests, stored once
+    assert len(run_store.get_run_store().find_runs(task_arn=task_arn)) == 1
+
+
+def test_request_context_is_stored_as_json(stand_in_queue, tmp_path):
+    request_id = Quantum_API.quantum_queue_submit(str(NODES), 'user-a', shots=50)
+
+    db = sqlite3.connect(str(tmp_path / 'qpu_queue' / 'queue.sqlite3'))
+    (context,) = db.execute("SELECT context FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+    context = json.loads(context)
+    assert context['kernel_nodes'] == list(range(8))
+    assert context['reduction']['steps'][0] == ['include', 9]
+
+
+def test_queues_sharing_a_database_submit_a_job_once(tmp_path):
+    device = CountingDevice()
+    db_path = str(tmp_path / 'queue.sqlite3')
+    queues = [QPUJobQueue(device, encode_result, db_path=db_path) for _ in range(2)]
+
+    ahs_program, shots = program()
+    request_id = queues[0].submit('user-a', ahs_program, shots)
+    queues[1].submit('user-b', ahs_program, shots)
+
+    barrier = threading.Barrier(len(queues))
+
+    def pump(queue):
+        barrier.wait()
+        queue.pump()
+
+    threads = [threading.Thread(target=pump, args=(queue,)) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert device.runs == 1
+    assert queues[1].wait(request_id, timeout=120)['status'] == 'completed'
+    device._executor.shutdown(wait=True)
+
+
+def test_resubmitting_a_failed_program_keeps_the_failed_request(tmp_path):
+    device = CountingDevice(fail=True)
+    queue = QPUJobQueue(device, encode_result, db_path=str(tmp_path / 'queue.sqlite3'))
+    ahs_program, shots = program()
+
+    failed = queue.submit('user-a', ahs_program, shots)
+    assert queue.wait(failed, timeout=10)['status'] == 'failed'
+
+    retried = queue.submit('user-a', ahs_program, shots)
+    assert queue.request_status(retried)['status'] == 'queued'
+    # The earlier request still reports its own run
+    failed_status = queue.request_status(failed)
+    assert failed_status['status'] == 'failed'
+    assert 'program rejected' in failed_status['error']
+    assert failed_status['job_id'] != queue.request_status(retried)['job_id']
+
+
+def test_aquila_backend_runs_through_the_queue_and_rate_limit(stand_in_queue, monkeypatch, tmp_path):
+    limiter = StubLimiter(allowed_calls=1)
+    monkeypatch.setattr(rate_limiter, 'get_quantum_limiter', lambda: limiter)
+    monkeypatch.setattr(quantum_backends, 'quantum_queue_poll_interval', lambda request_state, attempt: 0.05)
+    backend = quantum_backends.get_backend('aquila', user_id='user-a')
+
+    async def run():
+        request_id = await backend.submit(NODES, shots=50)
+        # Both wait on the same request: the queue pass runs the job, the backend polls it
+        result, _ = await asyncio.gather(
+            backend.result(request_id), asyncio.to_thread(stand_in_queue.wait, request_id, 120)
+        )
+        return request_id, result
+
+    request_id, result = asyncio.run(run())
+    assert limiter.keys == ['user-a']
+    assert Quantum_API.quantum_queue_status(request_id)['status'] == 'completed'
+    assert result.task_id == Quantum_API.quantum_queue_status(request_id)['task_arn']
+    assert result.n_shots == 50
+    assert all(label[9] == 'r' and label[8] == 'g' for label in result.counts)
+
+    # Out of quota: refused before anything is queued
+    with pytest.raises(RuntimeError, match="Rate limit exceeded"):
+        asyncio.run(backend.submit(NODES, shots=50))
+    db = sqlite3.connect(str(tmp_path / 'qpu_queue' / 'queue.sqlite3'))
+    assert db.execute("SELECT COUNT(*) FROM requests").fetchone() == (1,)
+
+
+def pump_instead_of_sleeping(queue):
+    """quantum_queue_poll_interval stand-in running a scheduling pass and polling again right away"""
+    def poll_interval(request_state, attempt):
+        queue.pump()
+        return 0.05
+    return poll_interval
+
+
+def test_decomposed_qpu_piece_runs_through_the_queue(stand_in_queue, monkeypatch):
+    limiter = StubLimiter(allowed_calls=1)
+    monkeypatch.setattr(rate_limiter, 'get_quantum_limiter', lambda: limiter)
+    monkeypatch.setattr(Quantum_API, 'quantum_queue_poll_interval', pump_instead_of_sleeping(stand_in_queue))
+    graph = graph_from_coordinates(NODES)
+
+    solution = quantum_piece_solver(graph, mode='QuEra', max_attempts=2400, user_id='user-a')
+
+    assert limiter.keys == ['user-a']
+    assert all(not graph.has_edge(u, v) for u in solution for v in solution)
+    # Lifted through the reduction of the queued request
+    assert 9 in solution and 8 not in solution
+
+
+def test_failed_qpu_piece_raises(stand_in_queue, monkeypatch):
+    def reject(program, shots):
+        raise RuntimeError("program rejected")
+
+    monkeypatch.setattr(rate_limiter, 'get_quantum_limiter', lambda: StubLimiter(allowed_calls=1))
+    monkeypatch.setattr(Quantum_API, 'quantum_queue_poll_interval', pump_instead_of_sleeping(stand_in_queue))
+    monkeypatch.setattr(stand_in_queue.device, 'run', reject)
+
+    with pytest.raises(RuntimeError, match="program rejected"):
+        quantum_piece_solver(graph_from_coordinates(NODES), mode='QuEra', max_attempts=100)
+
+
+def test_status_is_answered_while_a_submission_is_in_progress(tmp_path):
+    submitting = threading.Event()
+    release = threading.Event()
+
+    class SlowDevice(LocalStandInDevice):
+        def run(self, program, shots):
+            submitting.set()
+            release.wait(30)
+            return super().run(program, shots)
+
+    device = SlowDevice()
+    queue = QPUJobQueue(device, encode_result, db_path=str(tmp_path / 'queue.sqlite3'))
+    ahs_program, shots = program()
+    request_id = queue.submit('user-a', ahs_program, shots)
+
+    pump = threading.Thread(target=queue.pump)
+    pump.start()
+    try:
+        assert submitting.wait(30)
+        answered = []
+        status = threading.Thread(target=lambda: answered.append(queue.request_status(request_id)))
+        status.start()
+        status.join(timeout=5)
+        assert answered and answered[0]['status'] == 'submitting'
+    finally:
+        release.set()
+        pump.join()
+    assert queue.wait(request_id, timeout=120)['status'] == 'completed'
+    device._executor.shutdown(wait=True)
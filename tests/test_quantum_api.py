@@ -0,0 +1,42 @@
+import pytest
+
+import Quantum_API
+from Quantum_API import quantum_packed_execute, quantum_simulator_execute
+from register_packing import pack_registers
+
+
+@pytest.mark.parametrize('mode', ['simulator', 'emulator'])
+def test_empty_graph_without_reductions(mode):
+    assert quantum_simulator_execute("[]", mode, reduce_graph=False, shots=10) == [("", 10)]
+
+
+def test_packed_empty_graphs_without_reductions():
+    assert quantum_packed_execute(["[]", "[]"], 'simulator', reduce_graph=False, shots=10) == [[("", 10)], [("", 10)]]
+
+
+def test_graph_solved_by_the_reductions():
+    # A path of three atoms: both ends are in the set, the middle one is not
+    assert quantum_simulator_execute("[(0, 0), (1, 0), (2, 0)]", 'simulator', shots=10) == [("rgr", 10)]
+
+
+# Four atoms on a square, kept whole with reduce_graph=False
+SQUARE = "[(0, 0), (1, 0), (1, 1), (0, 1)]"
+
+
+def test_packed_simulation_runs_one_copy_by_default(monkeypatch):
+    packed_registers = []
+
+    def record_packing(*args, **kwargs):
+        packed_registers.append(pack_registers(*args, **kwargs))
+        return packed_registers[-1]
+
+    monkeypatch.setattr(Quantum_API, 'pack_registers', record_packing)
+    ((label, count),) = quantum_packed_execute([SQUARE], 'simulator', reduce_graph=False, shots=20)[0]
+
+    assert len(packed_registers[0].coordinates) == 4
+    assert len(label) == 4 and 0 < count <= 20
+
+
+def test_packed_register_too_large_for_the_simulator():
+    with pytest.raises(ValueError, match="too large for the local simulator"):
+        quantum_packed_execute([SQUARE], 'simulator', copies=4, reduce_graph=False, shots=20)
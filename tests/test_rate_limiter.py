@@ -0,0 +1,132 @@
+import multiprocessing
+
+import pytest
+
+from rate_limiter import TokenBucketLimiter, client_identity
+
+
+class Clock:
+    """Manually advanced time source"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'rate_limits.sqlite3')
+
+
+def test_exhaustion_and_refill(db_path, clock):
+    # 3 calls per minute: one token every 20 seconds
+    limiter = TokenBucketLimiter('test', max_calls=3, time_frame=60, db_path=db_path, clock=clock)
+
+    assert [limiter.acquire('user-a').allowed for _ in range(4)] == [True, True, True, False]
+    refused = limiter.acquire('user-a')
+    assert refused.wait_seconds == pytest.approx(20)
+
+    clock.advance(19)
+    assert not limiter.acquire('user-a').allowed
+    clock.advance(1)
+    assert limiter.acquire('user-a').allowed
+    assert not limiter.acquire('user-a').allowed
+
+    # A bucket never holds more than max_calls tokens, however long it was idle
+    clock.advance(3600)
+    assert limiter.status('user-a').user_remaining == 3
+
+
+def test_users_have_separate_buckets(db_path, clock):
+    limiter = TokenBucketLimiter('test', max_calls=1, time_frame=60, db_path=db_path, clock=clock)
+
+    assert limiter.acquire('user-a').allowed
+    assert not limiter.acquire('user-a').allowed
+    assert limiter.acquire('user-b').allowed
+
+
+def test_global_cap(db_path, clock):
+    limiter = TokenBucketLimiter('test', max_calls=2, time_frame=60, global_max_calls=3, db_path=db_path,
+                                 clock=clock)
+
+    assert limiter.acquire('user-a').allowed
+    assert limiter.acquire('user-a').allowed
+    assert limiter.acquire('user-b').allowed
+    # user-b still has a token of its own, the global bucket is empty
+    refused = limiter.acquire('user-b')
+    assert not refused.allowed and refused.user_remaining == 1 and refused.global_remaining == 0
+    assert refused.wait_seconds == pytest.approx(20)
+
+    clock.advance(20)
+    assert limiter.acquire('user-c').allowed
+    assert not limiter.acquire('user-d').allowed
+
+
+def test_cost_takes_every_token_or_none(db_path, clock):
+    limiter = TokenBucketLimiter('test', max_calls=5, time_frame=3600, db_path=db_path, clock=clock)
+
+    assert not limiter.acquire('user-a', cost=6).allowed
+    assert limiter.status('user-a').user_remaining == 5
+    assert limiter.acquire('user-a', cost=4).allowed
+    assert not limiter.acquire('user-a', cost=2).allowed
+    assert limiter.acquire('user-a').allowed
+
+
+def test_limiters_sharing_a_database_share_the_buckets(db_path, clock):
+    first = TokenBucketLimiter('test', max_calls=2, time_frame=60, db_path=db_path, clock=clock)
+    second = TokenBucketLimiter('test', max_calls=2, time_frame=60, db_path=db_path, clock=clock)
+    other = TokenBucketLimiter('other', max_calls=2, time_frame=60, db_path=db_path, clock=clock)
+
+    assert first.acquire('user-a').allowed
+    assert second.acquire('user-a').allowed
+    assert not first.acquire('user-a').allowed
+    # Limiters with another name have their own buckets
+    assert other.acquire('user-a').allowed
+
+
+def acquire_in_process(db_path, calls, allowed):
+    # One hour per token: nothing refills while the processes run
+    limiter = TokenBucketLimiter('test', max_calls=10, time_frame=36000, db_path=db_path)
+    allowed.put(sum(limiter.acquire('user-a').allowed for _ in range(calls)))
+
+
+def test_concurrent_processes_never_exceed_the_bucket(db_path):
+    context = multiprocessing.get_context('spawn')
+    allowed = context.Queue()
+    processes = [context.Process(target=acquire_in_process, args=(db_path, 8, allowed)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+
+    assert sum(allowed.get(timeout=10) for _ in processes) == 10
+
+
+@pytest.mark.parametrize('kwargs, headers, hops, expected', [
+    ({'user_id': 'alice', 'ip_address': '10.0.0.1'}, None, '0', 'user:alice'),
+    ({'ip_address': '10.0.0.1'}, None, '0', 'ip:10.0.0.1'),
+    ({}, None, '0', 'session:session-1'),
+    # Without trusted proxies the header, which clients can set, is ignored
+    ({'ip_address': '10.0.0.1'}, {'X-Forwarded-For': '1.2.3.4'}, '0', 'ip:10.0.0.1'),
+    # Behind one proxy the last entry, added by the proxy, is the client
+    ({'ip_address': '10.0.0.1'}, {'X-Forwarded-For': '6.6.6.6, 1.2.3.4'}, '1', 'ip:1.2.3.4'),
+    ({'ip_address': '10.0.0.1'}, {'X-Forwarded-For': '6.6.6.6, 1.2.3.4, 10.0.0.2'}, '2', 'ip:1.2.3.4'),
+], ids=['user', 'address', 'session', 'untrusted-header', 'one-proxy', 'two-proxies'])
+def test_client_identity(monkeypatch, kwargs, headers, hops, expected):
+    monkeypatch.setenv('trusted_proxy_hops', hops)
+    assert client_identity('session-1', headers=headers, **kwargs) == expected
+
+
+def test_new_sessions_of_a_client_share_its_identity(monkeypatch):
+    monkeypatch.setenv('trusted_proxy_hops', '0')
+    assert client_identity('session-1', ip_address='10.0.0.1') == client_identity('session-2', ip_address='10.0.0.1')
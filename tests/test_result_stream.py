@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from result_stream import ingest_result_file, write_result_file
+from shot_matrix import ShotMatrix
+
+
+N_SHOTS = 3000
+N_ATOMS = 13
+FAILED_SHOTS = 7
+
+
+@pytest.fixture
+def shots():
+    rng = np.random.default_rng(7)
+    pre = (rng.random((N_SHOTS, N_ATOMS)) < 0.97).astype(np.uint8)
+    # Few distinct states, as in a real run, and nothing measured on empty sites
+    post = rng.integers(0, 2, size=(40, N_ATOMS), dtype=np.uint8)[rng.integers(0, 40, size=N_SHOTS)] & pre
+    return ShotMatrix.from_arrays(pre, post)
+
+
+@pytest.fixture
+def result_file(tmp_path, shots):
+    path = tmp_path / 'results.json'
+    write_result_file(path, shots, failed_shots=FAILED_SHOTS)
+    return path
+
+
+def test_written_file_follows_the_braket_schema(result_file):
+    from braket.task_result import AnalogHamiltonianSimulationTaskResult
+
+    result = AnalogHamiltonianSimulationTaskResult.parse_file(result_file)
+    assert len(result.measurements) == N_SHOTS + FAILED_SHOTS
+
+
+@pytest.mark.parametrize('chunk_size, batch_size', [(777, 500), (64, 1), (1 << 20, 10000)])
+def test_streamed_counts_match_in_memory_counts(result_file, shots, chunk_size, batch_size):
+    ingested = ingest_result_file(result_file, keep_shots=True, chunk_size=chunk_size, batch_size=batch_size)
+
+    assert ingested.counts == shots.counts()
+    assert ingested.n_shots == N_SHOTS
+    assert ingested.failed_shots == FAILED_SHOTS
+    assert ingested.shots == shots
+
+
+def test_streamed_analytics_do_not_depend_on_the_chunking(result_file):
+    edges = np.array([(i, i + 1) for i in range(N_ATOMS - 1)])
+    small = ingest_result_file(result_file, edges=edges, optimum=7, chunk_size=777, batch_size=500).analytics
+    whole = ingest_result_file(result_file, edges=edges, optimum=7, batch_size=N_SHOTS).analytics
+
+    assert small.as_dict() == pytest.approx(whole.as_dict())
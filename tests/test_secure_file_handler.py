@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import secure_file_handler
+from file_metadata_index import FileMetadataIndex
+from secure_file_handler import SecureFile, cleanup_old_files
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Secure file storage in a private temporary directory with its own index"""
+    storage_dir = tmp_path / 'files'
+    storage_dir.mkdir(mode=0o700)
+    monkeypatch.setattr(secure_file_handler, 'TEMP_DIR', str(storage_dir))
+    monkeypatch.setattr(secure_file_handler, 'file_metadata',
+                        FileMetadataIndex(str(tmp_path / 'index.sqlite3'), str(storage_dir)))
+    return storage_dir
+
+
+def stored_file(data=b'stored bytes', owner='session-a'):
+    secure_file = SecureFile(file_data=data, file_type='bin', owner=owner)
+    assert secure_file.save_to_disk()
+    return secure_file
+
+
+def test_delete_removes_the_file_and_its_metadata(storage):
+    secure_file = stored_file()
+
+    assert secure_file.delete() == len(b'stored bytes')
+    assert os.listdir(storage) == []
+    assert len(secure_file_handler.file_metadata) == 0
+
+
+def test_failed_delete_is_retried_by_the_next_cleanup(storage, monkeypatch):
+    secure_file = stored_file()
+    real_remove = os.remove
+
+    def failing_remove(path):
+        raise PermissionError(f"cannot remove {path}")
+
+    monkeypatch.setattr(secure_file_handler.os, 'remove', failing_remove)
+    assert secure_file.delete() is None
+
+    # The renamed file is still on disk and still tracked
+    (leftover,) = os.listdir(storage)
+    assert leftover.endswith('.deleting')
+    assert str(storage / leftover) in secure_file_handler.file_metadata
+
+    monkeypatch.setattr(secure_file_handler.os, 'remove', real_remove)
+    report = cleanup_old_files()
+
+    assert report.files_deleted == 1
+    assert os.listdir(storage) == []
+    assert len(secure_file_handler.file_metadata) == 0
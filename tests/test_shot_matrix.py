@@ -0,0 +1,54 @@
+import io
+import json
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from result_stream import ingest_result_stream
+from shot_matrix import ShotMatrix
+
+
+@pytest.mark.parametrize('matrix', [
+    ShotMatrix.from_measurements([]),
+    ShotMatrix.concatenate([]),
+    ShotMatrix.from_labels([]),
+    ShotMatrix.from_arrays(np.zeros((0, 0)), np.zeros((0, 0))),
+    ShotMatrix.from_arrays([], []),
+], ids=['measurements', 'concatenate', 'labels', 'arrays', 'lists'])
+def test_no_shots(matrix):
+    assert matrix.n_shots == 0
+    assert matrix.n_atoms == 0
+    assert matrix.counts() == Counter()
+    assert matrix.state_labels() == []
+    assert ShotMatrix.from_bytes(matrix.to_bytes()) == matrix
+
+
+def test_shots_of_an_empty_register():
+    matrix = ShotMatrix.from_labels([""] * 3)
+
+    assert matrix.n_shots == 3
+    assert matrix.n_atoms == 0
+    assert matrix.counts() == Counter({"": 3})
+    assert matrix.state_labels() == ["", "", ""]
+    assert ShotMatrix.from_json(matrix.to_json()) == matrix
+    assert ShotMatrix.concatenate([matrix, matrix]).n_shots == 6
+
+
+def test_ingest_result_without_measurements():
+    stream = io.BytesIO(json.dumps({"measurements": []}).encode())
+
+    ingested = ingest_result_stream(stream, keep_shots=True)
+
+    assert ingested.n_shots == 0
+    assert ingested.counts == Counter()
+    assert ingested.shots.n_shots == 0
+
+
+def test_labels_round_trip():
+    labels = ["rgerg", "ggrgr", "rgerg", "eeeee"]
+    matrix = ShotMatrix.from_labels(labels)
+
+    assert matrix.state_labels() == labels
+    assert matrix.counts() == Counter(labels)
+    assert ShotMatrix.from_bytes(matrix.to_bytes()) == matrix
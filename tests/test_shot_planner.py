@@ -0,0 +1,33 @@
+import math
+from collections import Counter
+
+import pytest
+
+from graph_reduction import graph_from_coordinates
+from shot_planner import PLANNED_MIN_SHOTS, aquila_shot_fidelity, plan_qpu_shots
+
+
+# A path of three atoms, whose maximum independent set is both ends ('rgr')
+PATH = graph_from_coordinates([(0, 0), (1, 0), (2, 0)])
+
+
+def test_rare_optimum_is_planned_with_the_noise_margin():
+    # 1% of the noiseless shots are optimal: 459 shots reach 99%, 547 once filling and readout errors count
+    plan = plan_qpu_shots(Counter({'rgr': 1, 'grg': 99}), PATH)
+
+    assert plan.success_probability == pytest.approx(0.01)
+    assert plan.shots == 547
+    assert plan.shots == math.ceil(459 / aquila_shot_fidelity(3))
+
+
+def test_frequent_optimum_is_planned_at_least_the_minimum_shots():
+    counts = Counter({'rgr': 50, 'grg': 30, 'ggg': 20})
+
+    assert plan_qpu_shots(counts, PATH).shots == PLANNED_MIN_SHOTS == 100
+    # The noiseless estimate alone would be a 7 shot task
+    assert plan_qpu_shots(counts, PATH, safety_factor=1.0, min_shots=1).shots == 7
+
+
+def test_larger_registers_get_a_larger_margin():
+    assert aquila_shot_fidelity(0) == 1.0
+    assert aquila_shot_fidelity(10) < aquila_shot_fidelity(3) < 1.0